@@ -0,0 +1,193 @@
+# Rules for user accounts, and bulk provisioning.
+#
+#     python accounts.py students.csv --workers 4 --rejects rejects.csv
+#
+# main.add_user and the sign-up prompts check one user with the compiled
+# patterns below. provision_users takes a whole file of name, email,
+# password and optional role columns (CSV or JSON Lines, read as in
+# bulk_import.py). It validates every record first and reports all the
+# rejections together, drops emails repeated in the file or already
+# registered (one indexed query for the lot), hashes the passwords across
+# a process pool and inserts everyone with executemany in one transaction.
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import auth
+import cache
+from bulk_import import read_records, write_rejects
+from database import get_connection, write_transaction
+from migrations import migrate
+
+EMAIL = re.compile(r'[^@\s]+@gmail\.(?:com|org|in)', re.IGNORECASE)
+NAME = re.compile(r'[^\W\d_]+')
+# at least 6 characters, with a letter, a digit and an ASCII symbol
+PASSWORD = re.compile(r'(?=.*[^\W\d_])(?=.*\d)(?=.*[\x00-\x2f\x3a-\x40\x5b-\x60\x7b-\x7f]).{6,}', re.DOTALL)
+ROLE = re.compile(r'[a-z]+')
+
+INVALID_EMAIL = "Invalid email. Please use a Gmail address."
+WEAK_PASSWORD = "Weak password. Please use at least 6 characters, 1 alphabet, 1 number, and 1 special character."
+INVALID_NAME = "Invalid name. Please use only alphabets."
+INVALID_ROLE = "Invalid role. Please use lowercase letters only."
+
+DEFAULT_ROLE = 'user'
+HASH_CHUNK = 64
+
+
+def is_valid_name(name):
+    return NAME.fullmatch(name) is not None
+
+
+def is_valid_email(email):
+    return EMAIL.fullmatch(email) is not None
+
+
+def is_strong_password(password):
+    return PASSWORD.fullmatch(password) is not None
+
+
+# the reason a new user can't be added, or None
+def check_user(name, email, password, role=DEFAULT_ROLE):
+    if not is_valid_email(email):
+        return INVALID_EMAIL
+    if not is_strong_password(password):
+        return WEAK_PASSWORD
+    if not is_valid_name(name):
+        return INVALID_NAME
+    if ROLE.fullmatch(role) is None:
+        return INVALID_ROLE
+    return None
+
+
+class ProvisionStats:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejects = []
+        self.started = time.perf_counter()
+        self.hashing = 0.0
+        self.elapsed = 0.0
+
+    def summary(self):
+        return (
+            f"read {self.read}, inserted {self.inserted}, duplicates {self.duplicates}, "
+            f"rejected {len(self.rejects)} in {self.elapsed:.2f}s ({self.hashing:.2f}s hashing)"
+        )
+
+
+def _fields(record):
+    if record is None:
+        return None, "empty record"
+    if isinstance(record, str):
+        return None, record
+    if not isinstance(record, dict):
+        return None, "record is not an object"
+    name, email, role = (str(record.get(field) or '').strip() for field in ('name', 'email', 'role'))
+    # passwords are kept exactly as given, and emails as typed, the same as
+    # main.add_user stores them and auth.authenticate looks them up
+    password = str(record.get('password') or '')
+    return (name, email, password, role or DEFAULT_ROLE), None
+
+
+# splits records into [(position, (name, email, password, role))] and
+# [(position, reason)]
+def validate(records):
+    accepted = []
+    rejects = []
+    for position, record in records:
+        user, reason = _fields(record)
+        if user is not None:
+            reason = check_user(*user)
+        if reason is None:
+            accepted.append((position, user))
+        else:
+            rejects.append((position, reason))
+    return accepted, rejects
+
+
+def existing_emails(cursor, emails):
+    # one statement for any number of emails, each looked up in the unique
+    # index on users.email
+    cursor.execute('''
+        SELECT email FROM users
+        WHERE email IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(emails)),))
+    return {row[0] for row in cursor}
+
+
+def _hash_all(passwords, workers):
+    if workers <= 1:
+        return [auth.hash_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(auth.hash_password, passwords, chunksize=HASH_CHUNK))
+
+
+def provision_users(records, workers=None):
+    stats = ProvisionStats()
+    workers = workers or os.cpu_count() or 1
+
+    accepted, stats.rejects = validate(records)
+    stats.read = len(accepted) + len(stats.rejects)
+
+    users = {}
+    for _, user in accepted:
+        if user[1] in users:
+            stats.duplicates += 1
+        else:
+            users[user[1]] = user
+    with get_connection() as connection:
+        registered = existing_emails(connection.cursor(), users)
+    stats.duplicates += len(registered)
+    for email in registered:
+        del users[email]
+
+    # hashing takes far longer than the insert, so it runs before the write
+    # lock is taken
+    started = time.perf_counter()
+    hashes = _hash_all([password for _, _, password, _ in users.values()], workers)
+    stats.hashing = time.perf_counter() - started
+
+    rows = [(name, email, hashed, role) for (name, email, _, role), hashed in zip(users.values(), hashes)]
+    with write_transaction() as cursor:
+        # someone may have signed up while the passwords were hashing
+        late = existing_emails(cursor, users)
+        cursor.executemany('''
+            INSERT INTO users (name, email, password, role)
+            VALUES (?, ?, ?, ?)
+        ''', [row for row in rows if row[1] not in late])
+    stats.duplicates += len(late)
+    stats.inserted = len(rows) - len(late)
+
+    for email in users:
+        cache.invalidate_user(email)
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add users from a CSV or JSON Lines file.")
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes hashing passwords")
+    parser.add_argument('--rejects', help="write rejected records to this CSV file")
+    args = parser.parse_args()
+
+    try:
+        with get_connection() as connection:
+            migrate(connection)
+        stats = provision_users(read_records(args.path), args.workers)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+    print(stats.summary())
+    if args.rejects:
+        write_rejects(args.rejects, stats.rejects)
+    else:
+        for position, reason in stats.rejects[:20]:
+            print(f"  record {position}: {reason}")
@@ -0,0 +1,154 @@
+# Circulation reports.
+#
+#     python analytics.py --top 10 --days 30
+#
+# Every report reads the aggregate tables from migration 8, which triggers
+# update in the same transaction as each borrow, return and catalog change,
+# so a report costs an index read however long the loan ledger grows.
+# Archiving loans (archive.py) does not change the aggregates.
+
+import argparse
+import datetime
+import sqlite3
+
+from database import get_connection
+
+TOP = 10
+
+MOST_BORROWED = '''
+    SELECT book_stats.book_id, books.title, books.author, book_stats.borrows
+    FROM book_stats
+    LEFT JOIN books ON books.id = book_stats.book_id
+    ORDER BY book_stats.borrows DESC
+    LIMIT ?
+'''
+
+MOST_ACTIVE_USERS = '''
+    SELECT user_stats.user_id, users.name, user_stats.borrows, user_stats.open_loans
+    FROM user_stats
+    LEFT JOIN users ON users.id = user_stats.user_id
+    ORDER BY user_stats.borrows DESC
+    LIMIT ?
+'''
+
+USER_ACTIVITY = '''
+    SELECT borrows, returns, open_loans, last_active_at
+    FROM user_stats
+    WHERE user_id = ?
+'''
+
+BUSIEST_HOURS = '''
+    SELECT weekday, hour, borrows
+    FROM borrow_hours
+    ORDER BY borrows DESC
+    LIMIT ?
+'''
+
+GENRE_UTILIZATION = '''
+    SELECT genre, books, on_shelf, on_loan, borrows
+    FROM genre_stats
+    ORDER BY genre
+'''
+
+DAILY_BORROWS = '''
+    SELECT day, SUM(borrows), SUM(returns)
+    FROM genre_daily
+    WHERE day >= ? AND day <= ?
+    GROUP BY day
+    ORDER BY day
+'''
+
+GENRE_DAILY_BORROWS = '''
+    SELECT day, borrows, returns
+    FROM genre_daily
+    WHERE genre = ? AND day >= ? AND day <= ?
+    ORDER BY day
+'''
+
+WEEKDAYS = ('Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday')
+
+
+def _query(sql, parameters=()):
+    with get_connection() as connection:
+        return connection.execute(sql, parameters).fetchall()
+
+
+# [(book_id, title, author, borrows)]
+def most_borrowed(limit=TOP):
+    return _query(MOST_BORROWED, (limit,))
+
+
+# [(user_id, name, borrows, open_loans)]
+def most_active_users(limit=TOP):
+    return _query(MOST_ACTIVE_USERS, (limit,))
+
+
+# (borrows, returns, open_loans, last_active_at), or None for a user who
+# never borrowed
+def user_activity(user_id):
+    rows = _query(USER_ACTIVITY, (user_id,))
+    return rows[0] if rows else None
+
+
+# [(weekday, hour, borrows)], weekday 0 being Sunday
+def busiest_hours(limit=TOP):
+    return _query(BUSIEST_HOURS, (limit,))
+
+
+# [(genre, books, on_shelf, on_loan, borrows, utilization)], where
+# utilization is the share of the genre's copies out on loan
+def genre_utilization():
+    return [
+        (genre, books, on_shelf, on_loan, borrows,
+         on_loan / (on_shelf + on_loan) if on_shelf + on_loan > 0 else 0.0)
+        for genre, books, on_shelf, on_loan, borrows in _query(GENRE_UTILIZATION)
+    ]
+
+
+# [(day, borrows, returns)] for every day with activity from start to end,
+# inclusive; for one genre if given ('' is books without a genre)
+def daily_borrows(start, end, genre=None):
+    start, end = start.isoformat(), end.isoformat()
+    if genre is None:
+        return _query(DAILY_BORROWS, (start, end))
+    return _query(GENRE_DAILY_BORROWS, (genre, start, end))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print circulation reports.")
+    parser.add_argument('--top', type=int, default=TOP)
+    parser.add_argument('--days', type=int, default=30, help="days of daily totals to show")
+    parser.add_argument('--genre', help="daily totals for this genre only")
+    args = parser.parse_args()
+
+    try:
+        end = datetime.date.today()
+        books = most_borrowed(args.top)
+        users = most_active_users(args.top)
+        hours = busiest_hours(args.top)
+        genres = genre_utilization()
+        days = daily_borrows(end - datetime.timedelta(days=args.days - 1), end, args.genre)
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+    print("Most borrowed books:")
+    for book_id, title, author, borrows in books:
+        print(f"  {borrows:6d}  {title or f'(deleted book {book_id})'}" + (f" by {author}" if author else ""))
+
+    print("\nMost active users:")
+    for user_id, name, borrows, open_loans in users:
+        print(f"  {borrows:6d}  {name or f'(deleted user {user_id})'}, {open_loans} on loan")
+
+    print("\nBusiest hours:")
+    for weekday, hour, borrows in hours:
+        print(f"  {borrows:6d}  {WEEKDAYS[weekday]} {hour:02d}:00")
+
+    print("\nGenres:")
+    for genre, titles, on_shelf, on_loan, borrows, utilization in genres:
+        print(f"  {genre or '(none)':20} {titles:6d} books, {on_loan:6d} of {on_shelf + on_loan:6d} copies out "
+              f"({utilization:.0%}), {borrows} borrows")
+
+    print(f"\nLast {args.days} days" + (f" ({args.genre})" if args.genre else "") + ":")
+    for day, borrowed, returned in days:
+        print(f"  {day}  {borrowed:6d} borrowed  {returned:6d} returned")
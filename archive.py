@@ -0,0 +1,122 @@
+# Loan archival.
+#
+#     python archive.py --older-than-days 365 --directory archive --vacuum
+#
+# Returned loans stay in the transactions ledger until they are archived.
+# This moves the ones returned before a cutoff into one SQLite file per year
+# of return (archive/loans-2024.db, ...), a batch at a time. Each batch is
+# committed to its archive files before it is deleted from the library
+# database, and archive rows keep their ledger id, so a run that stops half
+# way only copies the same rows again (and ignores them) when repeated.
+
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+from collections import defaultdict
+
+from database import get_connection
+from migrations import migrate
+from timestamps import to_micros
+
+ARCHIVE_DIR = 'archive'
+BATCH_SIZE = 5000
+KEEP_DAYS = 365
+
+CLOSED_LOANS = '''
+    SELECT id, user_id, book_id, borrowed_at, returned_at
+    FROM transactions
+    WHERE returned_at IS NOT NULL AND returned_at < ?
+    ORDER BY returned_at
+    LIMIT ?
+'''
+
+
+def archive_path(directory, year):
+    return os.path.join(directory, f'loans-{year}.db')
+
+
+def _append(path, loans):
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS loans (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                book_id INTEGER,
+                borrowed_at DATETIME,
+                returned_at DATETIME
+            )
+        ''')
+        # timestamps as in the ledger, microseconds since the epoch
+        connection.executemany('INSERT OR IGNORE INTO loans VALUES (?, ?, ?, ?, ?)', (
+            (loan_id, user_id, book_id, to_micros(borrowed_at), to_micros(returned_at))
+            for loan_id, user_id, book_id, borrowed_at, returned_at in loans
+        ))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+# returns {year: loans moved}
+def archive_loans(cutoff, directory=ARCHIVE_DIR, batch_size=BATCH_SIZE):
+    os.makedirs(directory, exist_ok=True)
+    moved = defaultdict(int)
+
+    with get_connection() as connection:
+        while True:
+            loans = connection.execute(CLOSED_LOANS, (to_micros(cutoff), batch_size)).fetchall()
+            if not loans:
+                break
+
+            by_year = defaultdict(list)
+            for loan in loans:
+                by_year[loan[4].year].append(loan)
+            for year, rows in by_year.items():
+                _append(archive_path(directory, year), rows)
+                moved[year] += len(rows)
+
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany('DELETE FROM transactions WHERE id = ?', ((loan[0],) for loan in loans))
+                connection.commit()
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+
+    return dict(moved)
+
+
+# give the pages freed by archival back to the file system
+def compact():
+    with get_connection() as connection:
+        connection.execute('VACUUM')
+        connection.execute('PRAGMA optimize')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old returned loans into yearly archive files.")
+    parser.add_argument('--older-than-days', type=int, default=KEEP_DAYS,
+                        help="archive loans returned more than this many days ago")
+    parser.add_argument('--directory', default=ARCHIVE_DIR)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--vacuum', action='store_true', help="VACUUM the library database afterwards")
+    args = parser.parse_args()
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=args.older_than_days)
+    started = time.perf_counter()
+    try:
+        with get_connection() as connection:
+            migrate(connection)
+        moved = archive_loans(cutoff, args.directory, args.batch_size)
+        if args.vacuum:
+            compact()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+    for year, count in sorted(moved.items()):
+        print(f"{year}: {count} loans -> {archive_path(args.directory, year)}")
+    print(f"Archived {sum(moved.values())} loans returned before {cutoff:%Y-%m-%d} "
+          f"in {time.perf_counter() - started:.1f}s")
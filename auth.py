@@ -0,0 +1,197 @@
+# Password hashing and login sessions.
+#
+# Passwords are stored as '$'-separated strings that carry their own
+# parameters, e.g. scrypt$16384$8$1$<salt>$<hash>, so the cost can be raised
+# later: a hash made with other parameters still verifies, and is replaced
+# with a fresh one on the next successful login. Rows still holding a
+# plaintext password from before hashing are upgraded the same way.
+#
+# Hashing is deliberately slow, so the service runs logins on their own small
+# thread pool (see login_async) and hands out session tokens; requests that
+# carry a token are checked against the session cache instead of the
+# password.
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+from database import get_connection
+
+SCRYPT = 'scrypt'
+PBKDF2 = 'pbkdf2_sha256'
+# scrypt needs OpenSSL 1.1+; fall back to PBKDF2 where it is missing
+ALGORITHM = SCRYPT if hasattr(hashlib, 'scrypt') else PBKDF2
+
+# scrypt cost: n is the CPU/memory cost (a power of two), r the block size,
+# p the parallelism; memory used is about 128 * n * r bytes
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+HASH_WORKERS = 4
+ADMIN_ROLE = 'admin'
+SESSION_TTL = 30 * 60  # seconds
+MAX_SESSIONS = 100_000
+
+
+def _encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _derive(password, salt, algorithm, params):
+    password = password.encode()
+    if algorithm == SCRYPT:
+        n, r, p = params
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=129 * n * r + 2 ** 20, dklen=HASH_BYTES)
+    iterations, = params
+    return hashlib.pbkdf2_hmac('sha256', password, salt, iterations, HASH_BYTES)
+
+
+def _default_params(algorithm):
+    if algorithm == SCRYPT:
+        return (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return (PBKDF2_ITERATIONS,)
+
+
+def hash_password(password, algorithm=None, params=None):
+    algorithm = algorithm or ALGORITHM
+    params = tuple(params or _default_params(algorithm))
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _derive(password, salt, algorithm, params)
+    return '$'.join([algorithm, *map(str, params), _encode(salt), _encode(digest)])
+
+
+# returns (algorithm, params, salt, digest), or None for a legacy plaintext
+# password
+def _parse(stored):
+    parts = stored.split('$')
+    counts = {SCRYPT: 6, PBKDF2: 4}
+    if counts.get(parts[0]) != len(parts):
+        return None
+    try:
+        params = tuple(int(value) for value in parts[1:-2])
+        return parts[0], params, base64.b64decode(parts[-2]), base64.b64decode(parts[-1])
+    except ValueError:
+        return None
+
+
+def verify_password(password, stored):
+    parsed = _parse(stored)
+    if parsed is None:
+        return hmac.compare_digest(password.encode(), stored.encode())
+    algorithm, params, salt, digest = parsed
+    return hmac.compare_digest(_derive(password, salt, algorithm, params), digest)
+
+
+def needs_rehash(stored):
+    parsed = _parse(stored)
+    return parsed is None or parsed[:2] != (ALGORITHM, _default_params(ALGORITHM))
+
+
+_dummy_hash = None
+
+
+def _dummy():
+    # unknown emails are checked against this, so they take as long as a
+    # wrong password and don't reveal which emails exist
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(8))
+    return _dummy_hash
+
+
+# returns the user id for a correct email and password, otherwise None
+def authenticate(email, password):
+    with get_connection() as connection:
+        row = connection.execute('SELECT id, password FROM users WHERE email = ?', (email,)).fetchone()
+
+    if row is None:
+        verify_password(password, _dummy())
+        return None
+
+    user_id, stored = row
+    if not verify_password(password, stored):
+        return None
+
+    if needs_rehash(stored):
+        rehashed = hash_password(password)
+        with get_connection() as connection:
+            # only if nobody changed the password in the meantime
+            connection.execute(
+                'UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                (rehashed, user_id, stored),
+            )
+            connection.commit()
+    return user_id
+
+
+# the role of a user id, or None once the user is deleted
+def user_role(user_id):
+    with get_connection() as connection:
+        row = connection.execute('SELECT role FROM users WHERE id = ?', (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+# token -> user id
+sessions = cache.LRUCache('sessions', maxsize=MAX_SESSIONS, ttl=SESSION_TTL)
+
+
+def user_tag(user_id):
+    return ('user', user_id)
+
+
+def start_session(user_id):
+    token = secrets.token_urlsafe(32)
+    sessions.put(token, user_id, tags=[user_tag(user_id)])
+    return token
+
+
+def session_user(token):
+    user_id = sessions.get(token)
+    return None if user_id is cache.MISSING else user_id
+
+
+def end_session(token):
+    sessions.invalidate(token)
+
+
+def end_user_sessions(user_id):
+    sessions.invalidate_tag(user_tag(user_id))
+
+
+# returns (user_id, token), or None when the credentials are wrong
+def login(email, password):
+    user_id = authenticate(email, password)
+    if user_id is None:
+        return None
+    return user_id, start_session(user_id)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='library-auth')
+    return _executor
+
+
+# hashlib releases the GIL while hashing, so logins on the pool run in
+# parallel and never block the event loop
+async def login_async(email, password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), login, email, password)
@@ -0,0 +1,72 @@
+# Batch circulation against one call per book.
+#
+#     python -m benchmarks.batch_bench --stacks 200 --min-stack 10 --max-stack 20
+#
+# Patrons hand over stacks of books at the desk. Each stack is borrowed and
+# then returned twice over: once with a checkout()/checkin() call per book,
+# each in its own transaction, and once with checkout_many()/checkin_many(),
+# one transaction per stack.
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import circulation
+import database
+from benchmarks.borrow_stress import prepare
+
+
+def make_stacks(rng, count, smallest, largest, books, users):
+    return [
+        (rng.randint(1, users), rng.sample(range(1, books + 1), rng.randint(smallest, largest)))
+        for _ in range(count)
+    ]
+
+
+def per_item(stacks):
+    for user_id, book_ids in stacks:
+        for book_id in book_ids:
+            circulation.checkout(user_id, book_id)
+    for user_id, book_ids in stacks:
+        for book_id in book_ids:
+            circulation.checkin(user_id, book_id)
+
+
+def batched(stacks):
+    for user_id, book_ids in stacks:
+        circulation.checkout_many(user_id, book_ids)
+    for user_id, book_ids in stacks:
+        circulation.checkin_many(user_id, book_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batch and per-book circulation.")
+    parser.add_argument('--stacks', type=int, default=200)
+    parser.add_argument('--min-stack', type=int, default=10)
+    parser.add_argument('--max-stack', type=int, default=20)
+    parser.add_argument('--books', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stacks = make_stacks(rng, args.stacks, args.min_stack, args.max_stack, args.books, args.users)
+    items = sum(len(book_ids) for _, book_ids in stacks)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, run in (('per item', per_item), ('batched', batched)):
+            path = os.path.join(directory, f'{name}.db')
+            prepare(path, args.books, 1_000, args.users)
+            database.configure(path)
+            started = time.perf_counter()
+            run(stacks)
+            elapsed = time.perf_counter() - started
+            database.close_pool()
+            print(f"{name:9} {elapsed * 1000 / args.stacks:8.2f} ms per stack (borrow + return)  "
+                  f"{items * 2 / elapsed:9,.0f} items/s")
+
+
+if __name__ == "__main__":
+    main()
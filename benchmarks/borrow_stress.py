@@ -0,0 +1,132 @@
+# Concurrency stress test for circulation.checkout.
+#
+# Many threads (or processes) race to borrow a small stock of copies. At the
+# end the number of successful checkouts must equal the number of copies that
+# disappeared from the shelves, and no book may have negative availability.
+#
+#     python -m benchmarks.borrow_stress --workers 8 --attempts 2000 --mode process
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import auth
+import circulation
+import database
+from migrations import migrate
+
+PASSWORD = 'secret1!'
+
+
+def prepare(path, books, copies, users):
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    password = auth.hash_password(PASSWORD)
+    connection.executemany(
+        'INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)',
+        ((f'user{i}', f'user{i}@gmail.com', password, 'user') for i in range(users)),
+    )
+    connection.executemany(
+        'INSERT INTO books (title, author, isbn, genre, availability) VALUES (?, ?, ?, ?, ?)',
+        ((f'Title {i}', f'Author {i}', f'{i:013d}', 'Fiction', copies) for i in range(books)),
+    )
+    connection.commit()
+    connection.close()
+
+
+def borrow_many(seed, attempts, books, users):
+    rng = random.Random(seed)
+    borrowed = 0
+    for _ in range(attempts):
+        result = circulation.checkout(rng.randint(1, users), rng.randint(1, books))
+        if result.status == circulation.BORROWED:
+            borrowed += 1
+    return borrowed
+
+
+def run_worker(path, seed, attempts, books, users):
+    database.configure(path, size=1)
+    return borrow_many(seed, attempts, books, users)
+
+
+def run_threads(path, workers, attempts, books, users):
+    database.configure(path, size=workers)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda seed=seed: results.append(borrow_many(seed, attempts, books, users))
+        )
+        for seed in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    database.close_pool()
+    return sum(results)
+
+
+def run_processes(path, workers, attempts, books, users):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        results = pool.starmap(
+            run_worker,
+            [(path, seed, attempts, books, users) for seed in range(workers)],
+        )
+    return sum(results)
+
+
+def verify(path, books, copies, borrowed):
+    connection = sqlite3.connect(path)
+    remaining, lowest = connection.execute('SELECT SUM(availability), MIN(availability) FROM books').fetchone()
+    loans = connection.execute('SELECT COUNT(*) FROM transactions WHERE returned_at IS NULL').fetchone()[0]
+    connection.close()
+
+    problems = []
+    if lowest < 0:
+        problems.append(f"availability went negative ({lowest})")
+    if loans != borrowed:
+        problems.append(f"{loans} loan rows for {borrowed} successful checkouts")
+    if books * copies - remaining != borrowed:
+        problems.append(f"{books * copies - remaining} copies taken for {borrowed} checkouts")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race concurrent checkouts and check for overselling.")
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=1000, help="checkouts tried per worker")
+    parser.add_argument('--books', type=int, default=50)
+    parser.add_argument('--copies', type=int, default=20)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stress.db')
+        prepare(path, args.books, args.copies, args.users)
+
+        run = run_threads if args.mode == 'thread' else run_processes
+        started = time.perf_counter()
+        borrowed = run(path, args.workers, args.attempts, args.books, args.users)
+        elapsed = time.perf_counter() - started
+
+        attempts = args.workers * args.attempts
+        print(f"mode: {args.mode}, workers: {args.workers}, attempts: {attempts}, borrowed: {borrowed}")
+        print(f"{attempts / elapsed:,.0f} checkout attempts/s in {elapsed:.2f}s")
+
+        problems = verify(path, args.books, args.copies, borrowed)
+        for problem in problems:
+            print(f"FAILED: {problem}")
+        if problems:
+            raise SystemExit(1)
+        print("No overselling detected.")
+
+
+if __name__ == "__main__":
+    main()
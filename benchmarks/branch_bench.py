@@ -0,0 +1,81 @@
+# Checkouts from many desks against one database file and against one file
+# per branch.
+#
+#     python -m benchmarks.branch_bench --branches 12 --desks 12 --loans 500
+#
+# Each desk thread borrows and returns books at its own branch. With every
+# branch in one file all desks share a write lock; with branches.py each
+# branch has its own. Also times listing the catalog of every branch, which
+# fans out across the branch files.
+
+import argparse
+import tempfile
+import threading
+import time
+
+import branches
+import database
+from migrations import migrate
+
+
+def desk(library, branch, user_id, books, loans):
+    for i in range(loans):
+        book_id = i % books + 1
+        library.borrow_book(branch, user_id, book_id)
+        library.return_book(branch, user_id, book_id)
+
+
+def run(library, desks, names, user_id, books, loans):
+    threads = [
+        threading.Thread(target=desk, args=(library, names[i % len(names)], user_id, books, loans))
+        for i in range(desks)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare one database file with one per branch.")
+    parser.add_argument('--branches', type=int, default=12)
+    parser.add_argument('--desks', type=int, default=12, help="threads borrowing and returning")
+    parser.add_argument('--books', type=int, default=1_000, help="books per branch")
+    parser.add_argument('--loans', type=int, default=500, help="borrow and return cycles per desk")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.configure(f'{directory}/library.db', size=args.desks)
+        with database.get_connection() as connection:
+            migrate(connection)
+            user_id = connection.execute(
+                "INSERT INTO users (name, email, password, role) VALUES ('Desk', 'desk@gmail.com', '', 'user') "
+                "RETURNING id"
+            ).fetchone()[0]
+            connection.commit()
+
+        names = [f'branch{i}' for i in range(args.branches)]
+        for label, files in (('one file', ['all']), (f'{args.branches} files', names)):
+            library = branches.Branches(f'{directory}/{len(files)}', pool_size=args.desks)
+            for name in files:
+                engine = library.add_branch(name)
+                with database.write_transaction(engine.pool) as cursor:
+                    cursor.executemany(
+                        'INSERT INTO books (title, author, isbn, genre, availability) VALUES (?, ?, ?, ?, ?)',
+                        ((f'Title {i}', 'Author', f'{i:013d}', 'Fiction', args.desks) for i in range(args.books)),
+                    )
+            elapsed = run(library, args.desks, files, user_id, args.books, args.loans)
+            cycles = args.desks * args.loans
+            print(f"{label:>9}: {cycles / elapsed:8,.0f} borrow+return cycles/s")
+
+            started = time.perf_counter()
+            listed = library.list_books()
+            print(f"{'':>9}  list_books: {len(listed):,} books in {(time.perf_counter() - started) * 1e3:.1f} ms")
+            library.close()
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
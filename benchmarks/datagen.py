@@ -0,0 +1,115 @@
+# Synthetic library data for benchmarks.
+#
+#     python -m benchmarks.datagen library-100k.db --scale 100k
+#
+# The same seed always produces the same users, books and transactions, so
+# benchmark runs on different machines or commits are comparable.
+
+import argparse
+import datetime
+import random
+import sqlite3
+
+import auth
+from migrations import migrate
+from timestamps import to_micros
+
+# books per scale; there are a tenth as many users and as many loans as books
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+SYLLABLES = (
+    'ka ri to ne mo sa lu ve an el or im us ta de lo mi ra be ko '
+    'shi ar en ul ma no pe ti go ha ze fa wi do li yu'
+).split()
+
+GENRES = ('Fiction', 'Fantasy', 'History', 'Science', 'Mystery', 'Romance', 'Poetry')
+
+# every generated user has this password
+PASSWORD = 'secret1!'
+
+# fixed so generated loans don't depend on when the data was built
+EPOCH = datetime.datetime(2024, 1, 1)
+
+
+# a Zipf-like vocabulary of made-up words, so a few words are common and most
+# are rare, as in a real catalog
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def split_vocabulary(rng, size=50_000):
+    vocabulary = make_vocabulary(size, rng)
+    words, names = vocabulary[:size * 4 // 5], vocabulary[size * 4 // 5:]
+    rng.shuffle(words)
+    rng.shuffle(names)
+    return words, names
+
+
+def pick(words, rng):
+    return words[min(len(words) - 1, int(rng.paretovariate(1.1)) - 1)]
+
+
+def isbn13(number):
+    digits = f'978{number:09d}'
+    check = (10 - sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(digits)) % 10) % 10
+    return f'{digits}{check}'
+
+
+def generate_books(count, words, names, rng):
+    for i in range(count):
+        title = ' '.join(pick(words, rng) for _ in range(rng.randint(2, 5))).title()
+        author = f'{pick(names, rng).title()} {pick(names, rng).title()}'
+        yield title, author, isbn13(i), rng.choice(GENRES), rng.randint(0, 5)
+
+
+def generate_users(count, names, rng):
+    # hashing is slow on purpose, so all users share one hash
+    password = auth.hash_password(PASSWORD)
+    for i in range(count):
+        name = rng.choice(names).title()
+        yield name, f'{name.lower()}{i}@gmail.com', password, 'user'
+
+
+def generate_transactions(count, users, books, rng, days=60):
+    for _ in range(count):
+        borrowed_at = EPOCH - datetime.timedelta(seconds=rng.randint(0, days * 86400))
+        yield rng.randint(1, users), rng.randint(1, books), to_micros(borrowed_at)
+
+
+def build_database(path, books, users, transactions, seed=1):
+    rng = random.Random(seed)
+    words, names = split_vocabulary(rng)
+
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    connection.executemany(
+        'INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)',
+        generate_users(users, names, rng),
+    )
+    connection.executemany(
+        'INSERT INTO books (title, author, isbn, genre, availability) VALUES (?, ?, ?, ?, ?)',
+        generate_books(books, words, names, rng),
+    )
+    connection.executemany(
+        'INSERT INTO transactions (user_id, book_id, borrowed_at) VALUES (?, ?, ?)',
+        generate_transactions(transactions, users, books, rng),
+    )
+    connection.commit()
+    connection.close()
+
+
+def build_scale(path, scale, seed=1):
+    books = SCALES[scale]
+    build_database(path, books, books // 10, books, seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic library database.")
+    parser.add_argument('path')
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    build_scale(args.path, args.scale, args.seed)
@@ -0,0 +1,100 @@
+# Commit per operation against group commit, under contention.
+#
+#     python -m benchmarks.group_commit_bench --desks 32 --loans 200 --synchronous FULL
+#
+# Every desk thread borrows and returns books, waiting for each result as a
+# desk would. First each call commits on its own (circulation.checkout and
+# checkin); then the same calls go through group_commit.GroupCommitWriter,
+# once per --delays value. Prints throughput, latency percentiles and the
+# average batch the writer committed.
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import circulation
+import database
+import group_commit
+from migrations import migrate
+
+
+def prepare(path, desks, books):
+    database.configure(path, size=desks + 1)
+    with database.get_connection() as connection:
+        migrate(connection)
+        connection.executemany(
+            'INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)',
+            (('Desk', f'desk{i}@gmail.com', '', 'user') for i in range(desks)),
+        )
+        connection.executemany(
+            'INSERT INTO books (title, author, isbn, genre, availability) VALUES (?, ?, ?, ?, ?)',
+            ((f'Title {i}', 'Author', f'{i:013d}', 'Fiction', desks) for i in range(books)),
+        )
+        connection.commit()
+
+
+def desk(user_id, books, loans, checkout, checkin, latencies):
+    for i in range(loans):
+        book_id = (user_id * 7 + i) % books + 1
+        for operation in (checkout, checkin):
+            started = time.perf_counter()
+            operation(user_id, book_id)
+            latencies.append(time.perf_counter() - started)
+
+
+def run(desks, books, loans, checkout, checkin):
+    latencies = []
+    threads = [
+        threading.Thread(target=desk, args=(user_id, books, loans, checkout, checkin, latencies))
+        for user_id in range(1, desks + 1)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def report(label, elapsed, latencies, extra=''):
+    p50 = statistics.median(latencies) * 1e3
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+    print(f"{label:>22}: {len(latencies) / elapsed:8,.0f} ops/s  p50 {p50:6.2f} ms  p99 {p99:7.2f} ms{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare commit per operation with group commit.")
+    parser.add_argument('--desks', type=int, default=32, help="threads borrowing and returning")
+    parser.add_argument('--books', type=int, default=1_000)
+    parser.add_argument('--loans', type=int, default=200, help="borrow and return cycles per desk")
+    parser.add_argument('--max-batch', type=int, default=group_commit.MAX_BATCH)
+    parser.add_argument('--delays', default='0.5,2', help="comma separated latency budgets in ms")
+    parser.add_argument('--synchronous', default='NORMAL', choices=('OFF', 'NORMAL', 'FULL'))
+    args = parser.parse_args()
+
+    database.PRAGMAS['synchronous'] = args.synchronous
+    print(f"{args.desks} desks, {args.desks * args.loans * 2:,} operations each run, synchronous={args.synchronous}")
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(os.path.join(directory, 'single.db'), args.desks, args.books)
+        report('commit per operation', *run(args.desks, args.books, args.loans,
+                                              circulation.checkout, circulation.checkin))
+
+        for delay in (float(ms) for ms in args.delays.split(',')):
+            prepare(os.path.join(directory, f'group{delay}.db'), args.desks, args.books)
+            writer = group_commit.GroupCommitWriter(max_batch=args.max_batch, max_delay=delay / 1000).start()
+            elapsed, latencies = run(
+                args.desks, args.books, args.loans,
+                lambda user_id, book_id: writer.checkout(user_id, book_id).result(),
+                lambda user_id, book_id: writer.checkin(user_id, book_id).result(),
+            )
+            writer.stop()
+            report(f'group commit, {delay:g} ms', elapsed, latencies,
+                   f"  {writer.operations / writer.batches:5.1f} per commit")
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
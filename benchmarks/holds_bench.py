@@ -0,0 +1,96 @@
+# Hold queue throughput with a large number of open holds.
+#
+#     python -m benchmarks.holds_bench --holds 100000 --books 1000 --users 20000
+#
+# Every copy starts out on loan, then --holds holds are placed on random
+# books. Returning every book promotes the head of each waitlist, and expiry
+# passes then time out the ready holds a round at a time, each expired hold
+# promoting the next patron in line. The last line times finding the ready
+# holds due with the expiry index against a scan of the holds table.
+
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+import circulation
+import database
+import holds
+from benchmarks.borrow_stress import prepare
+from timestamps import to_micros
+
+BORROWER = 1
+
+
+def place(rng, count, books, users):
+    pairs = set()
+    while len(pairs) < count:
+        pairs.add((rng.randint(BORROWER + 1, users), rng.randint(1, books)))
+    started = time.perf_counter()
+    for user_id, book_id in pairs:
+        holds.place_hold(user_id, book_id)
+    return time.perf_counter() - started
+
+
+def due(now, indexed):
+    with database.get_connection() as connection:
+        return connection.execute(f'''
+            SELECT COUNT(*) FROM holds {'' if indexed else 'NOT INDEXED'}
+            WHERE status = 'ready' AND expires_at <= ?
+        ''', (to_micros(now),)).fetchone()[0]
+
+
+def timed(function, *args, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(*args)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure hold queue throughput.")
+    parser.add_argument('--holds', type=int, default=100_000)
+    parser.add_argument('--books', type=int, default=1_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--rounds', type=int, default=5, help="expiry rounds to time")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    book_ids = list(range(1, args.books + 1))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'holds.db')
+        prepare(path, args.books, 1, args.users)
+        database.configure(path)
+        for start in range(0, args.books, 100):
+            circulation.checkout_many(BORROWER, book_ids[start:start + 100])
+
+        elapsed = place(rng, args.holds, args.books, args.users)
+        print(f"placed {args.holds:,} holds: {args.holds / elapsed:9,.0f} holds/s")
+
+        started = time.perf_counter()
+        for book_id in book_ids:
+            circulation.checkin(BORROWER, book_id)
+        elapsed = time.perf_counter() - started
+        print(f"returns promoting a hold: {elapsed * 1e6 / args.books:9,.0f} us per return")
+
+        now = datetime.datetime.now()
+        for number in range(1, args.rounds + 1):
+            now += datetime.timedelta(days=holds.HOLD_DAYS + 1)
+            started = time.perf_counter()
+            expired = holds.expire_holds(now)
+            elapsed = time.perf_counter() - started
+            print(f"expiry round {number}: {expired:,} expired in {elapsed * 1000:7.1f} ms "
+                  f"({expired / elapsed:9,.0f} holds/s), {holds.waitlist_length(book_ids[0])} waiting on book 1")
+
+        now += datetime.timedelta(days=holds.HOLD_DAYS + 1)
+        print(f"holds due: {timed(due, now, True) * 1000:.2f} ms by index, "
+              f"{timed(due, now, False) * 1000:.2f} ms by scan")
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Load test for service.py.
+#
+#     python -m benchmarks.load_test --clients 50 --requests 200
+#
+# Starts the service on a temporary database in a background thread, then
+# runs N concurrent keep-alive clients issuing a mix of catalog reads,
+# searches and borrow/return pairs, and reports latency percentiles. Each
+# client logs in once before it starts; that login is not timed.
+# Pass --url to load an already running server instead.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import database
+import service
+from benchmarks.borrow_stress import PASSWORD, prepare
+
+
+async def request(reader, writer, method, path, body=None, token=None):
+    payload = json.dumps(body).encode() if body is not None else b''
+    authorization = f'Authorization: Bearer {token}\r\n' if token else ''
+    writer.write(
+        f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n{authorization}'
+        f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'.encode()
+        + payload
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def client(host, port, seed, requests, books, users, timings, statuses):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        # one login per client, its token covers the borrows and returns
+        credentials = {'email': f'user{rng.randrange(users)}@gmail.com', 'password': PASSWORD}
+        status, body = await request(reader, writer, 'POST', '/login', credentials)
+        token = json.loads(body)['token'] if status == 200 else None
+
+        for _ in range(requests):
+            choice = rng.random()
+            if choice < 0.4:
+                calls = [('GET', f'/books?limit=20&cursor={rng.randint(0, books)}', None)]
+            elif choice < 0.7:
+                calls = [('GET', f'/books/search?q=Title+{rng.randint(0, books - 1)}', None)]
+            else:
+                i = rng.randint(0, books - 1)
+                book = {'title': f'Title {i}', 'author': f'Author {i}'}
+                calls = [('POST', '/borrow', book), ('POST', '/return', book)]
+
+            for method, path, body in calls:
+                started = time.perf_counter()
+                status, _ = await request(reader, writer, method, path, body, token)
+                timings.append((time.perf_counter() - started) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_clients(host, port, clients, requests, books, users):
+    timings, statuses = [], {}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, seed, requests, books, users, timings, statuses)
+        for seed in range(clients)
+    ))
+    return timings, statuses, time.perf_counter() - started
+
+
+def start_server(workers, max_concurrent):
+    ready = threading.Event()
+    state = {}
+
+    def run():
+        async def main():
+            state['service'] = service.LibraryService(workers, max_concurrent)
+            state['port'] = await state['service'].start('127.0.0.1', 0)
+            state['loop'] = asyncio.get_running_loop()
+            ready.set()
+            await state['service'].server.serve_forever()
+
+        try:
+            asyncio.run(main())
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    return state
+
+
+def report(timings, statuses, elapsed, clients):
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"clients: {clients}, requests: {len(timings)}, elapsed: {elapsed:.2f}s, "
+          f"{len(timings) / elapsed:,.0f} req/s")
+    print(f"latency p50 {statistics.median(timings):.2f} ms, p99 {p99:.2f} ms, max {timings[-1]:.2f} ms")
+    print("status codes: " + ', '.join(f'{code}: {count}' for code, count in sorted(statuses.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure service latency under concurrent clients.")
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help="requests per client")
+    parser.add_argument('--workers', type=int, default=database.POOL_SIZE)
+    parser.add_argument('--max-concurrent', type=int, default=service.MAX_CONCURRENT)
+    parser.add_argument('--books', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--url', help="load an already running server, e.g. http://127.0.0.1:8080")
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlsplit(args.url)
+        result = asyncio.run(run_clients(url.hostname, url.port, args.clients, args.requests, args.books, args.users))
+        report(*result, args.clients)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'load.db')
+        prepare(path, args.books, 1_000_000, args.users)
+        database.configure(path, size=args.workers)
+
+        state = start_server(args.workers, args.max_concurrent)
+        result = asyncio.run(run_clients('127.0.0.1', state['port'], args.clients, args.requests, args.books, args.users))
+        report(*result, args.clients)
+
+        state['loop'].call_soon_threadsafe(state['service'].server.close)
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
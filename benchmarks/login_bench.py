@@ -0,0 +1,111 @@
+# Logins per second at different password hash costs.
+#
+#     python -m benchmarks.login_bench --algorithm scrypt --costs 8192,16384,32768 --threads 4
+#
+# For each cost (scrypt's n, or PBKDF2's iterations) the users get fresh
+# hashes at that cost, then --logins logins run on a pool of --threads
+# threads through auth.authenticate. Session lookups are timed at the end
+# for comparison, since those are what a logged-in request pays instead.
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import auth
+import database
+from migrations import migrate
+
+PASSWORD = 'secret1!'
+
+
+def prepare(path, users, algorithm, params):
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    connection.execute('DELETE FROM users')
+    connection.executemany(
+        'INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)',
+        ((f'user{i}', f'user{i}@gmail.com', auth.hash_password(PASSWORD, algorithm, params), 'user')
+         for i in range(users)),
+    )
+    connection.commit()
+    connection.close()
+
+
+def timed_login(email):
+    started = time.perf_counter()
+    user_id = auth.authenticate(email, PASSWORD)
+    elapsed = time.perf_counter() - started
+    if user_id is None:
+        raise RuntimeError(f"login failed for {email}")
+    return elapsed
+
+
+def run(path, algorithm, params, users, logins, threads, seed):
+    prepare(path, users, algorithm, params)
+    rng = random.Random(seed)
+    emails = [f'user{rng.randrange(users)}@gmail.com' for _ in range(logins)]
+
+    # the stored hashes must not be replaced with default-cost ones mid-run
+    defaults = auth.ALGORITHM, auth.SCRYPT_N, auth.SCRYPT_R, auth.SCRYPT_P, auth.PBKDF2_ITERATIONS
+    auth.ALGORITHM = algorithm
+    if algorithm == auth.SCRYPT:
+        auth.SCRYPT_N, auth.SCRYPT_R, auth.SCRYPT_P = params
+    else:
+        auth.PBKDF2_ITERATIONS, = params
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            timings = sorted(executor.map(timed_login, emails))
+        elapsed = time.perf_counter() - started
+    finally:
+        auth.ALGORITHM, auth.SCRYPT_N, auth.SCRYPT_R, auth.SCRYPT_P, auth.PBKDF2_ITERATIONS = defaults
+
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{algorithm} {'/'.join(map(str, params)):>14}  {logins / elapsed:8.1f} logins/s   "
+          f"p50 {statistics.median(timings) * 1000:8.2f} ms   p99 {p99 * 1000:8.2f} ms")
+
+
+def time_sessions(lookups):
+    tokens = [auth.start_session(user_id) for user_id in range(1, 101)]
+    started = time.perf_counter()
+    for i in range(lookups):
+        auth.session_user(tokens[i % len(tokens)])
+    elapsed = time.perf_counter() - started
+    print(f"session lookups: {lookups / elapsed:,.0f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure login throughput at chosen hash costs.")
+    parser.add_argument('--algorithm', choices=(auth.SCRYPT, auth.PBKDF2), default=auth.ALGORITHM)
+    parser.add_argument('--costs', help="comma-separated scrypt n or PBKDF2 iterations")
+    parser.add_argument('--r', type=int, default=auth.SCRYPT_R, help="scrypt block size")
+    parser.add_argument('--p', type=int, default=auth.SCRYPT_P, help="scrypt parallelism")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=auth.HASH_WORKERS)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.costs:
+        costs = [int(cost) for cost in args.costs.split(',')]
+    else:
+        costs = [auth.SCRYPT_N if args.algorithm == auth.SCRYPT else auth.PBKDF2_ITERATIONS]
+
+    print(f"cpus: {os.cpu_count()}, threads: {args.threads}, logins: {args.logins}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'logins.db')
+        database.configure(path, size=args.threads)
+        for cost in costs:
+            params = (cost, args.r, args.p) if args.algorithm == auth.SCRYPT else (cost,)
+            run(path, args.algorithm, params, args.users, args.logins, args.threads, args.seed)
+        time_sessions(100_000)
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
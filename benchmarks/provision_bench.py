@@ -0,0 +1,106 @@
+# Bulk user provisioning against one add_user call per student.
+#
+#     python -m benchmarks.provision_bench --users 1000 --workers 4
+#
+# Generates a roster with a share of invalid and repeated entries, then
+# times validating it with the compiled patterns in accounts.py against the
+# per-character checks add_user used to make, and adding everyone with
+# add_user in a loop against accounts.provision_users with one
+# process and with --workers processes hashing passwords.
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import accounts
+import database
+from main import add_user
+from migrations import migrate
+
+
+def make_roster(rng, count):
+    records = []
+    for i in range(count):
+        name = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(8)).capitalize()
+        record = {'name': name, 'email': f'student{i}@gmail.com', 'password': f'{name}{i}!'}
+        roll = rng.random()
+        if roll < 0.02:
+            record['email'] = f'student{i}@example.com'
+        elif roll < 0.04:
+            record['password'] = 'short'
+        elif roll < 0.06:
+            record['email'] = f'student{rng.randrange(max(i, 1))}@gmail.com'
+        records.append(record)
+    return list(enumerate(records, start=1))
+
+
+# the checks add_user made before accounts.py
+def old_check(name, email, password):
+    return (
+        email.lower().endswith(("gmail.com", "gmail.org", "gmail.in"))
+        and len(password) >= 6
+        and any(c.isalpha() for c in password)
+        and any(c.isdigit() for c in password)
+        and any(c.isascii() and not c.isalnum() for c in password)
+        and name.isalpha()
+    )
+
+
+def fresh_database(directory, name):
+    path = os.path.join(directory, f'{name}.db')
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    connection.close()
+    database.configure(path)
+
+
+def one_by_one(roster):
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _, record in roster:
+            add_user(record['name'], record['email'], record['password'], 'user')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare bulk and per-user provisioning.")
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    roster = make_roster(random.Random(args.seed), args.users)
+    users = [(r['name'], r['email'].lower(), r['password']) for _, r in roster] * (30_000 // args.users + 1)
+
+    started = time.perf_counter()
+    for user in users:
+        old_check(*user)
+    old = time.perf_counter() - started
+    started = time.perf_counter()
+    for user in users:
+        accounts.check_user(*user)
+    new = time.perf_counter() - started
+    print(f"validating {len(users):,} users: {old * 1e6 / len(users):.2f} us each with per-character checks, "
+          f"{new * 1e6 / len(users):.2f} us with compiled patterns")
+
+    with tempfile.TemporaryDirectory() as directory:
+        fresh_database(directory, 'one_by_one')
+        started = time.perf_counter()
+        one_by_one(roster)
+        elapsed = time.perf_counter() - started
+        print(f"add_user per student:  {elapsed:7.2f}s  {args.users / elapsed:7,.0f} users/s")
+
+        for workers in sorted({1, args.workers}):
+            fresh_database(directory, f'bulk{workers}')
+            stats = accounts.provision_users(roster, workers)
+            label = f"{workers} {'processes' if workers > 1 else 'process'}"
+            print(f"provision_users, {label:11}: "
+                  f"{stats.elapsed:7.2f}s  {args.users / stats.elapsed:7,.0f} users/s  ({stats.summary()})")
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Building and serving "also borrowed" recommendations.
+#
+#     python -m benchmarks.recommend_bench --loans 200000 --new-loans 2000
+#
+# Generates patrons who mostly borrow from one genre, then times
+# recommendations.rebuild() with NumPy (when installed) and plain Python,
+# refresh() after --new-loans more loans, and also_borrowed() lookups.
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import database
+import recommendations
+from migrations import migrate
+from timestamps import to_micros
+
+GENRES = 20
+
+
+def make_loans(rng, count, users, books, start):
+    per_genre = books // GENRES
+    for i in range(count):
+        user_id = rng.randint(1, users)
+        if rng.random() < 0.8:
+            book_id = user_id % GENRES * per_genre + rng.randint(1, per_genre)
+        else:
+            book_id = rng.randint(1, books)
+        yield user_id, book_id, to_micros(start + datetime.timedelta(seconds=i))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time building and serving recommendations.")
+    parser.add_argument('--loans', type=int, default=200_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--books', type=int, default=10_000)
+    parser.add_argument('--new-loans', type=int, default=2_000)
+    parser.add_argument('--lookups', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'library.db')
+        connection = sqlite3.connect(path)
+        migrate(connection)
+        connection.executemany(
+            'INSERT INTO books (title, author, isbn, genre, availability) VALUES (?, ?, ?, ?, 1)',
+            ((f'Title {i}', 'Author', f'{i:013d}', f'Genre {i % GENRES}') for i in range(args.books)),
+        )
+        connection.executemany(
+            'INSERT INTO transactions (user_id, book_id, borrowed_at) VALUES (?, ?, ?)',
+            make_loans(rng, args.loans, args.users, args.books, datetime.datetime(2024, 1, 1)),
+        )
+        connection.commit()
+        database.configure(path)
+
+        engines = [('NumPy', recommendations.numpy)] if recommendations.numpy is not None else []
+        for label, module in engines + [('plain Python', None)]:
+            recommendations.numpy = module
+            started = time.perf_counter()
+            books = recommendations.rebuild()
+            print(f"rebuild, {label:12}: {time.perf_counter() - started:6.2f}s for {args.loans:,} loans, "
+                  f"{books:,} books")
+
+        connection.executemany(
+            'INSERT INTO transactions (user_id, book_id, borrowed_at) VALUES (?, ?, ?)',
+            make_loans(rng, args.new_loans, args.users, args.books, datetime.datetime(2024, 6, 1)),
+        )
+        connection.commit()
+        started = time.perf_counter()
+        recommendations.refresh()
+        print(f"refresh: {time.perf_counter() - started:6.2f}s for {args.new_loans:,} new loans")
+
+        book_ids = [rng.randint(1, args.books) for _ in range(args.lookups)]
+        started = time.perf_counter()
+        for book_id in book_ids:
+            recommendations.also_borrowed(book_id, 10)
+        print(f"also_borrowed: {(time.perf_counter() - started) * 1e6 / args.lookups:.0f} us per lookup")
+        connection.close()
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
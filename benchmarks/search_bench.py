@@ -0,0 +1,91 @@
+# Search latency on a synthetic catalog.
+#
+#     python -m benchmarks.search_bench --books 1000000
+#
+# Builds a catalog of random titles in a temporary database, then times ranked
+# word/prefix searches and the trigram fallback for misspelled queries.
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import database
+import search
+from benchmarks.datagen import generate_books, split_vocabulary
+from migrations import migrate
+
+
+def misspell(text, rng):
+    letters = list(text)
+    i = rng.randrange(len(letters) - 1)
+    letters[i], letters[i + 1] = letters[i + 1], letters[i]
+    return ''.join(letters)
+
+
+def build(path, count, words, names, seed):
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    connection.executemany(
+        'INSERT INTO books (title, author, isbn, genre, availability) VALUES (?, ?, ?, ?, ?)',
+        generate_books(count, words, names, random.Random(seed)),
+    )
+    connection.commit()
+    connection.close()
+
+
+def time_queries(function, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        function(query)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'p50': statistics.median(timings),
+        'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        'max': timings[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time catalog searches on a synthetic catalog.")
+    parser.add_argument('--books', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words, names = split_vocabulary(rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'search.db')
+        started = time.perf_counter()
+        build(path, args.books, words, names, args.seed)
+        print(f"built {args.books:,} books in {time.perf_counter() - started:.1f}s")
+
+        database.configure(path)
+        # query with words people would actually look for, not the rarest ones
+        common = words[:2000]
+        two_words = [f'{rng.choice(common)} {rng.choice(common)}' for _ in range(args.queries)]
+        prefixes = [f'{rng.choice(common)} {rng.choice(common)[:3]}' for _ in range(args.queries)]
+        authors = [rng.choice(names[:2000]) for _ in range(args.queries)]
+        typos = [misspell(rng.choice(names[:2000]), rng) for _ in range(args.queries)]
+
+        cases = [
+            ('two words', search.ranked_search, two_words),
+            ('word + prefix', search.ranked_search, prefixes),
+            ('author', search.ranked_search, authors),
+            ('misspelled (trigram)', search.fuzzy_search, typos),
+        ]
+        for name, function, queries in cases:
+            result = time_queries(function, queries)
+            print(f"{name:22} p50 {result['p50']:7.2f} ms   p99 {result['p99']:7.2f} ms   max {result['max']:7.2f} ms")
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
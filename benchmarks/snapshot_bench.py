@@ -0,0 +1,120 @@
+# Memory per book of the catalog snapshot against plain rows.
+#
+#     python -m benchmarks.snapshot_bench --books 1000000 --changes 1000
+#
+# Measures, with tracemalloc, the Python heap taken by the whole books table
+# as the tuples fetchall() returns (what list_books and data.py used to
+# hold), as a list of Book records, as a snapshot.Catalog and as a
+# snapshot.MappedCatalog, whose columns live in the mapped file instead.
+# Then times an incremental refresh after --changes updates against a full
+# reload.
+
+import argparse
+import gc
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import database
+import snapshot
+from benchmarks.datagen import generate_books, split_vocabulary
+from migrations import migrate
+
+
+def prepare(path, books, seed):
+    rng = random.Random(seed)
+    words, names = split_vocabulary(rng)
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    connection.executemany(
+        'INSERT INTO books (title, author, isbn, genre, availability) VALUES (?, ?, ?, ?, ?)',
+        generate_books(books, words, names, rng),
+    )
+    connection.commit()
+    connection.close()
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size, elapsed
+
+
+def fetch_rows():
+    with database.get_connection() as connection:
+        return connection.execute('SELECT * FROM books').fetchall()
+
+
+def fetch_records():
+    with database.get_connection() as connection:
+        return [snapshot.Book(*row) for row in connection.execute(snapshot.BOOKS)]
+
+
+def report(name, size, elapsed, books):
+    print(f"{name:22} {size / books:8.1f} bytes/book  {size / 2 ** 20:9.1f} MiB  built in {elapsed:6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare catalog memory use per book.")
+    parser.add_argument('--books', type=int, default=100_000)
+    parser.add_argument('--changes', type=int, default=1_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'snapshot.db')
+        prepare(path, args.books, args.seed)
+        database.configure(path)
+
+        rows, size, elapsed = measure(fetch_rows)
+        report('tuples (fetchall)', size, elapsed, args.books)
+        del rows
+
+        records, size, elapsed = measure(fetch_records)
+        report('Book records', size, elapsed, args.books)
+        del records
+
+        catalog, size, elapsed = measure(snapshot.Catalog.load)
+        report('Catalog columns', size, elapsed, args.books)
+
+        snapshot_path = os.path.join(directory, 'catalog.snap')
+        started = time.perf_counter()
+        catalog.write(snapshot_path)
+        print(f"snapshot file: {os.path.getsize(snapshot_path) / args.books:.1f} bytes/book, "
+              f"written in {time.perf_counter() - started:.2f}s")
+
+        mapped, size, elapsed = measure(lambda: snapshot.MappedCatalog(snapshot_path))
+        report('MappedCatalog (heap)', size, elapsed, args.books)
+        rng = random.Random(args.seed)
+        lookups = [rng.randint(1, args.books) for _ in range(100_000)]
+        started = time.perf_counter()
+        for book_id in lookups:
+            mapped.get(book_id)
+        print(f"mapped get(): {(time.perf_counter() - started) / len(lookups) * 1e6:.2f} us per lookup")
+        mapped.close()
+
+        with database.get_connection() as connection:
+            connection.executemany(
+                'UPDATE books SET availability = availability + 1 WHERE id = ?',
+                ((rng.randint(1, args.books),) for _ in range(args.changes)),
+            )
+            connection.commit()
+        started = time.perf_counter()
+        applied = catalog.refresh()
+        print(f"refresh of {applied} changes: {(time.perf_counter() - started) * 1000:.1f} ms")
+        started = time.perf_counter()
+        snapshot.Catalog.load()
+        print(f"full reload: {(time.perf_counter() - started) * 1000:.1f} ms")
+        database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
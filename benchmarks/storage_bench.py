@@ -0,0 +1,84 @@
+# The storage engines side by side.
+#
+#     python -m benchmarks.storage_bench --books 20000 --users 2000 --loans 5000
+#
+# Runs the same workload through every engine in storage.py: adding books
+# and users one at a time, lookups by id, title and email, paging through
+# the catalog and borrow/return cycles. Prints operations per second.
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import storage
+
+ENGINES = storage.ENGINES
+
+
+def timed(operation, count):
+    started = time.perf_counter()
+    operation()
+    return count / (time.perf_counter() - started)
+
+
+def workload(engine, args, rng):
+    rates = {}
+    rates['add book'] = timed(lambda: [
+        engine.add_book(f'Title {i}', f'Author {i % 1000}', f'{i:013d}', 'Fiction', 2) for i in range(args.books)
+    ], args.books)
+    rates['add user'] = timed(lambda: [
+        engine.add_user(f'user{i}', f'user{i}@gmail.com', 'hash', 'user') for i in range(args.users)
+    ], args.users)
+
+    book_ids = [rng.randint(1, args.books) for _ in range(args.lookups)]
+    titles = [f'Title {book_id - 1}' for book_id in book_ids]
+    emails = [f'user{rng.randrange(args.users)}@gmail.com' for _ in range(args.lookups)]
+    rates['book by id'] = timed(lambda: [engine.book(book_id) for book_id in book_ids], args.lookups)
+    rates['find by title'] = timed(lambda: [engine.find_books(title) for title in titles], args.lookups)
+    rates['user by email'] = timed(lambda: [engine.user_by_email(email) for email in emails], args.lookups)
+
+    def walk():
+        after_id = 0
+        while True:
+            page = engine.books_page(after_id, 100)
+            if not page:
+                return
+            after_id = page[-1].id
+    rates['page (100 books)'] = timed(walk, args.books / 100)
+
+    loans = [(rng.randint(1, args.users), rng.randint(1, args.books)) for _ in range(args.loans)]
+    rates['borrow'] = timed(lambda: [engine.checkout(user_id, book_id) for user_id, book_id in loans], args.loans)
+    rates['return'] = timed(lambda: [engine.checkin(user_id, book_id) for user_id, book_id in loans], args.loans)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the storage engines.")
+    parser.add_argument('--books', type=int, default=20_000)
+    parser.add_argument('--users', type=int, default=2_000)
+    parser.add_argument('--lookups', type=int, default=20_000)
+    parser.add_argument('--loans', type=int, default=5_000)
+    parser.add_argument('--engines', default=','.join(ENGINES), help="comma-separated")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.engines.split(','):
+            spec = f'sqlite:{os.path.join(directory, "bench.db")}' if name == 'sqlite' else name
+            engine = storage.open_engine(spec)
+            try:
+                results[name] = workload(engine, args, random.Random(args.seed))
+            finally:
+                engine.close()
+
+    names = list(results)
+    print(f"{'ops/s':18}" + ''.join(f'{name:>12}' for name in names))
+    for operation in results[names[0]]:
+        print(f"{operation:18}" + ''.join(f'{results[name][operation]:12,.0f}' for name in names))
+
+
+if __name__ == "__main__":
+    main()
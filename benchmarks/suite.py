@@ -0,0 +1,271 @@
+# Benchmark suite for the data-access functions.
+#
+#     python -m benchmarks.suite run --scale 100k --output before.json
+#     python -m benchmarks.suite run --scale 100k --output after.json
+#     python -m benchmarks.suite compare before.json after.json
+#
+# Each scale's database is generated once by benchmarks.datagen and kept in
+# --data-dir. Every run works on a fresh copy, so writes from one run never
+# leak into the next. Lookups are timed cold, with the caches cleared before
+# every call, and separately warm where a cache applies.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+
+import cache
+import circulation
+import database
+import main as library
+import pagination
+import penalties
+import search
+from benchmarks.datagen import PASSWORD, SCALES, build_scale
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '.data')
+REPEAT = 200
+THRESHOLD = 0.20
+# differences smaller than this are timer noise, whatever the percentage
+MIN_DELTA_MS = 0.02
+
+
+def _sample_books(path, rng, count):
+    connection = sqlite3.connect(path)
+    total = connection.execute('SELECT MAX(id) FROM books').fetchone()[0]
+    rows = [
+        connection.execute('SELECT id, title, author FROM books WHERE id = ?', (rng.randint(1, total),)).fetchone()
+        for _ in range(count)
+    ]
+    users = connection.execute('SELECT MAX(id) FROM users').fetchone()[0]
+    loans = connection.execute('SELECT MAX(id) FROM transactions').fetchone()[0] or 0
+    connection.close()
+    return rows, total, users, loans
+
+
+def _cold(function):
+    def call(*args):
+        cache.invalidate_all_books()
+        cache.user_ids.clear()
+        return function(*args)
+    return call
+
+
+# Each benchmark is (setup, function). setup(context, rng, repeat) returns the
+# argument tuples for each timed call.
+def _books(context, rng, repeat):
+    return [(title, author) for _, title, author in rng.choices(context['books'], k=repeat)]
+
+
+# a few popular books asked for over and over, so the caches get hits
+def _hot_books(context, rng, repeat):
+    return [(title, author) for _, title, author in rng.choices(context['books'][:20], k=repeat)]
+
+
+def _hot_titles(context, rng, repeat):
+    return [(title,) for title, _ in _hot_books(context, rng, repeat)]
+
+
+def _titles(context, rng, repeat):
+    return [(title,) for _, title, _ in rng.choices(context['books'], k=repeat)]
+
+
+def _book_cursors(context, rng, repeat):
+    return [(str(rng.randint(0, context['total'])),) for _ in range(repeat)]
+
+
+def _loan_cursors(context, rng, repeat):
+    return [(str(rng.randint(0, context['loans'])),) for _ in range(repeat)]
+
+
+def _new_books(context, rng, repeat):
+    return [(f'Bench Title {rng.random()}', 'Bench Author', None, 'Fiction', 3) for _ in range(repeat)]
+
+
+def _checkouts(context, rng, repeat):
+    return [(rng.randint(1, context['users']), book_id) for book_id, _, _ in rng.choices(context['books'], k=repeat)]
+
+
+def _returns(context, rng, repeat):
+    # lend the books first so every timed return finds its loan
+    arguments = []
+    for book_id, title, author in rng.choices(context['books'], k=repeat):
+        user_id = rng.randint(1, context['users'])
+        with database.get_connection() as connection:
+            connection.execute('UPDATE books SET availability = availability + 1 WHERE id = ?', (book_id,))
+            connection.commit()
+        circulation.checkout(user_id, book_id)
+        arguments.append((user_id, title, author))
+    return arguments
+
+
+def _logins(context, rng, repeat):
+    connection = sqlite3.connect(context['path'])
+    rows = [
+        (connection.execute('SELECT email FROM users WHERE id = ?', (rng.randint(1, context['users']),)).fetchone()[0],
+         PASSWORD)
+        for _ in range(repeat)
+    ]
+    connection.close()
+    return rows
+
+
+def _walk_all_books():
+    for _ in pagination.iter_pages(pagination.books_page, 500):
+        pass
+
+
+BENCHMARKS = {
+    'add_book': (_new_books, library.insert_book),
+    'borrow_book': (_checkouts, circulation.checkout),
+    'return_book': (_returns, circulation.checkin_by_title),
+    'get_book_id_by_name_author': (_books, _cold(library.get_book_id_by_name_author)),
+    'get_book_id_by_name_author_cached': (_hot_books, library.get_book_id_by_name_author),
+    'find_book': (_titles, _cold(library.get_book_by_title)),
+    'find_book_cached': (_hot_titles, library.get_book_by_title),
+    'search_books': (_titles, search.search_books),
+    'list_books_page': (_book_cursors, _cold(pagination.books_page)),
+    'available_books_page': (_book_cursors, _cold(pagination.available_books_page)),
+    'user_transactions_page': (_loan_cursors, pagination.transactions_page),
+    # dominated by the password hash, see benchmarks/login_bench.py
+    'login_user': (_logins, library.check_login),
+    # a full walk is slow at large scales, so it only runs a few times
+    'list_books_all': (lambda context, rng, repeat: [()] * 3, _cold(_walk_all_books)),
+    'overdue_report': (lambda context, rng, repeat: [()] * 3, penalties.overdue_report),
+}
+
+
+def time_calls(function, arguments):
+    timings = []
+    for args in arguments:
+        started = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    mean = statistics.fmean(timings)
+    return {
+        'calls': len(timings),
+        'mean_ms': mean * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'min_ms': timings[0] * 1000,
+        'ops_per_sec': 1 / mean if mean else None,
+    }
+
+
+def prepare(scale, data_dir, seed):
+    os.makedirs(data_dir, exist_ok=True)
+    base = os.path.join(data_dir, f'library-{scale}-seed{seed}.db')
+    if not os.path.exists(base):
+        print(f"generating {scale} dataset in {base} ...", file=sys.stderr)
+        build_scale(base + '.tmp', scale, seed)
+        os.replace(base + '.tmp', base)
+
+    work = os.path.join(data_dir, f'work-{scale}.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(base, work)
+    return work
+
+
+def run(scale, repeat, data_dir, seed, only=None):
+    path = prepare(scale, data_dir, seed)
+    database.configure(path)
+
+    rng = random.Random(seed)
+    books, total, users, loans = _sample_books(path, rng, 1000)
+    context = {'path': path, 'books': books, 'total': total, 'users': users, 'loans': loans}
+
+    results = {}
+    for name, (setup, function) in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        arguments = setup(context, rng, repeat)
+        results[name] = time_calls(function, arguments)
+        print(f"{name:36} median {results[name]['median_ms']:9.3f} ms   p95 {results[name]['p95_ms']:9.3f} ms",
+              file=sys.stderr)
+
+    database.close_pool()
+    return {
+        'meta': {
+            'scale': scale,
+            'seed': seed,
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+
+
+# returns (name, before, after, change, regressed) for every benchmark in
+# both runs; a regression is a median slower by more than threshold and by
+# more than min_delta milliseconds
+def compare(before, after, threshold=THRESHOLD, min_delta=MIN_DELTA_MS):
+    rows = []
+    for name, old in before['results'].items():
+        new = after['results'].get(name)
+        if new is None:
+            continue
+        old_ms, new_ms = old['median_ms'], new['median_ms']
+        change = (new_ms - old_ms) / old_ms if old_ms else 0.0
+        rows.append((name, old_ms, new_ms, change, change > threshold and new_ms - old_ms > min_delta))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the library's data-access functions.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--scale', choices=SCALES, default='10k')
+    run_parser.add_argument('--repeat', type=int, default=REPEAT)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--data-dir', default=DATA_DIR)
+    run_parser.add_argument('--only', help="comma-separated benchmark names")
+    run_parser.add_argument('--output', help="write JSON results here instead of stdout")
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                                help="relative slowdown of the median that counts as a regression")
+    compare_parser.add_argument('--min-delta-ms', type=float, default=MIN_DELTA_MS)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        only = set(args.only.split(',')) if args.only else None
+        result = run(args.scale, args.repeat, args.data_dir, args.seed, only)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(result, output, indent=2)
+        else:
+            print(json.dumps(result, indent=2))
+        return
+
+    with open(args.before) as before, open(args.after) as after:
+        before, after = json.load(before), json.load(after)
+    if before['meta']['scale'] != after['meta']['scale']:
+        print(f"Warning: comparing scale {before['meta']['scale']} with {after['meta']['scale']}")
+
+    rows = compare(before, after, args.threshold, args.min_delta_ms)
+    for name, old, new, change, regressed in rows:
+        flag = 'REGRESSION' if regressed else ''
+        print(f"{name:36} {old:9.3f} ms -> {new:9.3f} ms  {change:+7.1%}  {flag}")
+    if any(row[4] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# Branch shards: each branch's books, loans and holds in a file of its own.
+#
+#     python branches.py add downtown
+#     python branches.py add-book downtown "Dune" "Frank Herbert" 9780441013593 Fiction 2
+#     python branches.py borrow downtown ann@gmail.com 1
+#     python branches.py books
+#     python branches.py find "Dune"
+#     python branches.py loans ann@gmail.com
+#
+# With a single database file every branch's desks wait on one write lock.
+# Here each branch is a SQLite file (branches/<name>.db) with its own
+# connection pool and storage.SQLiteEngine, so a checkout at one branch
+# never waits for another. Users stay global in the library database
+# (database.py's pool), so accounts, logins and sessions are unchanged. A
+# branch's users table only keeps the id and role of patrons who borrowed
+# there, for circulation.POLICIES.
+#
+# A book is identified by its branch and its id in that branch. Writes go
+# to one branch. Catalog and loan history queries run on every branch at
+# once on a thread pool (SQLite releases the GIL while it works) and the
+# results are merged. ATTACH would do the same in one statement, but SQLite
+# attaches at most 10 databases by default.
+
+import argparse
+import heapq
+import os
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import circulation
+import database
+import storage
+from database import get_connection
+from migrations import migrate
+from snapshot import Book
+
+BRANCH_DIR = 'branches'
+# branch names become file names
+NAME = re.compile(r'[a-z0-9][a-z0-9_-]*')
+FAN_OUT_WORKERS = 16
+
+BranchLoan = namedtuple('BranchLoan', 'branch id book_id title borrowed_at returned_at')
+
+
+def _role(user_id):
+    with get_connection() as connection:
+        row = connection.execute('SELECT role FROM users WHERE id = ?', (user_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"Unknown user {user_id}")
+    return row[0]
+
+
+def _remember_patron(cursor, user_id, role):
+    cursor.execute('''
+        INSERT INTO users (id, role) VALUES (?, ?)
+        ON CONFLICT (id) DO UPDATE SET role = excluded.role
+        WHERE role IS NOT excluded.role
+    ''', (user_id, role))
+
+
+def _books(engine):
+    with engine.pool.connection() as connection:
+        rows = connection.execute('''
+            SELECT id, title, author, isbn, genre, availability
+            FROM books ORDER BY title, author, id
+        ''').fetchall()
+    return [Book(*row) for row in rows]
+
+
+def _loans(engine, user_id):
+    with engine.pool.connection() as connection:
+        return connection.execute('''
+            SELECT transactions.id, transactions.book_id, books.title,
+                   transactions.borrowed_at, transactions.returned_at
+            FROM transactions
+            LEFT JOIN books ON books.id = transactions.book_id
+            WHERE transactions.user_id = ?
+            ORDER BY transactions.borrowed_at DESC
+        ''', (user_id,)).fetchall()
+
+
+class Branches:
+    def __init__(self, directory=BRANCH_DIR, pool_size=database.POOL_SIZE, workers=FAN_OUT_WORKERS):
+        self.directory = directory
+        self.pool_size = pool_size
+        self._engines = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='branch')
+        os.makedirs(directory, exist_ok=True)
+        for filename in sorted(os.listdir(directory)):
+            name, extension = os.path.splitext(filename)
+            if extension == '.db' and NAME.fullmatch(name):
+                self._open(name)
+
+    def _open(self, name):
+        pool = database.ConnectionPool(os.path.join(self.directory, f'{name}.db'), self.pool_size)
+        engine = self._engines[name] = storage.SQLiteEngine(pool)
+        return engine
+
+    def names(self):
+        return sorted(self._engines)
+
+    def add_branch(self, name):
+        if NAME.fullmatch(name) is None:
+            raise ValueError(f"Invalid branch name {name!r}, use lowercase letters, digits, - and _")
+        with self._lock:
+            return self._engines.get(name) or self._open(name)
+
+    def engine(self, branch):
+        try:
+            return self._engines[branch]
+        except KeyError:
+            raise ValueError(f"Unknown branch {branch!r}") from None
+
+    # [(branch, function(engine))] for every branch, run at the same time
+    def _fan_out(self, function, *args):
+        with self._lock:
+            engines = sorted(self._engines.items())
+        futures = [(name, self._executor.submit(function, engine, *args)) for name, engine in engines]
+        return [(name, future.result()) for name, future in futures]
+
+    def add_book(self, branch, title, author, isbn, genre, availability):
+        return self.engine(branch).add_book(title, author, isbn, genre, availability)
+
+    # through the engine, like return_book, in one transaction with noting
+    # the patron
+    def borrow_book(self, branch, user_id, book_id, now=None):
+        role = _role(user_id)
+
+        def checkout(cursor, user_id, book_id, now):
+            _remember_patron(cursor, user_id, role)
+            return circulation._checkout(cursor, user_id, book_id, now)
+
+        return self.engine(branch)._circulate(checkout, user_id, book_id, now)
+
+    def return_book(self, branch, user_id, book_id, now=None):
+        return self.engine(branch).checkin(user_id, book_id, now)
+
+    # [(branch, Book)] of every branch, by title and author
+    def list_books(self):
+        return list(heapq.merge(
+            *([(name, book) for book in books] for name, books in self._fan_out(_books)),
+            key=lambda item: (item[1].title, item[1].author),
+        ))
+
+    # [(branch, Book)], branch by branch
+    def find_book(self, title, author=None):
+        return [
+            (name, book)
+            for name, books in self._fan_out(storage.SQLiteEngine.find_books, title, author)
+            for book in books
+        ]
+
+    # [BranchLoan] of one patron at every branch, newest first
+    def user_transactions(self, user_id):
+        return list(heapq.merge(
+            *([BranchLoan(name, *row) for row in rows] for name, rows in self._fan_out(_loans, user_id)),
+            key=lambda loan: loan.borrowed_at, reverse=True,
+        ))
+
+    def close(self):
+        self._executor.shutdown()
+        for engine in self._engines.values():
+            engine.close()
+        self._engines.clear()
+
+
+_branches = None
+_branches_lock = threading.Lock()
+
+
+def configure(directory=BRANCH_DIR, pool_size=database.POOL_SIZE):
+    global _branches
+    branches = Branches(directory, pool_size)
+    with _branches_lock:
+        previous, _branches = _branches, branches
+    if previous is not None:
+        previous.close()
+    return branches
+
+
+def get_branches(environ=os.environ):
+    global _branches
+    if _branches is None:
+        with _branches_lock:
+            if _branches is None:
+                _branches = Branches(environ.get('LIBRARY_BRANCHES', BRANCH_DIR))
+    return _branches
+
+
+def _user_id(email):
+    with get_connection() as connection:
+        row = connection.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+    if row is None:
+        raise ValueError(f"No user with email {email}")
+    return row[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage books and loans across branches.")
+    parser.add_argument('--directory', default=BRANCH_DIR, help="where the branch databases are")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('add', help="add a branch").add_argument('branch')
+    add_book_parser = commands.add_parser('add-book', help="add a book to a branch")
+    for argument in ('branch', 'title', 'author', 'isbn', 'genre'):
+        add_book_parser.add_argument(argument)
+    add_book_parser.add_argument('availability', type=int)
+    for command in ('borrow', 'return'):
+        command_parser = commands.add_parser(command, help=f"{command} a book at a branch")
+        command_parser.add_argument('branch')
+        command_parser.add_argument('email')
+        command_parser.add_argument('book_id', type=int)
+    commands.add_parser('books', help="list the books of every branch")
+    find_parser = commands.add_parser('find', help="find a title at every branch")
+    find_parser.add_argument('title')
+    find_parser.add_argument('--author')
+    commands.add_parser('loans', help="a patron's loans at every branch").add_argument('email')
+    args = parser.parse_args()
+
+    try:
+        with get_connection() as connection:
+            migrate(connection)
+        branches = configure(args.directory)
+        if args.command == 'add':
+            branches.add_branch(args.branch)
+            print(f"Branches: {', '.join(branches.names())}")
+        elif args.command == 'add-book':
+            book_id = branches.add_book(args.branch, args.title, args.author, args.isbn, args.genre,
+                                        args.availability)
+            print(f"Added book {book_id} at {args.branch}")
+        elif args.command in ('borrow', 'return'):
+            operation = branches.borrow_book if args.command == 'borrow' else branches.return_book
+            result = operation(args.branch, _user_id(args.email), args.book_id)
+            print(f"{result.status}" + (f", penalty ${result.penalty}" if result.penalty else ""))
+        elif args.command == 'loans':
+            for loan in branches.user_transactions(_user_id(args.email)):
+                print(f"{loan.branch}: {loan.title} (book {loan.book_id}), borrowed {loan.borrowed_at:%Y-%m-%d %H:%M}, "
+                      f"returned {loan.returned_at or 'not yet'}")
+        else:
+            found = branches.list_books() if args.command == 'books' else branches.find_book(args.title, args.author)
+            for branch, book in found:
+                print(f"{branch}: {book.id}. {book.title} by {book.author} - Genre: {book.genre}, "
+                      f"Available: {book.availability}")
+            if not found:
+                print("No books found.")
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
@@ -0,0 +1,233 @@
+# Streaming catalog import.
+#
+#     python bulk_import.py catalog.csv --batch-size 5000 --rejects rejects.csv
+#
+# Records are read lazily from CSV or JSON Lines, validated, deduplicated by
+# ISBN and written with executemany, one transaction per batch. The position
+# reached in the source is committed with every batch, so an interrupted
+# import picks up where it stopped when run again.
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import sqlite3
+import time
+from itertools import islice
+
+import cache
+from database import get_connection
+from timestamps import to_micros
+from migrations import migrate
+
+BATCH_SIZE = 5000
+
+# keep well below SQLite's limit on bound parameters
+LOOKUP_CHUNK = 500
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.rejects = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"read {self.read}, inserted {self.inserted}, duplicates {self.duplicates}, "
+            f"rejected {len(self.rejects)}, resumed past {self.skipped} "
+            f"in {self.elapsed:.2f}s ({self.rate:,.0f} records/s)"
+        )
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as source:
+        for position, record in enumerate(csv.DictReader(source), start=1):
+            yield position, record
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as source:
+        for position, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line:
+                yield position, None
+                continue
+            try:
+                yield position, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield position, f"invalid JSON: {e.msg}"
+
+
+def read_records(path):
+    if path.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return read_jsonl(path)
+    return read_csv(path)
+
+
+def normalize_isbn(value):
+    isbn = str(value or '').replace('-', '').replace(' ', '').upper()
+
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        digits = [10 if c == 'X' else int(c) for c in isbn]
+        if sum((10 - i) * d for i, d in enumerate(digits)) % 11 == 0:
+            return isbn
+    elif len(isbn) == 13 and isbn.isdigit():
+        if sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(isbn)) % 10 == 0:
+            return isbn
+    return None
+
+
+# returns (row, None) for a good record or (None, reason) for a bad one
+def validate(record):
+    if record is None:
+        return None, "empty record"
+    if isinstance(record, str):
+        return None, record
+    if not isinstance(record, dict):
+        return None, "record is not an object"
+
+    title = str(record.get('title') or '').strip()
+    author = str(record.get('author') or '').strip()
+    genre = str(record.get('genre') or '').strip()
+    if not title:
+        return None, "missing title"
+    if not author:
+        return None, "missing author"
+
+    isbn = normalize_isbn(record.get('isbn'))
+    if isbn is None:
+        return None, f"invalid ISBN {record.get('isbn')!r}"
+
+    availability = record.get('availability')
+    try:
+        availability = 1 if availability in (None, '') else int(availability)
+    except (TypeError, ValueError):
+        return None, f"invalid availability {availability!r}"
+    if availability < 0:
+        return None, "availability cannot be negative"
+
+    return (title, author, isbn, genre, availability), None
+
+
+def existing_isbns(cursor, isbns):
+    found = set()
+    isbns = list(isbns)
+    for start in range(0, len(isbns), LOOKUP_CHUNK):
+        chunk = isbns[start:start + LOOKUP_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        cursor.execute(f'SELECT isbn FROM books WHERE isbn IN ({placeholders})', chunk)
+        found.update(row[0] for row in cursor)
+    return found
+
+
+def get_checkpoint(cursor, source):
+    cursor.execute('SELECT position FROM import_checkpoints WHERE source = ?', (source,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _write_batch(connection, source, position, rows, stats):
+    cursor = connection.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # rows from a previous, interrupted run are already in the table
+        present = existing_isbns(cursor, rows)
+        fresh = [row for isbn, row in rows.items() if isbn not in present]
+
+        cursor.executemany('''
+            INSERT INTO books (title, author, isbn, genre, availability)
+            VALUES (?, ?, ?, ?, ?)
+        ''', fresh)
+        cursor.execute('''
+            INSERT INTO import_checkpoints (source, position, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (source) DO UPDATE SET position = excluded.position, updated_at = excluded.updated_at
+        ''', (source, position, to_micros(datetime.datetime.now())))
+        connection.commit()
+    except sqlite3.Error:
+        connection.rollback()
+        raise
+
+    stats.inserted += len(fresh)
+    stats.duplicates += len(present)
+    if fresh:
+        cache.invalidate_all_books()
+
+
+def import_books(path, batch_size=BATCH_SIZE, resume=True, records=None):
+    source = os.path.abspath(path)
+    stats = ImportStats()
+
+    with get_connection() as connection:
+        start = get_checkpoint(connection.cursor(), source) if resume else 0
+        records = read_records(path) if records is None else records
+        if start:
+            records = islice(records, start, None)
+            stats.skipped = start
+
+        seen = set()
+        batch = {}
+        position = start
+        for position, record in records:
+            stats.read += 1
+            row, reason = validate(record)
+            if row is None:
+                stats.rejects.append((position, reason))
+                continue
+
+            isbn = row[2]
+            if isbn in seen:
+                stats.duplicates += 1
+                continue
+            seen.add(isbn)
+            batch[isbn] = row
+
+            if len(batch) >= batch_size:
+                _write_batch(connection, source, position, batch, stats)
+                batch = {}
+
+        # the final checkpoint also covers trailing rejects and duplicates
+        _write_batch(connection, source, position, batch, stats)
+
+    stats.elapsed = time.perf_counter() - stats.started
+    return stats
+
+
+def write_rejects(path, rejects):
+    with open(path, 'w', newline='', encoding='utf-8') as target:
+        writer = csv.writer(target)
+        writer.writerow(('position', 'reason'))
+        writer.writerows(rejects)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import books from a CSV or JSON Lines file.")
+    parser.add_argument('path')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--restart', action='store_true', help="ignore the saved checkpoint")
+    parser.add_argument('--rejects', help="write rejected records to this CSV file")
+    args = parser.parse_args()
+
+    try:
+        with get_connection() as connection:
+            migrate(connection)
+        stats = import_books(args.path, args.batch_size, resume=not args.restart)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+    print(stats.summary())
+    if args.rejects:
+        write_rejects(args.rejects, stats.rejects)
+    else:
+        for position, reason in stats.rejects[:20]:
+            print(f"  record {position}: {reason}")
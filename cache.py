@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import OrderedDict
+
+MAXSIZE = 4096
+TTL = 300  # seconds
+
+MISSING = object()
+
+
+# Thread-safe LRU cache whose entries also expire after ttl seconds. Entries
+# can carry tags, so everything derived from one book can be dropped at once
+# without knowing every key it was cached under.
+#
+# The cache lives in one process. Writes made by another process are only
+# noticed when entries expire, so keep the ttl short where that matters.
+class LRUCache:
+    def __init__(self, name, maxsize=MAXSIZE, ttl=TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        # bumped by every invalidation, so a value read from the database
+        # before a concurrent write is not cached after it
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            value, expires, _ = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, tags=(), generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    # read-through lookup; tags is a function of the loaded value
+    def get_or_load(self, key, load, tags=None):
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+
+        generation = self._generation
+        value = load()
+        self.put(key, value, tags(value) if tags else (), generation)
+        return value
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self._generation += 1
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+# (title, author) -> book id, for borrowing by name
+book_ids = LRUCache('book_ids')
+# title -> full books row, for find_book
+books = LRUCache('books')
+# email -> user id
+user_ids = LRUCache('user_ids')
+# (query, cursor, limit) -> page of list_books / available_books
+book_pages = LRUCache('book_pages', maxsize=256)
+
+CACHES = (book_ids, books, user_ids, book_pages)
+
+
+def book_tag(book_id):
+    return ('book', book_id)
+
+
+# call after a write to books has been committed; pass whatever is known
+# about the book before and after the change
+def invalidate_book(book_id=None, title=None, author=None):
+    if title is not None:
+        books.invalidate(title)
+        if author is not None:
+            book_ids.invalidate((title, author))
+    if book_id is not None:
+        books.invalidate_tag(book_tag(book_id))
+        book_ids.invalidate_tag(book_tag(book_id))
+    # every listing page shows availability, so any change can touch any page
+    book_pages.clear()
+
+
+def invalidate_all_books():
+    book_ids.clear()
+    books.clear()
+    book_pages.clear()
+
+
+def invalidate_user(email):
+    user_ids.invalidate(email)
+
+
+def stats():
+    return {cache.name: cache.stats() for cache in CACHES}
+
+
+def format_stats():
+    lines = []
+    for name, counters in stats().items():
+        lines.append(name + ': ' + ', '.join(f'{key} {value}' for key, value in counters.items()))
+    return '\n'.join(lines)
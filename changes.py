@@ -0,0 +1,127 @@
+# Change stream of the catalog, loans and users.
+#
+#     python changes.py tail --since 0 --follow > changes.jsonl
+#     python changes.py tail --state mirror.seq --follow
+#     python changes.py prune --older-than-days 30
+#
+# Triggers from migration 10 append a row to change_log for every book
+# added, updated or deleted, every borrow and return and every user added,
+# updated or deleted, in the same transaction as the change itself, so
+# nothing that commits can be missed and nothing rolled back shows up. Each
+# row has a sequence number that only grows. A mirror copies the tables
+# once, noting latest_sequence() first, then applies read_changes(since)
+# batches and remembers the last seq it applied.
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+
+from database import get_connection
+from timestamps import to_micros
+
+BATCH_SIZE = 500
+POLL_INTERVAL = 1.0  # seconds
+
+# entity is 'book', 'loan' or 'user'; op is 'insert', 'update' or 'delete'
+# for books and users, 'borrow' or 'return' for loans; data is the row after
+# the change (before it, for deletes)
+Change = namedtuple('Change', 'seq entity entity_id op data changed_at')
+
+CHANGES_SINCE = '''
+    SELECT seq, entity, entity_id, op, data, changed_at
+    FROM change_log
+    WHERE seq > ?
+    ORDER BY seq
+    LIMIT ?
+'''
+
+
+def latest_sequence():
+    with get_connection() as connection:
+        return connection.execute('SELECT IFNULL(MAX(seq), 0) FROM change_log').fetchone()[0]
+
+
+# the next batch_size changes after since, oldest first
+def read_changes(since=0, batch_size=BATCH_SIZE):
+    with get_connection() as connection:
+        rows = connection.execute(CHANGES_SINCE, (since, batch_size)).fetchall()
+    return [Change(seq, entity, entity_id, op, json.loads(data), changed_at)
+            for seq, entity, entity_id, op, data, changed_at in rows]
+
+
+# Yields batches of changes after since as they commit. Without follow it
+# stops once it has caught up; with it, it waits poll_interval seconds
+# whenever there is nothing new.
+def tail(since=0, batch_size=BATCH_SIZE, follow=False, poll_interval=POLL_INTERVAL):
+    while True:
+        batch = read_changes(since, batch_size)
+        if batch:
+            yield batch
+            since = batch[-1].seq
+        if len(batch) < batch_size:
+            if not follow:
+                return
+            time.sleep(poll_interval)
+
+
+# deletes changes logged before cutoff; consumers further behind than that
+# must copy the tables again
+def prune(cutoff):
+    with get_connection() as connection:
+        deleted = connection.execute(
+            'DELETE FROM change_log WHERE changed_at < ?', (to_micros(cutoff),),
+        ).rowcount
+        connection.commit()
+    return deleted
+
+
+def _read_state(path):
+    try:
+        with open(path) as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_state(path, seq):
+    partial = path + '.tmp'
+    with open(partial, 'w') as file:
+        file.write(f'{seq}\n')
+    os.replace(partial, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the change log.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    tail_parser = commands.add_parser('tail', help="print changes as JSON lines")
+    tail_parser.add_argument('--since', type=int, help="last sequence number already seen")
+    tail_parser.add_argument('--state', help="file keeping the last sequence number printed")
+    tail_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    tail_parser.add_argument('--follow', action='store_true', help="keep waiting for new changes")
+    tail_parser.add_argument('--interval', type=float, default=POLL_INTERVAL)
+    prune_parser = commands.add_parser('prune', help="delete old changes")
+    prune_parser.add_argument('--older-than-days', type=int, required=True)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'prune':
+            cutoff = datetime.datetime.now() - datetime.timedelta(days=args.older_than_days)
+            print(f"Deleted {prune(cutoff)} changes")
+        else:
+            since = args.since if args.since is not None else _read_state(args.state) if args.state else 0
+            for batch in tail(since, args.batch_size, args.follow, args.interval):
+                for change in batch:
+                    sys.stdout.write(json.dumps(change._asdict(), default=str) + '\n')
+                sys.stdout.flush()
+                if args.state:
+                    _write_state(args.state, batch[-1].seq)
+    except sqlite3.Error as e:
+        print(f"Error: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        pass
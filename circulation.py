@@ -0,0 +1,275 @@
+import datetime
+from collections import namedtuple
+
+import cache
+import holds
+import timestamps
+from database import write_transaction
+
+# outcomes of a checkout or a return
+BORROWED = 'borrowed'
+RETURNED = 'returned'
+NOT_FOUND = 'not_found'
+UNAVAILABLE = 'unavailable'
+NOT_BORROWED = 'not_borrowed'
+
+LOAN_DAYS = 5
+PENALTY_PER_DAY = 2
+
+Result = namedtuple('Result', 'status book_id penalty')
+
+# max_fine of None means no cap
+Policy = namedtuple('Policy', 'loan_days per_day max_fine', defaults=(None,))
+
+DEFAULT_POLICY = Policy(LOAN_DAYS, PENALTY_PER_DAY)
+
+# Loan rules that differ from the default, keyed by (genre, role); None
+# matches any genre or role. policy_for tries (genre, role), then
+# (genre, None), then (None, role), then (None, None), the order of
+# policy_rank; penalties.py picks policies in SQL in the same order. For
+# example:
+#
+#     POLICIES[('Reference', None)] = Policy(loan_days=2, per_day=5)
+#     POLICIES[(None, 'staff')] = Policy(loan_days=30, per_day=0)
+POLICIES = {}
+
+
+# lower ranks are more specific and win
+def policy_rank(key):
+    genre, role = key
+    return genre is None, role is None
+
+
+def policy_for(genre, role):
+    for key in ((genre, role), (genre, None), (None, role), (None, None)):
+        policy = POLICIES.get(key)
+        if policy is not None:
+            return policy
+    return DEFAULT_POLICY
+
+
+def _micros(moment):
+    if isinstance(moment, int):
+        return moment
+    if isinstance(moment, str):
+        moment = datetime.datetime.fromisoformat(moment)
+    return timestamps.to_micros(moment)
+
+
+# whole days of 24 hours between two moments, counted on the epoch like
+# penalties.assess, so a change to or from daylight saving time moves no
+# loan across a day boundary
+def days_between(start, end):
+    return (_micros(end) - _micros(start)) // timestamps.MICROS_PER_DAY
+
+
+def calculate_penalty(borrowed_at, returned_at, policy=DEFAULT_POLICY):
+    days_borrowed = days_between(borrowed_at, returned_at)
+    penalty = max(0, days_borrowed - policy.loan_days) * policy.per_day
+    return penalty if policy.max_fine is None else min(penalty, policy.max_fine)
+
+
+# The _checkout/_checkin helpers only issue statements; the caller owns the
+# transaction so several of them can share one.
+
+def _checkout(cursor, user_id, book_id, now):
+    # a copy set aside for the patron's hold is already off the shelf
+    if holds._claim(cursor, user_id, book_id):
+        return _lend(cursor, user_id, book_id, now)
+
+    # taking a copy and checking there is one left is a single statement, so
+    # two desks can never both take the last copy
+    cursor.execute('''
+        UPDATE books
+        SET availability = availability - 1
+        WHERE id = ? AND availability > 0
+        RETURNING id
+    ''', (book_id,))
+    if cursor.fetchone() is None:
+        cursor.execute('SELECT 1 FROM books WHERE id = ?', (book_id,))
+        return Result(UNAVAILABLE if cursor.fetchone() else NOT_FOUND, book_id, 0)
+    return _lend(cursor, user_id, book_id, now)
+
+
+def _lend(cursor, user_id, book_id, now):
+    cursor.execute('''
+        INSERT INTO transactions (user_id, book_id, borrowed_at)
+        VALUES (?, ?, ?)
+    ''', (user_id, book_id, timestamps.to_micros(now)))
+    return Result(BORROWED, book_id, 0)
+
+
+def _checkout_by_title(cursor, user_id, title, author, now):
+    book_id = holds._ready_by_title(cursor, user_id, title, author)
+    if book_id is not None:
+        return _checkout(cursor, user_id, book_id, now)
+
+    cursor.execute('''
+        UPDATE books
+        SET availability = availability - 1
+        WHERE id = (
+            SELECT id FROM books
+            WHERE title = ? AND author = ? AND availability > 0
+            LIMIT 1
+        ) AND availability > 0
+        RETURNING id
+    ''', (title, author))
+    book = cursor.fetchone()
+    if book is None:
+        cursor.execute('SELECT id FROM books WHERE title = ? AND author = ?', (title, author))
+        book = cursor.fetchone()
+        return Result(UNAVAILABLE, book[0], 0) if book else Result(NOT_FOUND, None, 0)
+    return _lend(cursor, user_id, book[0], now)
+
+
+def _checkout_by_isbn(cursor, user_id, isbn, now):
+    book_id = holds._ready_by_isbn(cursor, user_id, isbn)
+    if book_id is not None:
+        return _checkout(cursor, user_id, book_id, now)
+
+    cursor.execute('''
+        UPDATE books
+        SET availability = availability - 1
+        WHERE id = (
+            SELECT id FROM books
+            WHERE isbn = ? AND availability > 0
+            LIMIT 1
+        ) AND availability > 0
+        RETURNING id
+    ''', (isbn,))
+    book = cursor.fetchone()
+    if book is None:
+        cursor.execute('SELECT id FROM books WHERE isbn = ?', (isbn,))
+        book = cursor.fetchone()
+        return Result(UNAVAILABLE, book[0], 0) if book else Result(NOT_FOUND, None, 0)
+    return _lend(cursor, user_id, book[0], now)
+
+
+def _checkin(cursor, user_id, book_id, now):
+    cursor.execute('''
+        UPDATE transactions
+        SET returned_at = ?
+        WHERE id = (
+            SELECT id
+            FROM transactions
+            WHERE user_id = ? AND book_id = ? AND returned_at IS NULL
+            ORDER BY id
+            LIMIT 1
+        )
+        RETURNING book_id, borrowed_at
+    ''', (timestamps.to_micros(now), user_id, book_id))
+    return _restock(cursor, user_id, cursor.fetchone(), now)
+
+
+def _checkin_by_isbn(cursor, user_id, isbn, now):
+    cursor.execute('''
+        UPDATE transactions
+        SET returned_at = ?
+        WHERE id = (
+            SELECT transactions.id
+            FROM transactions
+            JOIN books ON books.id = transactions.book_id
+            WHERE transactions.user_id = ? AND books.isbn = ?
+              AND transactions.returned_at IS NULL
+            ORDER BY transactions.id
+            LIMIT 1
+        )
+        RETURNING book_id, borrowed_at
+    ''', (timestamps.to_micros(now), user_id, isbn))
+    return _restock(cursor, user_id, cursor.fetchone(), now)
+
+
+def _checkin_by_title(cursor, user_id, title, author, now):
+    # find and close the loan in one statement; the row stays as history
+    cursor.execute('''
+        UPDATE transactions
+        SET returned_at = ?
+        WHERE id = (
+            SELECT transactions.id
+            FROM transactions
+            JOIN books ON books.id = transactions.book_id
+            WHERE transactions.user_id = ? AND books.title = ? AND books.author = ?
+              AND transactions.returned_at IS NULL
+            ORDER BY transactions.id
+            LIMIT 1
+        )
+        RETURNING book_id, borrowed_at
+    ''', (timestamps.to_micros(now), user_id, title, author))
+    return _restock(cursor, user_id, cursor.fetchone(), now)
+
+
+# passes the copy of a loan just closed to the first patron waiting for it,
+# or puts it back on the shelf
+def _restock(cursor, user_id, loan, now):
+    if loan is None:
+        return Result(NOT_BORROWED, None, 0)
+
+    book_id, borrowed_at = loan
+    holds._release(cursor, book_id, now)
+    return Result(RETURNED, book_id, calculate_penalty(borrowed_at, now, _policy(cursor, user_id, book_id)))
+
+
+def _policy(cursor, user_id, book_id):
+    if not POLICIES:
+        return DEFAULT_POLICY
+    cursor.execute('SELECT genre FROM books WHERE id = ?', (book_id,))
+    book = cursor.fetchone()
+    cursor.execute('SELECT role FROM users WHERE id = ?', (user_id,))
+    user = cursor.fetchone()
+    return policy_for(book[0] if book else None, user[0] if user else None)
+
+
+# Batch items are book ids (int) or ISBNs (str). Each item gets its own
+# Result, in order; an item that can't be borrowed or returned doesn't stop
+# the others.
+
+def _checkout_items(cursor, user_id, items, now):
+    return [
+        _checkout_by_isbn(cursor, user_id, item, now) if isinstance(item, str)
+        else _checkout(cursor, user_id, item, now)
+        for item in items
+    ]
+
+
+def _checkin_items(cursor, user_id, items, now):
+    return [
+        _checkin_by_isbn(cursor, user_id, item, now) if isinstance(item, str)
+        else _checkin(cursor, user_id, item, now)
+        for item in items
+    ]
+
+
+def _in_write_transaction(operation, *args):
+    with write_transaction() as cursor:
+        result = operation(cursor, *args, datetime.datetime.now())
+
+    results = result if isinstance(result, list) else [result]
+    changed = {item.book_id for item in results if item.status in (BORROWED, RETURNED)}
+    for book_id in changed:
+        cache.invalidate_book(book_id)
+    return result
+
+
+def checkout(user_id, book_id):
+    return _in_write_transaction(_checkout, user_id, book_id)
+
+
+def checkin(user_id, book_id):
+    return _in_write_transaction(_checkin, user_id, book_id)
+
+
+def checkout_by_title(user_id, title, author):
+    return _in_write_transaction(_checkout_by_title, user_id, title, author)
+
+
+def checkin_by_title(user_id, title, author):
+    return _in_write_transaction(_checkin_by_title, user_id, title, author)
+
+
+# all items in one transaction; returns a list of Results
+def checkout_many(user_id, items):
+    return _in_write_transaction(_checkout_items, user_id, list(items))
+
+
+def checkin_many(user_id, items):
+    return _in_write_transaction(_checkin_items, user_id, list(items))
@@ -0,0 +1,155 @@
+# Checks that every storage engine in storage.py behaves the same.
+#
+#     python conformance.py              all engines
+#     python conformance.py dict memory  only these
+#
+# Each check gets a fresh, empty engine and raises AssertionError when the
+# engine does something the interface doesn't promise. The SQLite file
+# engine runs against a temporary file.
+
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import traceback
+
+import circulation
+import storage
+
+
+def check_users(engine):
+    user_id = engine.add_user('Ann', 'ann@gmail.com', 'hash', 'user')
+    user = engine.user_by_email('ann@gmail.com')
+    assert user == (user_id, 'Ann', 'ann@gmail.com', 'hash', 'user'), user
+    assert engine.user_by_email('nobody@gmail.com') is None
+    try:
+        engine.add_user('Ann', 'ann@gmail.com', 'other', 'user')
+    except sqlite3.IntegrityError:
+        pass
+    else:
+        raise AssertionError("a repeated email was accepted")
+    assert engine.add_user('Bob', 'bob@gmail.com', 'hash', 'staff') != user_id
+    assert engine.delete_user(user_id)
+    assert not engine.delete_user(user_id)
+    assert engine.user_by_email('ann@gmail.com') is None
+
+
+def check_books(engine):
+    first = engine.add_book('Dune', 'Herbert', '9780441013593', 'Fiction', 2)
+    second = engine.add_book('Dune', 'Anderson', '9780765312624', 'Fiction', 1)
+    third = engine.add_book('Emma', 'Austen', '9780441013593', None, 0)
+    assert first < second < third
+    assert tuple(engine.book(first)) == (first, 'Dune', 'Herbert', '9780441013593', 'Fiction', 2)
+    assert engine.book(third + 1) is None
+    assert [book.id for book in engine.find_books('Dune')] == [first, second]
+    assert [book.id for book in engine.find_books('Dune', 'Anderson')] == [second]
+    assert engine.find_books('Dune', 'Austen') == []
+    assert [book.id for book in engine.books_by_isbn('9780441013593')] == [first, third]
+
+    assert engine.update_book(second, title='Dune Messiah', availability=3)
+    assert engine.book(second).availability == 3
+    assert [book.id for book in engine.find_books('Dune')] == [first]
+    assert [book.id for book in engine.find_books('Dune Messiah', 'Anderson')] == [second]
+    assert not engine.update_book(third + 1, title='Nothing')
+    try:
+        engine.update_book(first, shelf='A3')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("an unknown column was accepted")
+
+    # returned books are copies
+    book = engine.book(first)
+    book.availability = 99
+    assert engine.book(first).availability == 2
+
+    assert engine.delete_book(first)
+    assert not engine.delete_book(first)
+    assert engine.book(first) is None
+    assert engine.find_books('Dune') == []
+    assert [book.id for book in engine.books_by_isbn('9780441013593')] == [third]
+
+
+def check_pages(engine):
+    ids = [engine.add_book(f'Title {i}', 'Author', f'{i:013d}', 'Fiction', 1) for i in range(10)]
+    engine.delete_book(ids[4])
+    expected = ids[:4] + ids[5:]
+
+    seen = []
+    after_id = 0
+    while True:
+        page = engine.books_page(after_id, 3)
+        assert len(page) <= 3
+        if not page:
+            break
+        seen.extend(book.id for book in page)
+        after_id = page[-1].id
+    assert seen == expected, seen
+    assert engine.books_page(ids[-1]) == []
+
+
+def check_circulation(engine):
+    user_id = engine.add_user('Ann', 'ann@gmail.com', 'hash', 'user')
+    book_id = engine.add_book('Dune', 'Herbert', '9780441013593', 'Fiction', 2)
+    last_id = engine.add_book('Emma', 'Austen', '9780141439587', 'Fiction', 0)
+    borrowed_at = datetime.datetime(2024, 1, 1, 10, 0)
+
+    assert engine.checkout(user_id, book_id, borrowed_at).status == circulation.BORROWED
+    assert engine.checkout(user_id, book_id, borrowed_at + datetime.timedelta(days=1)).status == circulation.BORROWED
+    assert engine.book(book_id).availability == 0
+    assert engine.checkout(user_id, book_id).status == circulation.UNAVAILABLE
+    assert engine.checkout(user_id, last_id).status == circulation.UNAVAILABLE
+    assert engine.checkout(user_id, last_id + 1).status == circulation.NOT_FOUND
+
+    loans = engine.open_loans(user_id)
+    assert [(loan.book_id, loan.borrowed_at, loan.returned_at) for loan in loans] == [
+        (book_id, borrowed_at, None), (book_id, borrowed_at + datetime.timedelta(days=1), None),
+    ], loans
+
+    # the oldest loan is closed first, and fined past the loan period
+    returned_at = borrowed_at + datetime.timedelta(days=circulation.LOAN_DAYS + 3)
+    result = engine.checkin(user_id, book_id, returned_at)
+    assert result == (circulation.RETURNED, book_id, 3 * circulation.PENALTY_PER_DAY), result
+    assert [loan.id for loan in engine.open_loans(user_id)] == [loans[1].id]
+    assert engine.book(book_id).availability == 1
+
+    assert engine.checkin(user_id, book_id, borrowed_at + datetime.timedelta(days=2)).penalty == 0
+    assert engine.checkin(user_id, book_id).status == circulation.NOT_BORROWED
+    assert engine.checkin(user_id, last_id).status == circulation.NOT_BORROWED
+    assert engine.open_loans(user_id) == []
+    assert engine.book(book_id).availability == 2
+
+
+CHECKS = [check_users, check_books, check_pages, check_circulation]
+
+
+def run_checks(spec, checks=CHECKS):
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for number, check in enumerate(checks):
+            if spec == 'sqlite':
+                engine = storage.open_engine(f'sqlite:{os.path.join(directory, f"{number}.db")}')
+            elif spec == 'memory':
+                engine = storage.open_engine(f'memory:conformance{number}')
+            else:
+                engine = storage.open_engine(spec)
+            try:
+                check(engine)
+            except AssertionError as e:
+                lineno = traceback.extract_tb(e.__traceback__)[-1].lineno
+                failures.append((spec, f'{check.__name__}:{lineno}', str(e) or "assertion failed"))
+            finally:
+                engine.close()
+    return failures
+
+
+if __name__ == "__main__":
+    failures = []
+    for spec in sys.argv[1:] or storage.ENGINES:
+        failures.extend(run_checks(spec))
+    if failures:
+        for spec, name, message in failures:
+            print(f"{spec}: {name}: {message}")
+        sys.exit(1)
+    print("All engines conform.")
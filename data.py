@@ -1,73 +1,295 @@
+# Listings and exports of the library tables, read from a snapshot.
+#
+#     python data.py                                       print users, books and loans
+#     python data.py export --format csv --output dumps
+#     python data.py export --tables books --where "books:genre = 'Fiction'" --format parquet
+#     python data.py snapshot nightly.db
+#
+# Every command first brings the live database up to the latest migration,
+# then copies it with the SQLite backup API, SNAPSHOT_PAGES pages per step
+# with a pause in between so the copy doesn't hog the disk. The copy runs inside one read transaction, so it is
+# consistent as of its start and, the live database being in WAL mode,
+# borrows and returns carry on meanwhile. Listings and exports then read
+# the copy, however long they take. Parquet output needs pyarrow.
+
+import argparse
+import csv
+import json
+import os
 import sqlite3
-def create_connection():
-    connection = None
+import sys
+import tempfile
+import time
+
+import database
+import instrumentation
+from migrations import migrate
+from pagination import FETCH_SIZE
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+SNAPSHOT_PAGES = 256
+SNAPSHOT_PAUSE = 0.005  # seconds between backup steps
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+# the columns each table exports; users never export their password hash
+TABLES = {
+    'users': ('id', 'name', 'email', 'role'),
+    'books': ('id', 'title', 'author', 'isbn', 'genre', 'availability'),
+    'transactions': ('id', 'user_id', 'book_id', 'borrowed_at', 'returned_at'),
+    'holds': ('id', 'user_id', 'book_id', 'status', 'placed_at', 'ready_at', 'expires_at'),
+}
+
+
+# copies the live database to destination; returns the number of pages
+# copied
+def take_snapshot(destination, source=None, pages=SNAPSHOT_PAGES, pause=SNAPSHOT_PAUSE):
+    source = source or database.get_pool().database
+    live = sqlite3.connect(source, uri=source.startswith('file:'))
+    copy = sqlite3.connect(destination)
+    copied = 0
+
+    def step(status, remaining, total):
+        nonlocal copied
+        copied = total - remaining
+        if remaining:
+            time.sleep(pause)
+
     try:
-        connection = sqlite3.connect('new_library.db')  # 'library.db' is the SQLite database file
-        print(f"Connection to SQLite DB  successful")
-    except sqlite3.Error as e:
-        print(f"Error: {e}")
-    return connection
-def fetch_and_print_users():
-    connection = create_connection()
-    if connection is not None:
+        # Without a read transaction of its own the backup restarts every
+        # time another connection writes, and may never finish under load.
+        live.execute('BEGIN')
+        live.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        live.backup(copy, pages=pages, progress=step)
+        # the copy is read on its own, without -wal and -shm files
+        copy.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        live.close()
+        copy.close()
+    return copied
+
+
+# with the pool's connection factory, so instrumentation counts the reads
+def open_snapshot(path):
+    return sqlite3.connect(
+        f'file:{path}?mode=ro', uri=True, detect_types=sqlite3.PARSE_DECLTYPES,
+        factory=database.get_pool().factory,
+    )
+
+
+# (columns, rows) of table, rows streamed a batch at a time; where is an SQL
+# condition on the table's columns
+def read_table(connection, table, where=None, size=FETCH_SIZE):
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table!r}")
+    columns = TABLES[table]
+    cursor = connection.execute(
+        f"SELECT {', '.join(columns)} FROM {table}" + (f' WHERE {where}' if where else '') + ' ORDER BY id'
+    )
+
+    def rows():
         try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT * FROM users')
-            users = cursor.fetchall()
+            while True:
+                batch = cursor.fetchmany(size)
+                if not batch:
+                    return
+                yield from batch
+        finally:
+            cursor.close()
+
+    return columns, rows()
+
+
+def write_csv(path, columns, rows):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_jsonl(path, columns, rows):
+    count = 0
+    with open(path, 'w', encoding='utf-8') as file:
+        for row in rows:
+            file.write(json.dumps(dict(zip(columns, row)), default=str) + '\n')
+            count += 1
+    return count
+
+
+def _arrow_type(declared):
+    declared = declared.upper()
+    if declared == 'DATETIME':
+        return pyarrow.timestamp('us')
+    if 'INT' in declared:
+        return pyarrow.int64()
+    if any(name in declared for name in ('REAL', 'FLOA', 'DOUB')):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+# one row group per FETCH_SIZE rows, so memory stays flat however large the
+# table; the column types come from the table's declared types
+def write_parquet(path, columns, rows, declared_types):
+    if pyarrow is None:
+        raise RuntimeError("Parquet output needs pyarrow")
+    schema = pyarrow.schema([(column, _arrow_type(declared_types[column])) for column in columns])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == FETCH_SIZE:
+                writer.write_table(pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in batch], schema))
+                count += len(batch)
+                batch = []
+        if batch or not count:
+            writer.write_table(pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in batch], schema))
+            count += len(batch)
+    return count
+
 
-            if not users:
-                print("No users in the database.")
-            else:
+def _declared_types(connection, table):
+    return {name: declared for _, name, declared, *_ in connection.execute(f'PRAGMA table_info({table})')}
+
+
+# writes each table to directory as table.format; filters maps a table to
+# its where condition; returns {table: rows written}
+def export(connection, directory, tables=tuple(TABLES), output_format='csv', filters=None):
+    os.makedirs(directory, exist_ok=True)
+    written = {}
+    for table in tables:
+        columns, rows = read_table(connection, table, (filters or {}).get(table))
+        path = os.path.join(directory, f'{table}.{output_format}')
+        if output_format == 'csv':
+            written[table] = write_csv(path, columns, rows)
+        elif output_format == 'jsonl':
+            written[table] = write_jsonl(path, columns, rows)
+        else:
+            written[table] = write_parquet(path, columns, rows, _declared_types(connection, table))
+    return written
+
+
+def fetch_and_print_users(connection):
+    try:
+        found = False
+        # rows are streamed with fetchmany, never held all at once
+        for user in read_table(connection, 'users')[1]:
+            if not found:
                 print("\nUsers:")
-                for user in users:
-                    print(f"ID: {user[0]}, Name: {user[1]}, Email: {user[2]}, Role: {user[4]}")
+                found = True
+            print(f"ID: {user[0]}, Name: {user[1]}, Email: {user[2]}, Role: {user[3]}")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+        if not found:
+            print("No users in the database.")
 
-def fetch_and_print_books():
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT * FROM books')
-            books = cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-            if not books:
-                print("No books in the database.")
-            else:
+def fetch_and_print_books(connection):
+    try:
+        found = False
+        for book in read_table(connection, 'books')[1]:
+            if not found:
                 print("\nBooks:")
-                for book in books:
-                    print(f"ID: {book[0]}, Title: {book[1]}, Author: {book[2]}, Genre: {book[4]}, Availability: {book[5]}")
+                found = True
+            print(f"ID: {book[0]}, Title: {book[1]}, Author: {book[2]}, Genre: {book[4]}, Availability: {book[5]}")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+        if not found:
+            print("No books in the database.")
 
-def fetch_and_print_transactions():
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT * FROM transactions')
-            transactions = cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-            if not transactions:
-                print("No transactions in the database.")
-            else:
+def fetch_and_print_transactions(connection):
+    try:
+        found = False
+        for transaction in read_table(connection, 'transactions')[1]:
+            if not found:
                 print("\nTransactions:")
-                for transaction in transactions:
-                    print(f"ID: {transaction[0]}, User ID: {transaction[1]}, Book ID: {transaction[2]}, Timestamp: {transaction[3]}")
+                found = True
+            print(f"ID: {transaction[0]}, User ID: {transaction[1]}, Book ID: {transaction[2]}, "
+                  f"Borrowed: {transaction[3]}, Returned: {transaction[4] or '-'}")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+        if not found:
+            print("No transactions in the database.")
+
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+
+
+def _filters(conditions):
+    filters = {}
+    for condition in conditions or ():
+        table, _, where = condition.partition(':')
+        if table not in TABLES or not where.strip():
+            raise SystemExit(f"--where takes TABLE:CONDITION, e.g. \"books:genre = 'Fiction'\", not {condition!r}")
+        filters[table] = where
+    return filters
 
-# Call the functions to print the contents of each table
-fetch_and_print_users()
-fetch_and_print_books()
-fetch_and_print_transactions()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or export the library tables from a snapshot.")
+    parser.add_argument('--database', default=database.DATABASE)
+    parser.add_argument('--pages', type=int, default=SNAPSHOT_PAGES, help="pages copied per backup step")
+    parser.add_argument('--pause', type=float, default=SNAPSHOT_PAUSE, help="seconds between backup steps")
+    parser.add_argument('--snapshot', help="keep the snapshot at this path")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('list', help="print users, books and loans (the default)")
+    export_parser = commands.add_parser('export', help="write tables as files")
+    export_parser.add_argument('--output', default='export')
+    export_parser.add_argument('--format', choices=FORMATS, default='csv')
+    export_parser.add_argument('--tables', default=','.join(TABLES), help="comma-separated")
+    export_parser.add_argument('--where', action='append', help="TABLE:CONDITION, may be repeated")
+    snapshot_parser = commands.add_parser('snapshot', help="only take the snapshot")
+    snapshot_parser.add_argument('path')
+    args = parser.parse_args()
+
+    tables = [table.strip() for table in args.tables.split(',')] if args.command == 'export' else []
+    unknown = [table for table in tables if table not in TABLES]
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(unknown)}")
+    if args.command == 'export' and args.format == 'parquet' and pyarrow is None:
+        parser.error("parquet output needs pyarrow")
+    filters = _filters(args.where) if args.command == 'export' else {}
+
+    database.configure(args.database)
+    instrumentation.install_from_environment()
+    path = args.path if args.command == 'snapshot' else args.snapshot
+    scratch = None
+    if path is None:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        scratch.close()
+        path = scratch.name
+    try:
+        # the exports read the current schema (borrowed_at and the rest)
+        with database.get_connection() as connection:
+            migrate(connection)
+        started = time.perf_counter()
+        pages = take_snapshot(path, args.database, args.pages, args.pause)
+        print(f"Snapshot of {pages} pages taken in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        if args.command != 'snapshot':
+            connection = open_snapshot(path)
+            try:
+                if args.command == 'export':
+                    for table, count in export(connection, args.output, tables, args.format, filters).items():
+                        print(f"{table}: {count} rows")
+                else:
+                    fetch_and_print_users(connection)
+                    fetch_and_print_books(connection)
+                    fetch_and_print_transactions(connection)
+            finally:
+                connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    finally:
+        if scratch is not None:
+            os.remove(path)
@@ -0,0 +1,221 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# registers the DATETIME and DATE converters
+import timestamps
+
+DATABASE = 'new_library.db'
+POOL_SIZE = 5
+CHECKOUT_TIMEOUT = 30
+
+# applied once, when the pool opens a connection
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,  # negative means KiB, so roughly 16 MB of page cache
+    'mmap_size': 268435456,  # 256 MB
+    'busy_timeout': 5000,
+}
+
+
+# What a nested checkout gets while the outer caller has a transaction open.
+# The nested work runs in a savepoint: commit() only releases it into the
+# outer transaction (and starts another), rollback() undoes the nested work
+# alone, and the outer caller still decides whether any of it is committed.
+class _NestedConnection:
+    def __init__(self, connection, name):
+        self._connection = connection
+        self._name = name
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def commit(self):
+        self._connection.execute(f'RELEASE {self._name}')
+        self._connection.execute(f'SAVEPOINT {self._name}')
+
+    def rollback(self):
+        self._connection.execute(f'ROLLBACK TO {self._name}')
+
+
+class ConnectionPool:
+    def __init__(self, database=DATABASE, size=POOL_SIZE, pragmas=None, timeout=CHECKOUT_TIMEOUT,
+                 factory=sqlite3.Connection):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.database = database
+        self.size = size
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self.factory = factory
+        # called with the seconds each checkout waited, see instrumentation.py
+        self.on_wait = None
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def _open(self):
+        connection = sqlite3.connect(
+            self.database,
+            uri=self.database.startswith('file:'),
+            check_same_thread=False,
+            factory=self.factory,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+        )
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _acquire(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._open()
+                except sqlite3.Error:
+                    self._opened -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"No database connection available after {self.timeout} seconds"
+            ) from None
+
+    def _release(self, connection):
+        # never hand out a connection with someone else's half-finished transaction
+        if connection.in_transaction:
+            connection.rollback()
+        if self._closed:
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+        else:
+            self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, 'connection', None)
+        if held is not None:
+            # nested checkout on the same thread shares the outer connection
+            if not held.in_transaction:
+                yield held
+                return
+            self._local.depth = depth = getattr(self._local, 'depth', 0) + 1
+            name = f'nested_{depth}'
+            held.execute(f'SAVEPOINT {name}')
+            try:
+                yield _NestedConnection(held, name)
+            except BaseException:
+                held.execute(f'ROLLBACK TO {name}')
+                raise
+            finally:
+                held.execute(f'RELEASE {name}')
+                self._local.depth = depth - 1
+            return
+
+        started = time.perf_counter()
+        connection = self._acquire()
+        if self.on_wait is not None:
+            self.on_wait(time.perf_counter() - started)
+        self._local.connection = connection
+        try:
+            yield connection
+        finally:
+            self._local.connection = None
+            self._release(connection)
+
+    # close idle connections so the next checkouts open fresh ones, e.g. after
+    # changing the factory
+    def reset(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+
+    def close(self):
+        self._closed = True
+        self.reset()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(database=DATABASE, size=POOL_SIZE, **options):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(database, size, **options)
+    return _pool
+
+
+# makes an already built pool the library pool, e.g. a storage engine's
+def use_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool is not pool:
+            _pool.close()
+        _pool = pool
+    return pool
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_connection():
+    return get_pool().connection()
+
+
+# BEGIN IMMEDIATE takes the write lock up front instead of upgrading a read
+# lock later, which can fail with "database is locked" under contention;
+# on the library pool unless given another. Inside a transaction the thread
+# already has open it is a savepoint of that transaction instead.
+@contextmanager
+def write_transaction(pool=None):
+    with (pool or get_pool()).connection() as connection:
+        cursor = connection.cursor()
+        if not connection.in_transaction:
+            cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(close_pool)
@@ -0,0 +1,161 @@
+# Group commit for circulation writes.
+#
+#     writer = group_commit.GroupCommitWriter(max_batch=64, max_delay=0.002)
+#     writer.start()
+#     result = writer.checkout(user_id, book_id).result()
+#     writer.stop()
+#
+# circulation.checkout and checkin commit once per call, so at busy times
+# the desks queue for commits (and their fsyncs) rather than for the work.
+# The writer is one thread holding one pooled connection. It takes queued
+# operations until it has max_batch of them or max_delay seconds have
+# passed since the first, runs them in one transaction and commits once.
+# Each caller gets a concurrent.futures.Future, resolved only after the
+# commit, so a result is never reported for a loan that could still be lost.
+#
+# Every operation runs in a savepoint of its own. One that raises is rolled
+# back alone and its future gets the exception; the rest of the batch still
+# commits. If the batch itself fails, every future in it that is not yet
+# resolved gets the error, and the writer carries on with the next batch.
+
+import datetime
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import cache
+import circulation
+import database
+
+MAX_BATCH = 64
+MAX_DELAY = 0.002  # seconds an operation may wait for others to join it
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, pool=None, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        if max_batch < 1:
+            raise ValueError("Batch size must be at least 1")
+        self.pool = pool or database.get_pool()
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # batches committed and operations in them, for benchmarks
+        self.batches = 0
+        self.operations = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='library-group-commit', daemon=True)
+        self._thread.start()
+        return self
+
+    # operation is one of circulation's cursor helpers (_checkout,
+    # _checkin_by_title, ...), called as operation(cursor, *args, now)
+    def submit(self, operation, *args, now=None):
+        if self._stopped:
+            raise RuntimeError("Group commit writer is stopped")
+        future = Future()
+        self._queue.put((future, operation, args, now or datetime.datetime.now()))
+        return future
+
+    def checkout(self, user_id, book_id):
+        return self.submit(circulation._checkout, user_id, book_id)
+
+    def checkin(self, user_id, book_id):
+        return self.submit(circulation._checkin, user_id, book_id)
+
+    def checkout_by_title(self, user_id, title, author):
+        return self.submit(circulation._checkout_by_title, user_id, title, author)
+
+    def checkin_by_title(self, user_id, title, author):
+        return self.submit(circulation._checkin_by_title, user_id, title, author)
+
+    # the whole list in one savepoint, resolved with a list of Results
+    def checkout_many(self, user_id, items):
+        return self.submit(circulation._checkout_items, user_id, list(items))
+
+    def checkin_many(self, user_id, items):
+        return self.submit(circulation._checkin_items, user_id, list(items))
+
+    # the first queued item, then whatever else arrives within max_delay
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, connection, batch):
+        cursor = connection.cursor()
+        done = []
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for future, operation, args, now in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cursor.execute('SAVEPOINT operation')
+                try:
+                    result = operation(cursor, *args, now)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO operation')
+                    future.set_exception(e)
+                else:
+                    done.append((future, result))
+                cursor.execute('RELEASE operation')
+            connection.commit()
+        except BaseException as e:
+            try:
+                connection.rollback()
+            finally:
+                # nothing in the batch was committed, including operations
+                # not reached yet
+                for future, _, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            logger.exception("group commit of %d operations failed", len(batch))
+            return
+
+        self.batches += 1
+        self.operations += len(done)
+        for future, result in done:
+            results = result if isinstance(result, list) else [result]
+            for item in results:
+                if getattr(item, 'status', None) in (circulation.BORROWED, circulation.RETURNED):
+                    cache.invalidate_book(item.book_id)
+            future.set_result(result)
+
+    def _run(self):
+        with self.pool.connection() as connection:
+            while True:
+                batch = self._next_batch()
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    try:
+                        self._commit(connection, batch)
+                    except Exception:
+                        # only _STOP ends the loop, or queued work would wait forever
+                        logger.exception("group commit writer failed a batch")
+                if stop:
+                    return
+
+    # finishes everything already queued first
+    def stop(self):
+        self._stopped = True
+        self._queue.put(_STOP)
+        if self._thread is not None:
+            self._thread.join()
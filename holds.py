@@ -0,0 +1,279 @@
+# Holds on books with no copy on the shelf.
+#
+#     python holds.py expire                 one pass over uncollected holds
+#     python holds.py run --interval 60      keep expiring them in the background
+#
+# A patron who finds no copy left places a hold and joins that book's
+# waitlist, first come first served. A returned copy goes to the first
+# waiting hold instead of back on the shelf: the hold becomes ready and the
+# patron has HOLD_DAYS to borrow it. Ready holds that are not collected in
+# time expire and the copy passes to the next patron in line, or back to the
+# shelf when nobody is waiting.
+#
+# Waitlists and expiry each read their own partial index (migration 9):
+# promotion takes the oldest waiting hold for one book, and expiry reads
+# ready holds in expiry order, a batch at a time, never touching waiting or
+# finished holds.
+
+import argparse
+import datetime
+import logging
+import sqlite3
+import threading
+from collections import namedtuple
+
+import cache
+from database import get_connection, write_transaction
+from timestamps import to_micros
+
+logger = logging.getLogger('library.holds')
+
+# hold statuses
+WAITING = 'waiting'
+READY = 'ready'
+FULFILLED = 'fulfilled'
+EXPIRED = 'expired'
+CANCELLED = 'cancelled'
+
+# outcomes of place_hold
+PLACED = 'placed'
+ALREADY_HELD = 'already_held'
+AVAILABLE = 'available'
+NOT_FOUND = 'not_found'
+
+HOLD_DAYS = 3
+EXPIRY_BATCH = 1000
+EXPIRY_INTERVAL = 60  # seconds
+
+# position is the place in the book's waitlist, 1 being next; None once the
+# hold is ready
+HoldResult = namedtuple('HoldResult', 'status hold_id position')
+
+
+# The underscored helpers only issue statements; the caller owns the
+# transaction, as in circulation.py.
+
+def _position(cursor, book_id, hold_id):
+    cursor.execute('''
+        SELECT COUNT(*) FROM holds
+        WHERE book_id = ? AND status = 'waiting' AND id <= ?
+    ''', (book_id, hold_id))
+    return cursor.fetchone()[0]
+
+
+def _place(cursor, user_id, book_id, now):
+    cursor.execute('SELECT availability FROM books WHERE id = ?', (book_id,))
+    book = cursor.fetchone()
+    if book is None:
+        return HoldResult(NOT_FOUND, None, None)
+
+    cursor.execute('''
+        SELECT id, status FROM holds
+        WHERE user_id = ? AND book_id = ? AND status IN ('waiting', 'ready')
+    ''', (user_id, book_id))
+    hold = cursor.fetchone()
+    if hold is not None:
+        hold_id, status = hold
+        return HoldResult(ALREADY_HELD, hold_id, _position(cursor, book_id, hold_id) if status == WAITING else None)
+
+    if book[0] > 0:
+        # a copy is on the shelf; borrow it instead
+        return HoldResult(AVAILABLE, None, None)
+
+    cursor.execute('''
+        INSERT INTO holds (user_id, book_id, status, placed_at)
+        VALUES (?, ?, 'waiting', ?)
+        RETURNING id
+    ''', (user_id, book_id, to_micros(now)))
+    hold_id = cursor.fetchone()[0]
+    return HoldResult(PLACED, hold_id, _position(cursor, book_id, hold_id))
+
+
+# sets a copy of book_id aside for the first patron waiting for it; returns
+# (hold_id, user_id), or None when nobody is waiting
+def _promote(cursor, book_id, now):
+    cursor.execute('''
+        UPDATE holds
+        SET status = 'ready', ready_at = ?, expires_at = ?
+        WHERE id = (
+            SELECT id FROM holds
+            WHERE book_id = ? AND status = 'waiting'
+            ORDER BY id
+            LIMIT 1
+        )
+        RETURNING id, user_id
+    ''', (to_micros(now), to_micros(now + datetime.timedelta(days=HOLD_DAYS)), book_id))
+    return cursor.fetchone()
+
+
+# passes on a held copy nobody collected; returns True if it went back on
+# the shelf
+def _release(cursor, book_id, now):
+    if _promote(cursor, book_id, now) is not None:
+        return False
+    cursor.execute('UPDATE books SET availability = availability + 1 WHERE id = ?', (book_id,))
+    return True
+
+
+# marks the patron's ready hold on book_id collected; returns True if there
+# was one, in which case the copy set aside for it is theirs
+def _claim(cursor, user_id, book_id):
+    cursor.execute('''
+        UPDATE holds
+        SET status = 'fulfilled'
+        WHERE user_id = ? AND book_id = ? AND status = 'ready'
+        RETURNING id
+    ''', (user_id, book_id))
+    return cursor.fetchone() is not None
+
+
+# the book id of a ready hold matching a checkout by title or ISBN, if any
+
+def _ready_by_title(cursor, user_id, title, author):
+    cursor.execute('''
+        SELECT holds.book_id
+        FROM holds
+        JOIN books ON books.id = holds.book_id
+        WHERE holds.user_id = ? AND holds.status = 'ready' AND books.title = ? AND books.author = ?
+        LIMIT 1
+    ''', (user_id, title, author))
+    hold = cursor.fetchone()
+    return hold[0] if hold else None
+
+
+def _ready_by_isbn(cursor, user_id, isbn):
+    cursor.execute('''
+        SELECT holds.book_id
+        FROM holds
+        JOIN books ON books.id = holds.book_id
+        WHERE holds.user_id = ? AND holds.status = 'ready' AND books.isbn = ?
+        LIMIT 1
+    ''', (user_id, isbn))
+    hold = cursor.fetchone()
+    return hold[0] if hold else None
+
+
+def _cancel(cursor, user_id, book_id, now):
+    cursor.execute('''
+        SELECT id, status FROM holds
+        WHERE user_id = ? AND book_id = ? AND status IN ('waiting', 'ready')
+    ''', (user_id, book_id))
+    hold = cursor.fetchone()
+    if hold is None:
+        return False, False
+
+    hold_id, status = hold
+    cursor.execute("UPDATE holds SET status = 'cancelled' WHERE id = ?", (hold_id,))
+    return True, status == READY and _release(cursor, book_id, now)
+
+
+# expires up to limit ready holds; returns (expired, ids of books whose copy
+# went back on the shelf)
+def _expire(cursor, now, limit):
+    cursor.execute('''
+        SELECT id, book_id FROM holds
+        WHERE status = 'ready' AND expires_at <= ?
+        ORDER BY expires_at
+        LIMIT ?
+    ''', (to_micros(now), limit))
+    holds = cursor.fetchall()
+    cursor.executemany("UPDATE holds SET status = 'expired' WHERE id = ?", ((hold_id,) for hold_id, _ in holds))
+    shelved = [book_id for _, book_id in holds if _release(cursor, book_id, now)]
+    return len(holds), shelved
+
+
+def place_hold(user_id, book_id):
+    with write_transaction() as cursor:
+        return _place(cursor, user_id, book_id, datetime.datetime.now())
+
+
+# returns True if the patron had an open hold on the book
+def cancel_hold(user_id, book_id):
+    with write_transaction() as cursor:
+        cancelled, shelved = _cancel(cursor, user_id, book_id, datetime.datetime.now())
+    if shelved:
+        cache.invalidate_book(book_id)
+    return cancelled
+
+
+# [(hold_id, book_id, status, placed_at, expires_at)] of the patron's
+# waiting and ready holds
+def holds_for_user(user_id):
+    with get_connection() as connection:
+        return connection.execute('''
+            SELECT id, book_id, status, placed_at, expires_at
+            FROM holds
+            WHERE user_id = ? AND status IN ('waiting', 'ready')
+            ORDER BY id
+        ''', (user_id,)).fetchall()
+
+
+def waitlist_length(book_id):
+    with get_connection() as connection:
+        return connection.execute('''
+            SELECT COUNT(*) FROM holds
+            WHERE book_id = ? AND status = 'waiting'
+        ''', (book_id,)).fetchone()[0]
+
+
+# expires every ready hold past its time, batch_size per transaction so
+# circulation is never locked out for long; returns how many expired
+def expire_holds(now=None, batch_size=EXPIRY_BATCH):
+    now = now or datetime.datetime.now()
+    total = 0
+    while True:
+        with write_transaction() as cursor:
+            expired, shelved = _expire(cursor, now, batch_size)
+        for book_id in set(shelved):
+            cache.invalidate_book(book_id)
+        total += expired
+        if expired < batch_size:
+            return total
+
+
+class ExpiryScheduler:
+    def __init__(self, interval=EXPIRY_INTERVAL, batch_size=EXPIRY_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                expired = expire_holds(batch_size=self.batch_size)
+                if expired:
+                    logger.info("expired %d holds", expired)
+            except sqlite3.Error:
+                logger.exception("hold expiry failed")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='library-holds', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expire holds that were not collected in time.")
+    parser.add_argument('command', choices=('expire', 'run'))
+    parser.add_argument('--interval', type=float, default=EXPIRY_INTERVAL, help="seconds between passes for run")
+    parser.add_argument('--batch-size', type=int, default=EXPIRY_BATCH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if args.command == 'expire':
+            print(f"Expired {expire_holds(batch_size=args.batch_size)} holds")
+        else:
+            scheduler = ExpiryScheduler(args.interval, args.batch_size)
+            scheduler.start()
+            scheduler._thread.join()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,279 @@
+# Query timing and metrics.
+#
+# install() makes the connection pool hand out instrumented connections. Every
+# statement run through them, from main.py, data.py or any other module, then
+# records its execute() latency in a per-statement histogram, along with the
+# rows it returned (counted as they are fetched) or, for statements that
+# return none, changed. The time spent waiting for a pooled connection gets
+# its own histogram. With a slow-query threshold set, statements over the
+# threshold are logged as SQL with placeholders; bound values are never
+# logged, since they include password hashes.
+#
+# To instrument a terminal session, set environment variables before running
+# main.py or data.py:
+#
+#     LIBRARY_METRICS=metrics.prom       Prometheus text file written on exit
+#     LIBRARY_QUERY_REPORT=1             print format_text() to stderr on exit
+#     LIBRARY_SLOW_QUERY_MS=50           log statements slower than this
+#     LIBRARY_PROFILE=session.prof       cProfile the whole session
+
+import atexit
+import bisect
+import cProfile
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import database
+
+logger = logging.getLogger('library.queries')
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+LABEL_LENGTH = 120
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.rows = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    def __init__(self):
+        self.queries = {}
+        self.pool_wait = Histogram()
+        self.slow_query_seconds = None
+        self._lock = threading.Lock()
+
+    def _histogram(self, statement):
+        histogram = self.queries.get(statement)
+        if histogram is None:
+            histogram = self.queries.setdefault(statement, Histogram())
+        return histogram
+
+    def record_query(self, statement, seconds, rows=0):
+        with self._lock:
+            histogram = self._histogram(statement)
+            histogram.observe(seconds)
+            histogram.rows += rows
+
+    def record_rows(self, statement, rows):
+        with self._lock:
+            self._histogram(statement).rows += rows
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.pool_wait.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.queries.clear()
+            self.pool_wait = Histogram()
+
+    def format_text(self):
+        with self._lock:
+            items = sorted(self.queries.items(), key=lambda item: item[1].total, reverse=True)
+            lines = [f"{'calls':>8} {'total ms':>10} {'mean ms':>9} {'p99 <= ms':>10} {'rows':>9}  statement"]
+            for statement, histogram in items:
+                lines.append(
+                    f"{histogram.count:8d} {histogram.total * 1000:10.2f} "
+                    f"{histogram.total * 1000 / histogram.count:9.3f} "
+                    f"{histogram.quantile(0.99) * 1000:10.2f} {histogram.rows:9d}  {statement}"
+                )
+            wait = self.pool_wait
+            if wait.count:
+                lines.append(
+                    f"connection waits: {wait.count}, total {wait.total * 1000:.2f} ms, "
+                    f"p99 <= {wait.quantile(0.99) * 1000:.2f} ms"
+                )
+            return '\n'.join(lines)
+
+    def format_prometheus(self):
+        lines = [
+            '# HELP library_query_seconds Time spent in execute() per statement.',
+            '# TYPE library_query_seconds histogram',
+        ]
+        with self._lock:
+            for statement, histogram in sorted(self.queries.items()):
+                lines.extend(_histogram_lines('library_query_seconds', histogram, {'query': statement}))
+            lines += [
+                '# HELP library_query_rows_total Rows returned or changed per statement.',
+                '# TYPE library_query_rows_total counter',
+            ]
+            for statement, histogram in sorted(self.queries.items()):
+                lines.append(f'library_query_rows_total{_labels({"query": statement})} {histogram.rows}')
+            lines += [
+                '# HELP library_pool_wait_seconds Time spent waiting for a pooled connection.',
+                '# TYPE library_pool_wait_seconds histogram',
+            ]
+            lines.extend(_histogram_lines('library_pool_wait_seconds', self.pool_wait, {}))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # write then rename, so a scraper never reads half a file
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as output:
+            output.write(self.format_prometheus())
+        os.replace(temporary, path)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _histogram_lines(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels({**labels, "le": repr(bound)})} {cumulative}')
+    lines.append(f'{name}_bucket{_labels({**labels, "le": "+Inf"})} {histogram.count}')
+    lines.append(f'{name}_sum{_labels(labels)} {histogram.total}')
+    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+    return lines
+
+
+metrics = Metrics()
+
+
+def normalize(sql):
+    statement = ' '.join(sql.split())
+    if len(statement) > LABEL_LENGTH:
+        statement = statement[:LABEL_LENGTH - 3] + '...'
+    return statement
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    statement = None
+
+    def _timed(self, method, sql, parameters):
+        self.statement = normalize(sql)
+        started = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            # statements that return rows (SELECT, ... RETURNING) have them
+            # counted as fetched; rowcount only for the others
+            changed = max(self.rowcount, 0) if self.description is None else 0
+            metrics.record_query(self.statement, elapsed, changed)
+            threshold = metrics.slow_query_seconds
+            if threshold is not None and elapsed >= threshold:
+                logger.warning("slow query (%.1f ms): %s", elapsed * 1000, ' '.join(sql.split()))
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self._timed(super().executemany, sql, parameters)
+
+    def _count(self, rows):
+        if self.statement is not None and rows:
+            metrics.record_rows(self.statement, rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        self._count(1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+
+def install(pool=None, slow_query_ms=None):
+    metrics.slow_query_seconds = None if slow_query_ms is None else slow_query_ms / 1000
+    pool = pool or database.get_pool()
+    pool.factory = InstrumentedConnection
+    pool.on_wait = metrics.record_wait
+    # connections already opened in the pool are not instrumented
+    pool.reset()
+    return metrics
+
+
+def uninstall(pool=None):
+    pool = pool or database.get_pool()
+    pool.factory = sqlite3.Connection
+    pool.on_wait = None
+    pool.reset()
+
+
+def print_report(output=None):
+    print(metrics.format_text(), file=output or sys.stderr)
+
+
+def install_from_environment(environ=os.environ):
+    metrics_path = environ.get('LIBRARY_METRICS')
+    report = environ.get('LIBRARY_QUERY_REPORT')
+    slow_query_ms = environ.get('LIBRARY_SLOW_QUERY_MS')
+    profile_path = environ.get('LIBRARY_PROFILE')
+
+    if metrics_path or report or slow_query_ms:
+        if slow_query_ms:
+            logging.basicConfig()
+        install(slow_query_ms=float(slow_query_ms) if slow_query_ms else None)
+        if metrics_path:
+            atexit.register(metrics.write_prometheus, metrics_path)
+        if report:
+            atexit.register(print_report)
+
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def save_profile():
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+        atexit.register(save_profile)
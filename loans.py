@@ -0,0 +1,89 @@
+# Loans by when they were borrowed.
+#
+#     python loans.py between 2024-01-01 2024-02-01
+#     python loans.py older-than 30 --open
+#
+# borrowed_at is stored as integer microseconds (see timestamps.py) with an
+# index of its own, so a time range is one index range scan however long the
+# ledger, and the datetime bounds are converted with timestamps.to_micros.
+# Open loans have a partial index on borrowed_at that only holds the books
+# currently out.
+
+import argparse
+import datetime
+import sqlite3
+
+from database import get_connection
+from migrations import migrate
+from timestamps import to_micros
+
+# id, user_id, book_id, borrowed_at, returned_at, oldest first
+LOANS_BETWEEN = '''
+    SELECT id, user_id, book_id, borrowed_at, returned_at
+    FROM transactions
+    WHERE borrowed_at >= ? AND borrowed_at < ?
+    ORDER BY borrowed_at
+    LIMIT ?
+'''
+
+LOANS_BEFORE = '''
+    SELECT id, user_id, book_id, borrowed_at, returned_at
+    FROM transactions
+    WHERE borrowed_at < ?
+    ORDER BY borrowed_at
+    LIMIT ?
+'''
+
+OPEN_LOANS_BEFORE = '''
+    SELECT id, user_id, book_id, borrowed_at, returned_at
+    FROM transactions
+    WHERE returned_at IS NULL AND borrowed_at < ?
+    ORDER BY borrowed_at
+    LIMIT ?
+'''
+
+
+def _query(query, parameters):
+    with get_connection() as connection:
+        return connection.execute(query, parameters).fetchall()
+
+
+# loans borrowed from start up to, not including, end; limit None is all
+def loans_between(start, end, limit=None):
+    return _query(LOANS_BETWEEN, (to_micros(start), to_micros(end), -1 if limit is None else limit))
+
+
+# loans borrowed more than days ago, only the ones still out if open_only
+def loans_older_than(days, open_only=False, now=None, limit=None):
+    cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=days)
+    return _query(OPEN_LOANS_BEFORE if open_only else LOANS_BEFORE, (to_micros(cutoff), -1 if limit is None else limit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List loans by when they were borrowed.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    between_parser = commands.add_parser('between', help="loans borrowed in [START, END)")
+    between_parser.add_argument('start', type=datetime.datetime.fromisoformat)
+    between_parser.add_argument('end', type=datetime.datetime.fromisoformat)
+    older_parser = commands.add_parser('older-than', help="loans borrowed more than DAYS ago")
+    older_parser.add_argument('days', type=int)
+    older_parser.add_argument('--open', action='store_true', help="only loans not yet returned")
+    for command_parser in (between_parser, older_parser):
+        command_parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    try:
+        with get_connection() as connection:
+            migrate(connection)
+        if args.command == 'between':
+            loans = loans_between(args.start, args.end, args.limit)
+        else:
+            loans = loans_older_than(args.days, args.open, limit=args.limit)
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+    for loan_id, user_id, book_id, borrowed_at, returned_at in loans:
+        print(f"{loan_id}: user {user_id}, book {book_id}, "
+              f"borrowed {borrowed_at:%Y-%m-%d %H:%M}, returned {returned_at or 'not yet'}")
+    print(f"{len(loans)} loans")
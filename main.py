@@ -1,273 +1,221 @@
 import sqlite3
-import datetime
 
-# to connect the sql database
-def create_connection():
-    connection = None
+import accounts
+import auth
+import cache
+import circulation
+import holds
+import instrumentation
+import pagination
+import search
+from database import get_connection
+from migrations import migrate
+
+def initialize_database():
     try:
-        connection = sqlite3.connect('new_library.db') 
+        with get_connection() as connection:
+            # for Creating new tables and bringing indexes up to date
+            migrate(connection)
+            print("Database initialized successfully")
     except sqlite3.Error as e:
         print(f"Error: {e}")
-    return connection
-
-def initialize_database():
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
 
-            # for Creating new tables
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT,
-                    email TEXT UNIQUE,
-                    password TEXT,
-                    role TEXT
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS books (
-                    id INTEGER PRIMARY KEY,
-                    title TEXT,
-                    author TEXT,
-                    isbn TEXT,
-                    genre TEXT,
-                    availability INTEGER
-                )
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER,
-                    book_id INTEGER,
-                    timestamp DATETIME,
-                    FOREIGN KEY (user_id) REFERENCES users(id),
-                    FOREIGN KEY (book_id) REFERENCES books(id)
+def add_user(name, email, password, role):
+    try:
+        reason = accounts.check_user(name, email, password, role)
+        if reason is None:
+            with get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    '''
+                    INSERT INTO users (name, email, password, role)
+                    VALUES (?, ?, ?, ?)
+                ''',
+                    (name, email, auth.hash_password(password), role),
                 )
-            ''')
+                connection.commit()
+            cache.invalidate_user(email)
+            print("User added successfully")
+        else:
+            print(reason)
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-            connection.commit()
-            print("Database initialized successfully")
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
 
-def add_user(name, email, password, role):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            # Check if the email is a Gmail address
-            if email.lower().endswith(("gmail.com", "gmail.org", "gmail.in")):
-                # Check if the password is strong
-                if (
-                    len(password) >= 6
-                    and any(c.isalpha() for c in password)
-                    and any(c.isdigit() for c in password)
-                    and any(c.isascii() and not c.isalnum() for c in password)
-                ):
-                    # Check if the name contains only alphabets
-                    if name.isalpha():
-                        cursor = connection.cursor()
-                        cursor.execute(
-                            '''
-                            INSERT INTO users (name, email, password, role)
-                            VALUES (?, ?, ?, ?)
-                        ''',
-                            (name, email, password, role),
-                        )
-                        connection.commit()
-                        print("User added successfully")
-                    else:
-                        print("Invalid name. Please use only alphabets.")
-                else:
-                    print(
-                        "Weak password. Please use at least 6 characters, 1 alphabet, 1 number, and 1 special character."
-                    )
-            else:
-                print("Invalid email. Please use a Gmail address.")
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
- 
+# the insert_* / get_* helpers return data and let sqlite3 errors through, for
+# callers other than the terminal menus (see service.py)
+def insert_book(title, author, isbn, genre, availability):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute('''
+            INSERT INTO books (title, author, isbn, genre, availability)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (title, author, isbn, genre, availability))
+        connection.commit()
+    cache.invalidate_book(title=title, author=author)
+    return cursor.lastrowid
 
 def add_book(title, author, isbn, genre, availability):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('''
-                INSERT INTO books (title, author, isbn, genre, availability)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (title, author, isbn, genre, availability))
-            connection.commit()
-            print("Book added successfully")
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    try:
+        insert_book(title, author, isbn, genre, availability)
+        print("Book added successfully")
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
 def list_books():
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT id, title, author, genre, availability FROM books')
-            books = cursor.fetchall()
-
-            if not books:
-                print("No books available.")
-            else:
+    try:
+        found = False
+        # print page by page instead of loading the whole catalog
+        for books in pagination.iter_pages(pagination.books_page):
+            if not found:
                 print("\nList of Books:")
-                for book in books:
-                    book_id, title, author, genre, availability = book
-                    print(f"{book_id}. {title} by {author} - Genre: {genre}, Available: {availability}")
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
-
-            
-def get_book_id_by_name_author(book_name, author):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT id FROM books WHERE title = ? AND author = ?', (book_name, author))
-            book = cursor.fetchone()
+                found = True
+            for book in books:
+                book_id, title, author, genre, availability = book
+                print(f"{book_id}. {title} by {author} - Genre: {genre}, Available: {availability}")
 
-            return book[0] if book else None
+        if not found:
+            print("No books available.")
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
 
-    return None
+def _load_book_id(book_name, author):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute('SELECT id FROM books WHERE title = ? AND author = ?', (book_name, author))
+        book = cursor.fetchone()
 
-def borrow_book(user_id):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            # to get book details from the user
-            book_name = input("Enter the name of the book you want to borrow: ")
-            author = input("Enter the author of the book: ")
+        return book[0] if book else None
 
-            # to get the book ID based on name and author
-            book_id = get_book_id_by_name_author(book_name, author)
+def get_book_id_by_name_author(book_name, author):
+    try:
+        return cache.book_ids.get_or_load(
+            (book_name, author),
+            lambda: _load_book_id(book_name, author),
+            tags=lambda book_id: [cache.book_tag(book_id)] if book_id else [],
+        )
 
-            if book_id is not None:
-                cursor = connection.cursor()
-                cursor.execute('''
-                    INSERT INTO transactions (user_id, book_id, timestamp)
-                    VALUES (?, ?, ?)
-                ''', (user_id, book_id, datetime.datetime.now()))
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-                # Update book availability
-                cursor.execute('''
-                    UPDATE books
-                    SET availability = availability - 1
-                    WHERE id = ?
-                ''', (book_id,))
+    return None
 
-                connection.commit()
-                print("Book borrowed successfully")
-            else:
-                print("Book not found. Please check the name and author.")
+def borrow_book(user_id, book_name, author):
+    try:
+        result = circulation.checkout_by_title(user_id, book_name, author)
+
+        if result.status == circulation.BORROWED:
+            print("Book borrowed successfully")
+        elif result.status == circulation.UNAVAILABLE:
+            print("No copies of this book are available right now.")
+        else:
+            print("Book not found. Please check the name and author.")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
 
 def get_borrowed_book_id_by_name_author(user_id, book_name, author):
-    connection = create_connection()
-    if connection is not None:
-        try:
+    try:
+        with get_connection() as connection:
             cursor = connection.cursor()
             cursor.execute('''
                 SELECT books.id
                 FROM books
                 JOIN transactions ON books.id = transactions.book_id
                 WHERE transactions.user_id = ? AND books.title = ? AND books.author = ?
+                  AND transactions.returned_at IS NULL
             ''', (user_id, book_name, author))
             book = cursor.fetchone()
 
             return book[0] if book else None
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
     return None
 
 def return_book(user_id, book_name, author):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
+    try:
+        result = circulation.checkin_by_title(user_id, book_name, author)
 
-            borrowed_book_id = get_borrowed_book_id_by_name_author(user_id, book_name, author)
+        if result.status == circulation.RETURNED:
+            if result.penalty > 0:
+                print(f"Book returned successfully. Penalty: ${result.penalty}")
+            else:
+                print("Book returned successfully. No penalty.")
+        else:
+            print("Book not found or not borrowed by the user. Please check.")
 
-            if borrowed_book_id:
-                cursor.execute('''
-                    SELECT transactions.id, transactions.timestamp
-                    FROM transactions
-                    WHERE transactions.user_id = ? AND transactions.book_id = ?
-                ''', (user_id, borrowed_book_id))
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-                transaction = cursor.fetchone()
 
-                if transaction:
-                    # for calculating the penalty
-                    borrow_date = datetime.datetime.strptime(transaction[1], '%Y-%m-%d %H:%M:%S.%f')
-                    return_date = datetime.datetime.now()
-                    days_borrowed = (return_date - borrow_date).days
+# Batch items are book ids (int) or ISBNs (str), see parse_items
+def borrow_books(user_id, items):
+    try:
+        for item, result in zip(items, circulation.checkout_many(user_id, items)):
+            if result.status == circulation.BORROWED:
+                print(f"{item}: borrowed")
+            elif result.status == circulation.UNAVAILABLE:
+                print(f"{item}: no copies available right now")
+            else:
+                print(f"{item}: not found")
 
-                    penalty = max(0, days_borrowed - 5) * 2
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-                    
-                    cursor.execute('''
-                        UPDATE books
-                        SET availability = availability + 1
-                        WHERE id = ?
-                    ''', (borrowed_book_id,))
 
-                    # Delete the transaction record
-                    cursor.execute('DELETE FROM transactions WHERE id = ?', (transaction[0],))
+def return_books(user_id, items):
+    try:
+        total = 0
+        for item, result in zip(items, circulation.checkin_many(user_id, items)):
+            if result.status == circulation.RETURNED:
+                total += result.penalty
+                print(f"{item}: returned" + (f", penalty ${result.penalty}" if result.penalty else ""))
+            else:
+                print(f"{item}: not borrowed by this user")
+        if total:
+            print(f"Total penalty: ${total}")
 
-                    connection.commit()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-                    if penalty > 0:
-                        print(f"Book returned successfully. Penalty: ${penalty}")
-                    else:
-                        print("Book returned successfully. No penalty.")
-                else:
-                    print("You haven't borrowed this book.")
+
+def place_hold(user_id, book_id):
+    try:
+        result = holds.place_hold(user_id, book_id)
+
+        if result.status == holds.PLACED:
+            print(f"Hold placed. You are number {result.position} in line.")
+        elif result.status == holds.ALREADY_HELD:
+            if result.position is None:
+                print("A copy is waiting for you; borrow it before it expires.")
             else:
-                print("Book not found or not borrowed by the user. Please check.")
+                print(f"You already have a hold on this book, number {result.position} in line.")
+        elif result.status == holds.AVAILABLE:
+            print("A copy is on the shelf; borrow it instead.")
+        else:
+            print("Book not found.")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
 
-def delete_book():
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
+# "12, 9780306406157" -> [12, '9780306406157']; numbers shorter than an
+# ISBN are book ids
+def parse_items(text):
+    items = []
+    for part in text.replace(',', ' ').split():
+        items.append(int(part) if part.isdigit() and len(part) < 10 else part)
+    return items
 
-            # Ask for book details
-            title = input("Enter the title of the book to delete: ")
-            author = input("Enter the author of the book to delete: ")
+
+def delete_book(title, author):
+    try:
+        with get_connection() as connection:
+            cursor = connection.cursor()
 
             # Check if the book exists
             cursor.execute('SELECT * FROM books WHERE title = ? AND author = ?', (title, author))
@@ -277,81 +225,79 @@ def delete_book():
                 # Delete the book
                 cursor.execute('DELETE FROM books WHERE id = ?', (book[0],))
                 connection.commit()
+                cache.invalidate_book(book[0], title, author)
                 print(f"Book '{title}' by {author} deleted successfully.")
             else:
                 print(f"Book '{title}' by {author} not found in our list.")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
 def available_books():
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT id, title, author FROM books WHERE availability > 0')
-            available_books = cursor.fetchall()
-
-            if not available_books:
-                print("No available books.")
-            else:
+    try:
+        found = False
+        for books in pagination.iter_pages(pagination.available_books_page):
+            if not found:
                 print("\nAvailable Books:")
-                for book in available_books:
-                    book_id, title, author = book
-                    print(f"{book_id}. {title} by {author}")
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()  
+                found = True
+            for book in books:
+                book_id, title, author = book
+                print(f"{book_id}. {title} by {author}")
+
+        if not found:
+            print("No available books.")
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+
+def _load_book(title):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute('SELECT * FROM books WHERE title = ?', (title,))
+        return cursor.fetchone()
+
+def get_book_by_title(title):
+    return cache.books.get_or_load(
+        title,
+        lambda: _load_book(title),
+        tags=lambda book: [cache.book_tag(book[0])] if book else [],
+    )
+
+def print_book(book):
+    print(f"Title: {book[1]}")
+    print(f"Author: {book[2]}")
+    print(f"ISBN: {book[3]}")
+    print(f"Genre: {book[4]}")
+    print(f"Availability: {book[5]}")
 
 def find_book(title):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT * FROM books WHERE title = ?', (title,))
-            book = cursor.fetchone()
+    try:
+        book = get_book_by_title(title)
+
+        if book:
+            print("Book found:")
+            print_book(book)
+        else:
+            print(f"Book '{title}' not found.")
+
+            # suggest close matches for partial or misspelled titles
+            suggestions = search.search_books(title, limit=5)
+            if suggestions:
+                print("Did you mean:")
+                for book_id, book_title, author, isbn, genre, availability in suggestions:
+                    print(f"{book_id}. {book_title} by {author} - Genre: {genre}, Available: {availability}")
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-            if book:
-                print("Book found:")
-                print(f"Title: {book[1]}")
-                print(f"Author: {book[2]}")
-                print(f"ISBN: {book[3]}")
-                print(f"Genre: {book[4]}")
-                print(f"Availability: {book[5]}")
-            else:
-                print(f"Book '{title}' not found.")
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
-          
 
 
-def update_book(title):
-    connection = create_connection()
-    if connection is not None:
-        try:
+def update_book(title, new_title, new_author, new_isbn, new_genre, new_availability):
+    try:
+        with get_connection() as connection:
             cursor = connection.cursor()
             cursor.execute('SELECT * FROM books WHERE title = ?', (title,))
             book = cursor.fetchone()
 
             if book:
-                print("Current Book Information:")
-                print(f"Title: {book[1]}")
-                print(f"Author: {book[2]}")
-                print(f"ISBN: {book[3]}")
-                print(f"Genre: {book[4]}")
-                print(f"Availability: {book[5]}")
-
-                new_title = input("Enter the new title: ")
-                new_author = input("Enter the new author: ")
-                new_isbn = input("Enter the new ISBN: ")
-                new_genre = input("Enter the new genre: ")
-                new_availability = int(input("Enter the new availability: "))
-
                 cursor.execute('''
                     UPDATE books
                     SET title = ?, author = ?, isbn = ?, genre = ?, availability = ?
@@ -359,79 +305,64 @@ def update_book(title):
                 ''', (new_title, new_author, new_isbn, new_genre, new_availability, book[0]))
 
                 connection.commit()
+                cache.invalidate_book(book[0], book[1], book[2])
+                cache.invalidate_book(title=new_title, author=new_author)
                 print("Book updated successfully.")
             else:
                 print(f"Book '{title}' not found.")
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
-def login_user(email, password):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT id FROM users WHERE email = ? AND password = ?', (email, password))
-            user_id = cursor.fetchone()
+def check_login(email, password):
+    return auth.authenticate(email, password)
 
-            return user_id[0] if user_id else None
+def login_user(email, password):
+    try:
+        return check_login(email, password)
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
     return None
 
-def get_user_id(email):
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-            user_id = cursor.fetchone()
+def _load_user_id(email):
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
+        user_id = cursor.fetchone()
+
+        return user_id[0] if user_id else None
 
-            return user_id[0] if user_id else None
+def get_user_id(email):
+    try:
+        return cache.user_ids.get_or_load(email, lambda: _load_user_id(email))
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
     return None
 
 def user_transactions():
-    connection = create_connection()
-    if connection is not None:
-        try:
-            cursor = connection.cursor()
-            cursor.execute('''
-                SELECT users.name, transactions.id, books.title, transactions.timestamp
-                FROM transactions
-                JOIN books ON transactions.book_id = books.id
-                JOIN users ON transactions.user_id = users.id
-            ''')
-
-            all_user_transactions = cursor.fetchall()
-
-            if not all_user_transactions:
-                print("No transactions found.")
-            else:
+    try:
+        found = False
+        for transactions in pagination.iter_pages(pagination.transactions_page):
+            if not found:
                 print("\nAll User Transactions:")
-                for user_transaction in all_user_transactions:
-                    user_name, transaction_id, book_title, timestamp = user_transaction
-                    print(f"User: {user_name}, Transaction ID: {transaction_id}, Book: {book_title}, Timestamp: {timestamp}")
+                found = True
+            for user_transaction in transactions:
+                transaction_id, user_name, book_title, borrowed_at, returned_at = user_transaction
+                print(f"User: {user_name}, Transaction ID: {transaction_id}, Book: {book_title}, "
+                      f"Borrowed: {borrowed_at}, Returned: {returned_at or 'not yet'}")
+
+        if not found:
+            print("No transactions found.")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
 
 def delete_user(email):
-    connection = create_connection()
-    if connection is not None:
-        try:
+    try:
+        with get_connection() as connection:
             cursor = connection.cursor()
 
             # Check if the user exists
@@ -439,24 +370,25 @@ def delete_user(email):
             user_id = cursor.fetchone()
 
             if user_id:
-                # Delete user and associated transactions
+                # Delete the user; their loans stay in the ledger as history
                 cursor.execute('DELETE FROM users WHERE id = ?', (user_id[0],))
-                cursor.execute('DELETE FROM transactions WHERE user_id = ?', (user_id[0],))
 
                 connection.commit()
+                cache.invalidate_user(email)
+                auth.end_user_sessions(user_id[0])
                 print(f"User '{email}' deleted successfully.")
             else:
                 print(f"User '{email}' not found.")
 
-        except sqlite3.Error as e:
-            print(f"Error: {e}")
-        finally:
-            connection.close()
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+
 
 
 # Main function
 if __name__ == "__main__":
 
+    instrumentation.install_from_environment()
     initialize_database()
 
     while True:
@@ -491,11 +423,25 @@ if __name__ == "__main__":
                         availability = int(input("Enter the number of copies available: "))
                         add_book(title, author, isbn, genre, availability)
                     elif admin_choice == "2":  
-                        delete_book()
+                        title = input("Enter the title of the book to delete: ")
+                        author = input("Enter the author of the book to delete: ")
+                        delete_book(title, author)
 
                     elif admin_choice == "3":  
                         title = input("Enter the title of the book to update: ")
-                        update_book(title)
+                        book = get_book_by_title(title)
+                        if book:
+                            print("Current Book Information:")
+                            print_book(book)
+
+                            new_title = input("Enter the new title: ")
+                            new_author = input("Enter the new author: ")
+                            new_isbn = input("Enter the new ISBN: ")
+                            new_genre = input("Enter the new genre: ")
+                            new_availability = int(input("Enter the new availability: "))
+                            update_book(title, new_title, new_author, new_isbn, new_genre, new_availability)
+                        else:
+                            print(f"Book '{title}' not found.")
 
                     elif admin_choice == "4":  
                         list_books()
@@ -526,31 +472,24 @@ if __name__ == "__main__":
             if auth_choice == "1":  
                 while True:
                     name = input("Enter your name: ")
-                    if name.isalpha():
+                    if accounts.is_valid_name(name):
                         break
                     else:
-                        print("Invalid name. Please use only alphabets.")
+                        print(accounts.INVALID_NAME)
 
                 while True:
                     email = input("Enter your email: ")
-                    if email.lower().endswith(("gmail.com", "gmail.org", "gmail.in")):
+                    if accounts.is_valid_email(email):
                         break
                     else:
-                        print("Invalid email. Please use a Gmail address.")
+                        print(accounts.INVALID_EMAIL)
 
                 while True:
                     password = input("Create a password: ")
-                    if (
-                        len(password) >= 6
-                        and any(c.isalpha() for c in password)
-                        and any(c.isdigit() for c in password)
-                        and any(c.isascii() and not c.isalnum() for c in password)
-                    ):
+                    if accounts.is_strong_password(password):
                         break
                     else:
-                        print(
-                            "Weak password. Please use at least 6 characters, 1 alphabet, 1 number, and 1 special character."
-                        )
+                        print(accounts.WEAK_PASSWORD)
 
                 add_user(name, email, password, "user")
                 print("Sign up successful.")
@@ -559,18 +498,21 @@ if __name__ == "__main__":
                 user_id = get_user_id(email)  
                 while True:
                     print("\nUser Menu:")
-                    print("1. Borrow a Book")
-                    print("2. Return a Book")
+                    print("1. Borrow Books")
+                    print("2. Return Books")
                     print("3. List Books")
                     print("4. Find Book")
-                    print("5. Exit")
+                    print("5. Place a Hold")
+                    print("6. Exit")
 
                     user_action = input("Enter your choice: ")
                     if user_action == "1":  
-                        borrow_book(user_id)
+                        items = input("Enter the IDs or ISBNs of the books to borrow, separated by commas: ")
+                        borrow_books(user_id, parse_items(items))
 
-                    if user_action == "2":  
-                        return_book(user_id)
+                    elif user_action == "2":  
+                        items = input("Enter the IDs or ISBNs of the books to return, separated by commas: ")
+                        return_books(user_id, parse_items(items))
 
                     elif user_action == "3":  
                         list_books()
@@ -579,7 +521,14 @@ if __name__ == "__main__":
                         title = input("Enter the title of the book you want to find: ")
                         find_book(title)
 
-                    elif user_action == "5":  
+                    elif user_action == "5":
+                        book_id = input("Enter the ID of the book to hold: ")
+                        if book_id.isdigit():
+                            place_hold(user_id, int(book_id))
+                        else:
+                            print("Please enter a book ID.")
+
+                    elif user_action == "6":  
                         print("Exiting User Menu. Goodbye!")
                         break
 
@@ -594,25 +543,23 @@ if __name__ == "__main__":
                 if user_id:
                     print("Login successful.")
 
-                    user_id = get_user_id(email)  
                     print("\nUser Menu:")
-                    print("1. Borrow a Book")
-                    print("2. Return a Book")
+                    print("1. Borrow Books")
+                    print("2. Return Books")
                     print("3. List Books")
                     print("4. Find Book")
-                    print("5. Exit")
+                    print("5. Place a Hold")
+                    print("6. Exit")
 
                     user_action = input("Enter your choice: ")
 
                     if user_action == "1": 
-                        book_id = input("Enter the ID of the book you want to borrow: ")
-                        borrow_book(user_id, book_id)
+                        items = input("Enter the IDs or ISBNs of the books to borrow, separated by commas: ")
+                        borrow_books(user_id, parse_items(items))
 
                     elif user_action == "2":  
-                        print("Return a Book:")
-                        book_name = input("Enter the name of the book you want to return: ")
-                        author = input("Enter the author of the book: ")
-                        return_book(user_id, book_name, author)
+                        items = input("Enter the IDs or ISBNs of the books to return, separated by commas: ")
+                        return_books(user_id, parse_items(items))
 
                     elif user_action == "3":  
                         list_books()
@@ -621,7 +568,14 @@ if __name__ == "__main__":
                         title = input("Enter the title of the book you want to find: ")
                         find_book(title)
 
-                    elif user_action == "5":  
+                    elif user_action == "5":
+                        book_id = input("Enter the ID of the book to hold: ")
+                        if book_id.isdigit():
+                            place_hold(user_id, int(book_id))
+                        else:
+                            print("Please enter a book ID.")
+
+                    elif user_action == "6":  
                         print("Exiting User Menu. Goodbye!")
                         break
 
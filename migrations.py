@@ -0,0 +1,666 @@
+import sqlite3
+
+import timestamps
+from timestamps import NOW_MICROS_SQL
+
+# (table, column) of every stored timestamp, for migration 11
+TIMESTAMP_COLUMNS = [
+    ('transactions', 'borrowed_at'),
+    ('transactions', 'returned_at'),
+    ('holds', 'placed_at'),
+    ('holds', 'ready_at'),
+    ('holds', 'expires_at'),
+    ('import_checkpoints', 'updated_at'),
+    ('book_stats', 'last_borrowed_at'),
+    ('user_stats', 'last_active_at'),
+    ('change_log', 'changed_at'),
+]
+
+
+def _timestamps_to_micros(cursor):
+    cursor.connection.create_function('to_micros', 1, timestamps.text_to_micros, deterministic=True)
+    for table, column in TIMESTAMP_COLUMNS:
+        cursor.execute(f"UPDATE {table} SET {column} = to_micros({column}) WHERE typeof({column}) = 'text'")
+
+
+# Each entry moves the schema up by one version. The version a database file
+# has reached is kept in PRAGMA user_version, so only the missing steps run.
+MIGRATIONS = [
+    # 1: the original tables
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            email TEXT UNIQUE,
+            password TEXT,
+            role TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY,
+            title TEXT,
+            author TEXT,
+            isbn TEXT,
+            genre TEXT,
+            availability INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            book_id INTEGER,
+            timestamp DATETIME,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (book_id) REFERENCES books(id)
+        )
+        ''',
+    ),
+    # 2: secondary indexes for the lookups in main.py
+    (
+        # find_book, update_book, delete_book and borrow_book look up by title (and author)
+        'CREATE INDEX IF NOT EXISTS idx_books_title_author ON books (title, author)',
+        # available_books, covering so the listing never touches the table
+        'CREATE INDEX IF NOT EXISTS idx_books_availability ON books (availability, title, author)',
+        # return_book and delete_user find a user's loans
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user_book ON transactions (user_id, book_id)',
+    ),
+    # 3: bulk catalog import
+    (
+        # duplicate checks by ISBN
+        'CREATE INDEX IF NOT EXISTS idx_books_isbn ON books (isbn)',
+        # how far each import source got, committed together with its rows
+        '''
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            updated_at DATETIME
+        )
+        ''',
+    ),
+    # 4: full-text search over the catalog, see search.py
+    (
+        # word index for ranked and prefix queries
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, genre, isbn,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        # trigram index for misspelled titles and authors
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_trigram USING fts5(
+            title, author,
+            content='books', content_rowid='id',
+            tokenize='trigram'
+        )
+        ''',
+        # how many books contain each trigram, to query with the rarest ones
+        "CREATE VIRTUAL TABLE IF NOT EXISTS books_trigram_vocab USING fts5vocab(books_trigram, 'row')",
+        '''
+        CREATE TRIGGER IF NOT EXISTS books_search_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author, genre, isbn)
+            VALUES (new.id, new.title, new.author, new.genre, new.isbn);
+            INSERT INTO books_trigram (rowid, title, author)
+            VALUES (new.id, new.title, new.author);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS books_search_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, genre, isbn)
+            VALUES ('delete', old.id, old.title, old.author, old.genre, old.isbn);
+            INSERT INTO books_trigram (books_trigram, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+        END
+        ''',
+        # availability changes on every loan and must not touch the indexes
+        '''
+        CREATE TRIGGER IF NOT EXISTS books_search_update
+        AFTER UPDATE OF title, author, genre, isbn ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, genre, isbn)
+            VALUES ('delete', old.id, old.title, old.author, old.genre, old.isbn);
+            INSERT INTO books_trigram (books_trigram, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+            INSERT INTO books_fts (rowid, title, author, genre, isbn)
+            VALUES (new.id, new.title, new.author, new.genre, new.isbn);
+            INSERT INTO books_trigram (rowid, title, author)
+            VALUES (new.id, new.title, new.author);
+        END
+        ''',
+        # index the books that are already there
+        "INSERT INTO books_fts (books_fts) VALUES ('rebuild')",
+        "INSERT INTO books_trigram (books_trigram) VALUES ('rebuild')",
+    ),
+    # 5: transactions become an append-only loan ledger; a return sets
+    # returned_at instead of deleting the row
+    (
+        'ALTER TABLE transactions RENAME COLUMN timestamp TO borrowed_at',
+        'ALTER TABLE transactions ADD COLUMN returned_at DATETIME',
+        'DROP INDEX IF EXISTS idx_transactions_user_book',
+        # return_book finds a user's open loan; returned rows leave the index,
+        # so it stays the size of the books currently out
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_open
+        ON transactions (user_id, book_id) WHERE returned_at IS NULL
+        ''',
+        # archive.py picks closed loans older than a cutoff
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_returned
+        ON transactions (returned_at) WHERE returned_at IS NOT NULL
+        ''',
+    ),
+    # 6: penalties.py reads every open loan's borrowed_at; with it in the
+    # open-loan index that scan never visits the table
+    (
+        'DROP INDEX IF EXISTS idx_transactions_open',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_open
+        ON transactions (user_id, book_id, borrowed_at) WHERE returned_at IS NULL
+        ''',
+    ),
+    # 7: the latest change to each book, numbered, so catalog snapshots can
+    # refresh just the books changed since they were taken (see snapshot.py)
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS book_changes (
+            book_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_book_changes_seq ON book_changes (seq)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS book_changes_insert AFTER INSERT ON books BEGIN
+            INSERT OR REPLACE INTO book_changes (book_id, seq)
+            VALUES (new.id, (SELECT IFNULL(MAX(seq), 0) + 1 FROM book_changes));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS book_changes_update AFTER UPDATE ON books BEGIN
+            INSERT OR REPLACE INTO book_changes (book_id, seq)
+            VALUES (new.id, (SELECT IFNULL(MAX(seq), 0) + 1 FROM book_changes));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS book_changes_delete AFTER DELETE ON books BEGIN
+            INSERT OR REPLACE INTO book_changes (book_id, seq)
+            VALUES (old.id, (SELECT IFNULL(MAX(seq), 0) + 1 FROM book_changes));
+        END
+        ''',
+    ),
+    # 8: aggregates for analytics.py, kept current by triggers on the loan
+    # ledger and on books; a NULL genre is counted under ''
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS book_stats (
+            book_id INTEGER PRIMARY KEY,
+            borrows INTEGER NOT NULL DEFAULT 0,
+            last_borrowed_at DATETIME
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_book_stats_borrows ON book_stats (borrows)',
+        '''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            borrows INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            open_loans INTEGER NOT NULL DEFAULT 0,
+            last_active_at DATETIME
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_user_stats_borrows ON user_stats (borrows)',
+        '''
+        CREATE TABLE IF NOT EXISTS genre_stats (
+            genre TEXT PRIMARY KEY,
+            books INTEGER NOT NULL DEFAULT 0,
+            on_shelf INTEGER NOT NULL DEFAULT 0,
+            on_loan INTEGER NOT NULL DEFAULT 0,
+            borrows INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS genre_daily (
+            genre TEXT NOT NULL,
+            day DATE NOT NULL,
+            borrows INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (genre, day)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_genre_daily_day ON genre_daily (day)',
+        # borrows by day of the week (0 is Sunday) and hour
+        '''
+        CREATE TABLE IF NOT EXISTS borrow_hours (
+            weekday INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            borrows INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (weekday, hour)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS loan_stats_borrow AFTER INSERT ON transactions BEGIN
+            INSERT INTO book_stats (book_id, borrows, last_borrowed_at)
+            VALUES (new.book_id, 1, new.borrowed_at)
+            ON CONFLICT (book_id) DO UPDATE
+            SET borrows = borrows + 1, last_borrowed_at = excluded.last_borrowed_at;
+
+            INSERT INTO user_stats (user_id, borrows, open_loans, last_active_at)
+            VALUES (new.user_id, 1, 1, new.borrowed_at)
+            ON CONFLICT (user_id) DO UPDATE
+            SET borrows = borrows + 1, open_loans = open_loans + 1, last_active_at = excluded.last_active_at;
+
+            INSERT INTO genre_stats (genre, on_loan, borrows)
+            VALUES (IFNULL((SELECT genre FROM books WHERE id = new.book_id), ''), 1, 1)
+            ON CONFLICT (genre) DO UPDATE SET on_loan = on_loan + 1, borrows = borrows + 1;
+
+            INSERT INTO genre_daily (genre, day, borrows)
+            VALUES (IFNULL((SELECT genre FROM books WHERE id = new.book_id), ''), date(new.borrowed_at), 1)
+            ON CONFLICT (genre, day) DO UPDATE SET borrows = borrows + 1;
+
+            INSERT INTO borrow_hours (weekday, hour, borrows)
+            VALUES (CAST(strftime('%w', new.borrowed_at) AS INTEGER), CAST(strftime('%H', new.borrowed_at) AS INTEGER), 1)
+            ON CONFLICT (weekday, hour) DO UPDATE SET borrows = borrows + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS loan_stats_return AFTER UPDATE OF returned_at ON transactions
+        WHEN old.returned_at IS NULL AND new.returned_at IS NOT NULL BEGIN
+            UPDATE user_stats
+            SET returns = returns + 1, open_loans = open_loans - 1, last_active_at = new.returned_at
+            WHERE user_id = new.user_id;
+
+            UPDATE genre_stats SET on_loan = on_loan - 1
+            WHERE genre = IFNULL((SELECT genre FROM books WHERE id = new.book_id), '');
+
+            INSERT INTO genre_daily (genre, day, returns)
+            VALUES (IFNULL((SELECT genre FROM books WHERE id = new.book_id), ''), date(new.returned_at), 1)
+            ON CONFLICT (genre, day) DO UPDATE SET returns = returns + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS genre_stats_book_insert AFTER INSERT ON books BEGIN
+            INSERT INTO genre_stats (genre, books, on_shelf)
+            VALUES (IFNULL(new.genre, ''), 1, IFNULL(new.availability, 0))
+            ON CONFLICT (genre) DO UPDATE SET books = books + 1, on_shelf = on_shelf + excluded.on_shelf;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS genre_stats_book_delete AFTER DELETE ON books BEGIN
+            UPDATE genre_stats SET books = books - 1, on_shelf = on_shelf - IFNULL(old.availability, 0)
+            WHERE genre = IFNULL(old.genre, '');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS genre_stats_book_update AFTER UPDATE OF genre, availability ON books BEGIN
+            UPDATE genre_stats SET books = books - 1, on_shelf = on_shelf - IFNULL(old.availability, 0)
+            WHERE genre = IFNULL(old.genre, '');
+            INSERT INTO genre_stats (genre, books, on_shelf)
+            VALUES (IFNULL(new.genre, ''), 1, IFNULL(new.availability, 0))
+            ON CONFLICT (genre) DO UPDATE SET books = books + 1, on_shelf = on_shelf + excluded.on_shelf;
+        END
+        ''',
+        # fill the aggregates from the books and loans already there
+        '''
+        INSERT INTO book_stats (book_id, borrows, last_borrowed_at)
+        SELECT book_id, COUNT(*), MAX(borrowed_at) FROM transactions GROUP BY book_id
+        ''',
+        '''
+        INSERT INTO user_stats (user_id, borrows, returns, open_loans, last_active_at)
+        SELECT user_id, COUNT(*), COUNT(returned_at), COUNT(*) - COUNT(returned_at),
+               MAX(MAX(borrowed_at), IFNULL(MAX(returned_at), ''))
+        FROM transactions GROUP BY user_id
+        ''',
+        '''
+        INSERT INTO genre_stats (genre, books, on_shelf)
+        SELECT IFNULL(genre, ''), COUNT(*), IFNULL(SUM(availability), 0) FROM books GROUP BY 1
+        ''',
+        '''
+        INSERT INTO genre_stats (genre, on_loan, borrows)
+        SELECT IFNULL(books.genre, ''), COUNT(*) - COUNT(transactions.returned_at), COUNT(*)
+        FROM transactions JOIN books ON books.id = transactions.book_id
+        WHERE true GROUP BY 1
+        ON CONFLICT (genre) DO UPDATE SET on_loan = excluded.on_loan, borrows = excluded.borrows
+        ''',
+        '''
+        INSERT INTO genre_daily (genre, day, borrows)
+        SELECT IFNULL(books.genre, ''), date(transactions.borrowed_at), COUNT(*)
+        FROM transactions JOIN books ON books.id = transactions.book_id
+        WHERE transactions.borrowed_at IS NOT NULL GROUP BY 1, 2
+        ''',
+        '''
+        INSERT INTO genre_daily (genre, day, returns)
+        SELECT IFNULL(books.genre, ''), date(transactions.returned_at), COUNT(*)
+        FROM transactions JOIN books ON books.id = transactions.book_id
+        WHERE transactions.returned_at IS NOT NULL GROUP BY 1, 2
+        ON CONFLICT (genre, day) DO UPDATE SET returns = excluded.returns
+        ''',
+        '''
+        INSERT INTO borrow_hours (weekday, hour, borrows)
+        SELECT CAST(strftime('%w', borrowed_at) AS INTEGER), CAST(strftime('%H', borrowed_at) AS INTEGER), COUNT(*)
+        FROM transactions WHERE borrowed_at IS NOT NULL GROUP BY 1, 2
+        ''',
+    ),
+    # 9: holds on books with no copy on the shelf, see holds.py
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS holds (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            placed_at DATETIME NOT NULL,
+            ready_at DATETIME,
+            expires_at DATETIME,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (book_id) REFERENCES books(id)
+        )
+        ''',
+        # each book's waitlist in the order holds were placed
+        "CREATE INDEX IF NOT EXISTS idx_holds_queue ON holds (book_id, id) WHERE status = 'waiting'",
+        # copies set aside and not yet collected, soonest expiry first
+        "CREATE INDEX IF NOT EXISTS idx_holds_expiry ON holds (expires_at) WHERE status = 'ready'",
+        # a patron's holds, and at most one open hold per patron and book
+        'CREATE INDEX IF NOT EXISTS idx_holds_user ON holds (user_id, status)',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_open
+        ON holds (user_id, book_id) WHERE status IN ('waiting', 'ready')
+        ''',
+    ),
+    # 10: change log for mirrors and notifications, see changes.py. seq only
+    # grows (AUTOINCREMENT never reuses one, even after pruning), and with a
+    # single writer at a time changes commit in seq order
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            data TEXT NOT NULL,
+            changed_at DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_book_insert AFTER INSERT ON books BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('book', new.id, 'insert', json_object(
+                'id', new.id, 'title', new.title, 'author', new.author, 'isbn', new.isbn,
+                'genre', new.genre, 'availability', new.availability
+            ));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_book_update AFTER UPDATE ON books BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('book', new.id, 'update', json_object(
+                'id', new.id, 'title', new.title, 'author', new.author, 'isbn', new.isbn,
+                'genre', new.genre, 'availability', new.availability
+            ));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_book_delete AFTER DELETE ON books BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('book', old.id, 'delete', json_object(
+                'id', old.id, 'title', old.title, 'author', old.author, 'isbn', old.isbn,
+                'genre', old.genre, 'availability', old.availability
+            ));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_borrow AFTER INSERT ON transactions BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('loan', new.id, 'borrow', json_object(
+                'id', new.id, 'user_id', new.user_id, 'book_id', new.book_id,
+                'borrowed_at', new.borrowed_at, 'returned_at', new.returned_at
+            ));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_return AFTER UPDATE OF returned_at ON transactions
+        WHEN old.returned_at IS NULL AND new.returned_at IS NOT NULL BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('loan', new.id, 'return', json_object(
+                'id', new.id, 'user_id', new.user_id, 'book_id', new.book_id,
+                'borrowed_at', new.borrowed_at, 'returned_at', new.returned_at
+            ));
+        END
+        ''',
+        # users without their password hash
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_user_insert AFTER INSERT ON users BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('user', new.id, 'insert', json_object(
+                'id', new.id, 'name', new.name, 'email', new.email, 'role', new.role
+            ));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_user_update AFTER UPDATE OF name, email, role ON users BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('user', new.id, 'update', json_object(
+                'id', new.id, 'name', new.name, 'email', new.email, 'role', new.role
+            ));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_user_delete AFTER DELETE ON users BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data)
+            VALUES ('user', old.id, 'delete', json_object(
+                'id', old.id, 'name', old.name, 'email', old.email, 'role', old.role
+            ));
+        END
+        ''',
+    ),
+    # 11: timestamps become integer microseconds since the Unix epoch (see
+    # timestamps.py), so range queries compare integers, and loans get
+    # indexes on borrowed_at for them. Existing text values are converted in
+    # place; the triggers that read or write timestamps are recreated for
+    # the new values. change_log.changed_at keeps its old text default, which
+    # SQLite can't alter, so its triggers now set it explicitly.
+    (
+        _timestamps_to_micros,
+        'CREATE INDEX IF NOT EXISTS idx_transactions_borrowed ON transactions (borrowed_at)',
+        # open loans past a date, oldest first, without visiting returned ones
+        '''
+        CREATE INDEX IF NOT EXISTS idx_transactions_open_borrowed
+        ON transactions (borrowed_at) WHERE returned_at IS NULL
+        ''',
+        'DROP TRIGGER IF EXISTS loan_stats_borrow',
+        '''
+        CREATE TRIGGER loan_stats_borrow AFTER INSERT ON transactions BEGIN
+            INSERT INTO book_stats (book_id, borrows, last_borrowed_at)
+            VALUES (new.book_id, 1, new.borrowed_at)
+            ON CONFLICT (book_id) DO UPDATE
+            SET borrows = borrows + 1, last_borrowed_at = excluded.last_borrowed_at;
+
+            INSERT INTO user_stats (user_id, borrows, open_loans, last_active_at)
+            VALUES (new.user_id, 1, 1, new.borrowed_at)
+            ON CONFLICT (user_id) DO UPDATE
+            SET borrows = borrows + 1, open_loans = open_loans + 1, last_active_at = excluded.last_active_at;
+
+            INSERT INTO genre_stats (genre, on_loan, borrows)
+            VALUES (IFNULL((SELECT genre FROM books WHERE id = new.book_id), ''), 1, 1)
+            ON CONFLICT (genre) DO UPDATE SET on_loan = on_loan + 1, borrows = borrows + 1;
+
+            INSERT INTO genre_daily (genre, day, borrows)
+            VALUES (
+                IFNULL((SELECT genre FROM books WHERE id = new.book_id), ''),
+                date(new.borrowed_at / 1000000, 'unixepoch', 'localtime'), 1
+            )
+            ON CONFLICT (genre, day) DO UPDATE SET borrows = borrows + 1;
+
+            INSERT INTO borrow_hours (weekday, hour, borrows)
+            VALUES (
+                CAST(strftime('%w', new.borrowed_at / 1000000, 'unixepoch', 'localtime') AS INTEGER),
+                CAST(strftime('%H', new.borrowed_at / 1000000, 'unixepoch', 'localtime') AS INTEGER), 1
+            )
+            ON CONFLICT (weekday, hour) DO UPDATE SET borrows = borrows + 1;
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS loan_stats_return',
+        '''
+        CREATE TRIGGER loan_stats_return AFTER UPDATE OF returned_at ON transactions
+        WHEN old.returned_at IS NULL AND new.returned_at IS NOT NULL BEGIN
+            UPDATE user_stats
+            SET returns = returns + 1, open_loans = open_loans - 1, last_active_at = new.returned_at
+            WHERE user_id = new.user_id;
+
+            UPDATE genre_stats SET on_loan = on_loan - 1
+            WHERE genre = IFNULL((SELECT genre FROM books WHERE id = new.book_id), '');
+
+            INSERT INTO genre_daily (genre, day, returns)
+            VALUES (
+                IFNULL((SELECT genre FROM books WHERE id = new.book_id), ''),
+                date(new.returned_at / 1000000, 'unixepoch', 'localtime'), 1
+            )
+            ON CONFLICT (genre, day) DO UPDATE SET returns = returns + 1;
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_book_insert',
+        f'''
+        CREATE TRIGGER change_log_book_insert AFTER INSERT ON books BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('book', new.id, 'insert', json_object(
+                'id', new.id, 'title', new.title, 'author', new.author, 'isbn', new.isbn,
+                'genre', new.genre, 'availability', new.availability
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_book_update',
+        f'''
+        CREATE TRIGGER change_log_book_update AFTER UPDATE ON books BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('book', new.id, 'update', json_object(
+                'id', new.id, 'title', new.title, 'author', new.author, 'isbn', new.isbn,
+                'genre', new.genre, 'availability', new.availability
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_book_delete',
+        f'''
+        CREATE TRIGGER change_log_book_delete AFTER DELETE ON books BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('book', old.id, 'delete', json_object(
+                'id', old.id, 'title', old.title, 'author', old.author, 'isbn', old.isbn,
+                'genre', old.genre, 'availability', old.availability
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_borrow',
+        f'''
+        CREATE TRIGGER change_log_borrow AFTER INSERT ON transactions BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('loan', new.id, 'borrow', json_object(
+                'id', new.id, 'user_id', new.user_id, 'book_id', new.book_id,
+                'borrowed_at', new.borrowed_at, 'returned_at', new.returned_at
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_return',
+        f'''
+        CREATE TRIGGER change_log_return AFTER UPDATE OF returned_at ON transactions
+        WHEN old.returned_at IS NULL AND new.returned_at IS NOT NULL BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('loan', new.id, 'return', json_object(
+                'id', new.id, 'user_id', new.user_id, 'book_id', new.book_id,
+                'borrowed_at', new.borrowed_at, 'returned_at', new.returned_at
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_user_insert',
+        f'''
+        CREATE TRIGGER change_log_user_insert AFTER INSERT ON users BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('user', new.id, 'insert', json_object(
+                'id', new.id, 'name', new.name, 'email', new.email, 'role', new.role
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_user_update',
+        f'''
+        CREATE TRIGGER change_log_user_update AFTER UPDATE OF name, email, role ON users BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('user', new.id, 'update', json_object(
+                'id', new.id, 'name', new.name, 'email', new.email, 'role', new.role
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS change_log_user_delete',
+        f'''
+        CREATE TRIGGER change_log_user_delete AFTER DELETE ON users BEGIN
+            INSERT INTO change_log (entity, entity_id, op, data, changed_at)
+            VALUES ('user', old.id, 'delete', json_object(
+                'id', old.id, 'name', old.name, 'email', old.email, 'role', old.role
+            ), {NOW_MICROS_SQL});
+        END
+        ''',
+    ),
+    # 12: a patron's loan history, newest first, for branches.py
+    (
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, borrowed_at)',
+    ),
+    # 13: "patrons who borrowed this also borrowed", see recommendations.py.
+    # How many patrons borrowed each book and each pair of books (both ways
+    # round), and each book's top neighbors by rank.
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS book_borrowers (
+            book_id INTEGER PRIMARY KEY,
+            users INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS co_borrows (
+            book_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            PRIMARY KEY (book_id, other_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS book_neighbors (
+            book_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (book_id, rank)
+        ) WITHOUT ROWID
+        ''',
+    ),
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(connection, target=LATEST_VERSION):
+    current = get_schema_version(connection)
+    if current > LATEST_VERSION:
+        raise sqlite3.DatabaseError(
+            f"Database schema version {current} is newer than this code ({LATEST_VERSION})"
+        )
+
+    cursor = connection.cursor()
+    for version in range(current + 1, target + 1):
+        # every step commits together with its version number, or not at all
+        cursor.execute('BEGIN')
+        try:
+            for step in MIGRATIONS[version - 1]:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            connection.commit()
+        except sqlite3.Error:
+            connection.rollback()
+            raise
+
+    return get_schema_version(connection)
@@ -0,0 +1,127 @@
+import cache
+from database import get_connection
+
+PAGE_SIZE = 50
+FETCH_SIZE = 500
+
+
+# Cursor tokens are the id of the last row on a page. Callers should treat
+# them as opaque strings and hand them back unchanged for the next page.
+def encode_cursor(last_id):
+    return None if last_id is None else str(last_id)
+
+
+def decode_cursor(token):
+    if token in (None, ''):
+        return 0
+    try:
+        last_id = int(token)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid page cursor {token!r}") from None
+    if last_id < 0:
+        raise ValueError(f"Invalid page cursor {token!r}")
+    return last_id
+
+
+# every query takes the last seen id and a limit, and orders by the id it
+# compares against, so each page is an index range read
+BOOKS_PAGE = '''
+    SELECT id, title, author, genre, availability
+    FROM books
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+'''
+
+AVAILABLE_BOOKS_PAGE = '''
+    SELECT id, title, author
+    FROM books
+    WHERE id > ? AND availability > 0
+    ORDER BY id
+    LIMIT ?
+'''
+
+TRANSACTIONS_PAGE = '''
+    SELECT transactions.id, users.name, books.title, transactions.borrowed_at, transactions.returned_at
+    FROM transactions
+    JOIN books ON transactions.book_id = books.id
+    JOIN users ON transactions.user_id = users.id
+    WHERE transactions.id > ?
+    ORDER BY transactions.id
+    LIMIT ?
+'''
+
+USER_TRANSACTIONS_PAGE = '''
+    SELECT transactions.id, users.name, books.title, transactions.borrowed_at, transactions.returned_at
+    FROM transactions
+    JOIN books ON transactions.book_id = books.id
+    JOIN users ON transactions.user_id = users.id
+    WHERE transactions.user_id = ? AND transactions.id > ?
+    ORDER BY transactions.id
+    LIMIT ?
+'''
+
+
+# returns (rows, next_cursor); next_cursor is None on the last page.
+# parameters go before the cursor and limit.
+def fetch_page(query, cursor=None, limit=PAGE_SIZE, parameters=()):
+    if limit < 1:
+        raise ValueError("Page size must be at least 1")
+
+    with get_connection() as connection:
+        # one extra row tells us whether another page exists
+        rows = connection.execute(query, (*parameters, decode_cursor(cursor), limit + 1)).fetchall()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1][0])
+    return rows, None
+
+
+# catalog pages are cached until the next write to books
+def books_page(cursor=None, limit=PAGE_SIZE):
+    return cache.book_pages.get_or_load(
+        ('books', cursor, limit),
+        lambda: fetch_page(BOOKS_PAGE, cursor, limit),
+    )
+
+
+def available_books_page(cursor=None, limit=PAGE_SIZE):
+    return cache.book_pages.get_or_load(
+        ('available', cursor, limit),
+        lambda: fetch_page(AVAILABLE_BOOKS_PAGE, cursor, limit),
+    )
+
+
+def transactions_page(cursor=None, limit=PAGE_SIZE):
+    return fetch_page(TRANSACTIONS_PAGE, cursor, limit)
+
+
+def user_transactions_page(user_id, cursor=None, limit=PAGE_SIZE):
+    return fetch_page(USER_TRANSACTIONS_PAGE, cursor, limit, (user_id,))
+
+
+# to walk every page of one of the *_page functions; the connection goes back
+# to the pool between pages
+def iter_pages(page, page_size=PAGE_SIZE):
+    cursor = None
+    while True:
+        rows, cursor = page(cursor, page_size)
+        if rows:
+            yield rows
+        if cursor is None:
+            return
+
+
+# to stream a whole query from one read snapshot without fetchall()
+def iter_rows(query, parameters=(), size=FETCH_SIZE):
+    with get_connection() as connection:
+        cursor = connection.execute(query, parameters)
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
@@ -0,0 +1,211 @@
+# Overdue days and fines for every open loan at once.
+#
+#     python penalties.py --top 20 --csv overdue.csv --policies policies.json
+#
+# Open loans are loaded as integer columns: ids, borrowed_at as stored
+# (epoch microseconds) and the index of the loan policy that applies, which
+# a CASE expression built from circulation.POLICIES picks in the same query,
+# in circulation.policy_rank order. Fines are then computed a column at a
+# time, with NumPy when it is installed and with plain arrays otherwise. The
+# rules, and the days counted, are the ones circulation.calculate_penalty
+# applies to a single return.
+
+import argparse
+import csv
+import datetime
+import json
+import sqlite3
+import time
+from array import array
+from collections import namedtuple
+from itertools import chain
+
+import circulation
+import timestamps
+from database import get_connection
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS = 5
+TOP_USERS = 10
+# stands in for "no cap" in the max_fine column
+NO_CAP = 2 ** 62
+
+# columns are numpy arrays, or array('q') without NumPy; policies[i] is the
+# policy for policy_index i
+OpenLoans = namedtuple('OpenLoans', 'ids user_ids book_ids borrowed policy_index policies')
+Assessment = namedtuple('Assessment', 'days_overdue fines')
+
+
+# most specific first, so the first matching WHEN is what policy_for returns
+def _ordered_policies(policies):
+    return sorted(policies.items(), key=lambda item: circulation.policy_rank(item[0]))
+
+
+def _open_loans_query(ordered):
+    cases, parameters = [], []
+    for index, ((genre, role), _) in enumerate(ordered, start=1):
+        conditions = []
+        if genre is not None:
+            conditions.append('books.genre = ?')
+            parameters.append(genre)
+        if role is not None:
+            conditions.append('users.role = ?')
+            parameters.append(role)
+        cases.append(f"WHEN {' AND '.join(conditions) or '1'} THEN {index}")
+
+    joins = ''
+    if any(genre is not None for (genre, _), _ in ordered):
+        joins += ' LEFT JOIN books ON books.id = transactions.book_id'
+    if any(role is not None for (_, role), _ in ordered):
+        joins += ' LEFT JOIN users ON users.id = transactions.user_id'
+    policy = f"CASE {' '.join(cases)} ELSE 0 END" if cases else '0'
+
+    # + 0 leaves borrowed_at without its DATETIME type, so the pool's
+    # connections don't turn it into a datetime
+    query = f'''
+        SELECT transactions.id, transactions.user_id, transactions.book_id,
+               transactions.borrowed_at + 0, {policy}
+        FROM transactions{joins}
+        WHERE transactions.returned_at IS NULL AND transactions.borrowed_at IS NOT NULL
+    '''
+    return query, parameters
+
+
+def _columns(flat, count):
+    if numpy is not None:
+        table = numpy.fromiter(flat, dtype=numpy.int64, count=count * COLUMNS).reshape(count, COLUMNS)
+        return [table[:, i] for i in range(COLUMNS)]
+    table = array('q', flat)
+    return [table[i::COLUMNS] for i in range(COLUMNS)]
+
+
+def load_open_loans(policies=None):
+    ordered = _ordered_policies(circulation.POLICIES if policies is None else policies)
+    query, parameters = _open_loans_query(ordered)
+    with get_connection() as connection:
+        rows = connection.execute(query, parameters).fetchall()
+
+    ids, user_ids, book_ids, borrowed, policy_index = _columns(chain.from_iterable(rows), len(rows))
+    return OpenLoans(ids, user_ids, book_ids, borrowed, policy_index,
+                     [circulation.DEFAULT_POLICY] + [policy for _, policy in ordered])
+
+
+def assess(loans, now=None):
+    now = timestamps.to_micros(now or datetime.datetime.now())
+    loan_days = [policy.loan_days for policy in loans.policies]
+    per_day = [policy.per_day for policy in loans.policies]
+    max_fine = [NO_CAP if policy.max_fine is None else policy.max_fine for policy in loans.policies]
+
+    if numpy is not None:
+        index = loans.policy_index
+        days = (now - loans.borrowed) // timestamps.MICROS_PER_DAY
+        over = numpy.maximum(days - numpy.array(loan_days)[index], 0)
+        fines = numpy.minimum(over * numpy.array(per_day)[index], numpy.array(max_fine)[index])
+        return Assessment(over, fines)
+
+    over = array('q', [
+        max(0, (now - borrowed) // timestamps.MICROS_PER_DAY - loan_days[index])
+        for borrowed, index in zip(loans.borrowed, loans.policy_index)
+    ])
+    fines = array('q', [
+        min(days * per_day[index], max_fine[index])
+        for days, index in zip(over, loans.policy_index)
+    ])
+    return Assessment(over, fines)
+
+
+# returns [(user_id, total fine, overdue loans)], largest fines first
+def top_users(loans, assessment, top=TOP_USERS):
+    if numpy is not None:
+        overdue = assessment.fines > 0
+        users = loans.user_ids[overdue]
+        if not len(users):
+            return []
+        totals = numpy.bincount(users, weights=assessment.fines[overdue])
+        counts = numpy.bincount(users)
+        leaders = numpy.argsort(-totals, kind='stable')[:top]
+        return [(int(user), int(totals[user]), int(counts[user])) for user in leaders if totals[user] > 0]
+
+    totals, counts = {}, {}
+    for user, fine in zip(loans.user_ids, assessment.fines):
+        if fine > 0:
+            totals[user] = totals.get(user, 0) + fine
+            counts[user] = counts.get(user, 0) + 1
+    leaders = sorted(totals, key=lambda user: (-totals[user], user))[:top]
+    return [(user, totals[user], counts[user]) for user in leaders]
+
+
+# returns (overdue loans, total fines)
+def totals(assessment):
+    if numpy is not None:
+        return int(numpy.count_nonzero(assessment.days_overdue)), int(assessment.fines.sum())
+    return sum(1 for days in assessment.days_overdue if days), sum(assessment.fines)
+
+
+def overdue_report(now=None, top=TOP_USERS, policies=None):
+    loans = load_open_loans(policies)
+    assessment = assess(loans, now)
+    overdue, total = totals(assessment)
+    return {
+        'open_loans': len(loans.ids),
+        'overdue_loans': overdue,
+        'total_fines': total,
+        'top_users': top_users(loans, assessment, top),
+    }
+
+
+# yields (loan_id, user_id, book_id, days_overdue, fine) for overdue loans
+def overdue_loans(loans, assessment):
+    for row in zip(loans.ids, loans.user_ids, loans.book_ids, assessment.days_overdue, assessment.fines):
+        if row[3] > 0:
+            yield tuple(int(value) for value in row)
+
+
+def load_policies(path):
+    # a JSON list of {"genre": ..., "role": ..., "loan_days": ..., "per_day": ..., "max_fine": ...}
+    with open(path) as source:
+        entries = json.load(source)
+    return {
+        (entry.get('genre'), entry.get('role')):
+            circulation.Policy(entry['loan_days'], entry['per_day'], entry.get('max_fine'))
+        for entry in entries
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report overdue loans and outstanding fines.")
+    parser.add_argument('--top', type=int, default=TOP_USERS, help="users with the largest fines to list")
+    parser.add_argument('--csv', help="write every overdue loan to this CSV file")
+    parser.add_argument('--policies', help="JSON file of loan policies per genre and role")
+    parser.add_argument('--as-of', type=datetime.datetime.fromisoformat, help="compute fines at this time")
+    args = parser.parse_args()
+
+    try:
+        if args.policies:
+            circulation.POLICIES.update(load_policies(args.policies))
+        started = time.perf_counter()
+        loans = load_open_loans()
+        loaded = time.perf_counter()
+        assessment = assess(loans, args.as_of)
+        leaders = top_users(loans, assessment, args.top)
+        overdue, total = totals(assessment)
+        finished = time.perf_counter()
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+
+    print(f"Open loans: {len(loans.ids)}, overdue: {overdue}, outstanding fines: ${total} "
+          f"(loaded in {(loaded - started) * 1000:.0f} ms, computed in {(finished - loaded) * 1000:.0f} ms "
+          f"with {'NumPy' if numpy is not None else 'plain arrays'})")
+    for user_id, total, count in leaders:
+        print(f"  user {user_id}: ${total} on {count} overdue loan(s)")
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(['loan_id', 'user_id', 'book_id', 'days_overdue', 'fine'])
+            writer.writerows(overdue_loans(loans, assessment))
@@ -0,0 +1,86 @@
+import ast
+import re
+import sqlite3
+import sys
+
+from migrations import migrate
+
+# modules whose queries must be served by an index
+MODULES = ['main.py', 'circulation.py', 'pagination.py', 'search.py', 'archive.py', 'snapshot.py', 'analytics.py', 'holds.py', 'changes.py', 'accounts.py', 'storage.py', 'loans.py', 'branches.py', 'recommendations.py']
+
+STATEMENT = re.compile(r'^\s*(SELECT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+FILTERED = re.compile(r'\bWHERE\b', re.IGNORECASE)
+
+
+def _is_sql(node):
+    return (
+        isinstance(node, ast.Constant)
+        and isinstance(node.value, str)
+        and STATEMENT.match(node.value)
+    )
+
+
+# to collect the SQL passed to cursor.execute() in a module, plus queries kept
+# in module-level constants
+def extract_queries(path):
+    with open(path) as source:
+        tree = ast.parse(source.read(), filename=path)
+
+    queries = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and _is_sql(node.value):
+            queries.append((node.lineno, node.value.value))
+
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr in ('execute', 'executemany')
+            and node.args
+            and _is_sql(node.args[0])
+        ):
+            queries.append((node.lineno, node.args[0].value))
+    return queries
+
+
+def explain(connection, query):
+    parameters = (None,) * query.count('?')
+    rows = connection.execute(f'EXPLAIN QUERY PLAN {query}', parameters).fetchall()
+    return [row[3] for row in rows]
+
+
+# a plain listing without WHERE is allowed to read the whole table; anything
+# that filters has to find its rows through an index
+def find_full_scans(modules=MODULES):
+    connection = sqlite3.connect(':memory:')
+    migrate(connection)
+
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    problems = []
+    for path in modules:
+        for lineno, query in extract_queries(path):
+            if not FILTERED.search(query):
+                continue
+            for detail in explain(connection, query):
+                # full-text MATCH queries show up as a scan of the virtual
+                # table, and scanning a bounded subquery's rows is fine
+                words = detail.split()
+                if (
+                    words[0] == 'SCAN'
+                    and words[1] in tables
+                    and 'VIRTUAL TABLE' not in detail
+                ):
+                    problems.append((path, lineno, ' '.join(query.split()), detail))
+
+    connection.close()
+    return problems
+
+
+if __name__ == "__main__":
+    problems = find_full_scans(sys.argv[1:] or MODULES)
+    if problems:
+        for path, lineno, query, detail in problems:
+            print(f"{path}:{lineno}: {detail}\n    {query}")
+        sys.exit(1)
+    print("No full table scans found.")
@@ -0,0 +1,304 @@
+# "Patrons who borrowed this also borrowed", from the loan ledger.
+#
+#     python recommendations.py rebuild
+#     python recommendations.py refresh
+#     python recommendations.py run --interval 300
+#     python recommendations.py show 42
+#
+# A patron who borrowed a book is a 1 in a user x book matrix X. X^T X
+# counts, for every pair of books, how many patrons borrowed both; divided
+# by the square root of the two books' borrower counts that is their cosine
+# similarity. rebuild() computes it for the whole ledger, with NumPy when it
+# is installed (pairs become int64 keys counted by numpy.unique) and with a
+# Counter otherwise. It keeps the counts in book_borrowers and co_borrows
+# and each book's TOP_K most similar books in book_neighbors (migration 13),
+# so also_borrowed() is one primary key lookup.
+#
+# refresh() folds in only the loans since the last rebuild or refresh,
+# tracked in import_checkpoints: the counts for the new pairs go up and the
+# neighbors of the books involved are ranked again. Other books' scores with
+# them drift until the next rebuild, which a nightly job can run.
+
+import argparse
+import datetime
+import heapq
+import math
+import sqlite3
+import time
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from bulk_import import get_checkpoint
+from database import get_connection, write_transaction
+from migrations import migrate
+from timestamps import to_micros
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TOP_K = 20
+SOURCE = 'recommendations'
+REFRESH_INTERVAL = 300
+
+READ_LOANS = '''
+    SELECT DISTINCT user_id, book_id FROM transactions
+    ORDER BY user_id, book_id
+'''
+
+
+# ({book: patrons}, {(book, other): patrons}) with book < other
+def _count_python(loans):
+    borrowers = Counter()
+    pairs = Counter()
+    by_user = defaultdict(list)
+    for user_id, book_id in loans:
+        by_user[user_id].append(book_id)
+        borrowers[book_id] += 1
+    for books in by_user.values():
+        pairs.update(combinations(books, 2))
+    return borrowers, pairs
+
+
+def _count_numpy(loans):
+    table = numpy.array(loans, dtype=numpy.int64).reshape(-1, 2)
+    users, books = table[:, 0], table[:, 1]
+    borrowers = numpy.bincount(books)
+    # loans come sorted by user, then book, so each user's books are a run;
+    # pairing every loan with the one gap places later in the same run, for
+    # growing gaps, gives each pair once with book < other
+    firsts, seconds = [], []
+    for gap in range(1, len(users)):
+        same = users[:-gap] == users[gap:]
+        if not same.any():
+            break
+        firsts.append(books[:-gap][same])
+        seconds.append(books[gap:][same])
+    if not firsts:
+        return borrowers, numpy.empty(0, numpy.int64), numpy.empty(0, numpy.int64), numpy.empty(0, numpy.int64)
+    width = len(borrowers)
+    keys, counts = numpy.unique(numpy.concatenate(firsts) * width + numpy.concatenate(seconds), return_counts=True)
+    return borrowers, keys // width, keys % width, counts
+
+
+# [(book_id, rank, neighbor_id, score)]: for every book its k most similar,
+# best first, ties broken by the lower id
+def _rank_python(borrowers, pairs, k):
+    candidates = defaultdict(list)
+    for (book, other), both in pairs.items():
+        score = both / math.sqrt(borrowers[book] * borrowers[other])
+        candidates[book].append((score, other))
+        candidates[other].append((score, book))
+    return [
+        (book, rank, other, score)
+        for book, scored in candidates.items()
+        for rank, (score, other) in enumerate(heapq.nsmallest(k, scored, key=lambda item: (-item[0], item[1])))
+    ]
+
+
+def _rank_numpy(borrowers, firsts, seconds, counts, k):
+    scores = counts / numpy.sqrt(borrowers[firsts] * borrowers[seconds])
+    books = numpy.concatenate([firsts, seconds])
+    others = numpy.concatenate([seconds, firsts])
+    scores = numpy.concatenate([scores, scores])
+    order = numpy.lexsort((others, -scores, books))
+    books, others, scores = books[order], others[order], scores[order]
+    ranks = numpy.arange(len(books)) - numpy.searchsorted(books, books)
+    keep = ranks < k
+    return list(zip(books[keep].tolist(), ranks[keep].tolist(), others[keep].tolist(), scores[keep].tolist()))
+
+
+def compute(loans, k=TOP_K):
+    # (borrower rows, co-borrow rows both ways round, neighbor rows), the
+    # co-borrows in primary key order so SQLite appends to the b-tree
+    # instead of splitting pages all over it
+    if numpy is not None and loans:
+        borrowers, firsts, seconds, counts = _count_numpy(loans)
+        neighbors = _rank_numpy(borrowers, firsts, seconds, counts, k)
+        books = numpy.flatnonzero(borrowers)
+        borrower_rows = list(zip(books.tolist(), borrowers[books].tolist()))
+        books, others = numpy.concatenate([firsts, seconds]), numpy.concatenate([seconds, firsts])
+        order = numpy.lexsort((others, books))
+        pair_rows = list(zip(books[order].tolist(), others[order].tolist(), numpy.tile(counts, 2)[order].tolist()))
+    else:
+        borrowers, pairs = _count_python(loans)
+        neighbors = _rank_python(borrowers, pairs, k)
+        borrower_rows = list(borrowers.items())
+        pair_rows = sorted(
+            row for (book, other), both in pairs.items() for row in ((book, other, both), (other, book, both))
+        )
+    return borrower_rows, pair_rows, neighbors
+
+
+def _save_checkpoint(cursor, position):
+    cursor.execute('''
+        INSERT INTO import_checkpoints (source, position, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (source) DO UPDATE SET position = excluded.position, updated_at = excluded.updated_at
+    ''', (SOURCE, position, to_micros(datetime.datetime.now())))
+
+
+# recomputes everything from the ledger; returns the number of books ranked
+def rebuild(k=TOP_K):
+    # read from one snapshot, so last_id is the newest loan counted, and
+    # without holding the write lock while computing
+    with get_connection() as connection:
+        connection.execute('BEGIN')
+        try:
+            last_id = connection.execute('SELECT IFNULL(MAX(id), 0) FROM transactions').fetchone()[0]
+            loans = connection.execute(READ_LOANS).fetchall()
+        finally:
+            connection.rollback()
+
+    borrower_rows, pair_rows, neighbors = compute(loans, k)
+    with write_transaction() as cursor:
+        cursor.execute('DELETE FROM book_borrowers')
+        cursor.execute('DELETE FROM co_borrows')
+        cursor.execute('DELETE FROM book_neighbors')
+        cursor.executemany('INSERT INTO book_borrowers (book_id, users) VALUES (?, ?)', borrower_rows)
+        cursor.executemany('INSERT INTO co_borrows (book_id, other_id, users) VALUES (?, ?, ?)', pair_rows)
+        cursor.executemany(
+            'INSERT INTO book_neighbors (book_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)', neighbors,
+        )
+        _save_checkpoint(cursor, last_id)
+    return len(borrower_rows)
+
+
+def _rerank(cursor, book_id, k):
+    cursor.execute('''
+        SELECT co_borrows.other_id, co_borrows.users, book_borrowers.users
+        FROM co_borrows
+        JOIN book_borrowers ON book_borrowers.book_id = co_borrows.other_id
+        WHERE co_borrows.book_id = ?
+    ''', (book_id,))
+    pairs = cursor.fetchall()
+    cursor.execute('SELECT users FROM book_borrowers WHERE book_id = ?', (book_id,))
+    mine = cursor.fetchone()[0]
+    best = heapq.nsmallest(
+        k, ((-both / math.sqrt(mine * theirs), other) for other, both, theirs in pairs),
+    )
+    cursor.execute('DELETE FROM book_neighbors WHERE book_id = ?', (book_id,))
+    cursor.executemany(
+        'INSERT INTO book_neighbors (book_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)',
+        [(book_id, rank, other, -score) for rank, (score, other) in enumerate(best)],
+    )
+
+
+# whether other's score for book now, or book's place among its neighbors,
+# could change book's top k
+def _pair_moves_list(cursor, book_id, other_id, k):
+    cursor.execute(
+        'SELECT neighbor_id, score FROM book_neighbors WHERE book_id = ? ORDER BY rank', (book_id,),
+    )
+    neighbors = cursor.fetchall()
+    if len(neighbors) < k or any(neighbor == other_id for neighbor, _ in neighbors):
+        return True
+    cursor.execute('''
+        SELECT co_borrows.users, mine.users, theirs.users
+        FROM co_borrows
+        JOIN book_borrowers AS mine ON mine.book_id = co_borrows.book_id
+        JOIN book_borrowers AS theirs ON theirs.book_id = co_borrows.other_id
+        WHERE co_borrows.book_id = ? AND co_borrows.other_id = ?
+    ''', (book_id, other_id))
+    both, mine, theirs = cursor.fetchone()
+    return both / math.sqrt(mine * theirs) >= neighbors[-1][1]
+
+
+# folds in the loans since the last rebuild or refresh; returns how many
+def refresh(k=TOP_K):
+    with write_transaction() as cursor:
+        since = get_checkpoint(cursor, SOURCE)
+        cursor.execute('SELECT id, user_id, book_id FROM transactions WHERE id > ? ORDER BY id', (since,))
+        loans = cursor.fetchall()
+        if not loans:
+            return 0
+
+        new_books = defaultdict(list)
+        for _, user_id, book_id in loans:
+            new_books[user_id].append(book_id)
+        borrowers = Counter()
+        pairs = Counter()
+        for user_id, books in new_books.items():
+            cursor.execute(
+                'SELECT DISTINCT book_id FROM transactions WHERE user_id = ? AND id <= ?', (user_id, since),
+            )
+            seen = {row[0] for row in cursor}
+            for book_id in books:
+                # a patron borrowing a book again changes nothing
+                if book_id in seen:
+                    continue
+                borrowers[book_id] += 1
+                for other in seen:
+                    pairs[book_id, other] += 1
+                    pairs[other, book_id] += 1
+                seen.add(book_id)
+
+        cursor.executemany('''
+            INSERT INTO book_borrowers (book_id, users) VALUES (?, ?)
+            ON CONFLICT (book_id) DO UPDATE SET users = users + excluded.users
+        ''', borrowers.items())
+        cursor.executemany('''
+            INSERT INTO co_borrows (book_id, other_id, users) VALUES (?, ?, ?)
+            ON CONFLICT (book_id, other_id) DO UPDATE SET users = users + excluded.users
+        ''', [(book, other, both) for (book, other), both in pairs.items()])
+        # a book with a new borrower has all its scores changed; any other
+        # book only needs ranking again if a changed pair can move its list
+        stale = set(borrowers)
+        for book, other in pairs:
+            if book not in stale and _pair_moves_list(cursor, book, other, k):
+                stale.add(book)
+        for book_id in stale:
+            _rerank(cursor, book_id, k)
+        _save_checkpoint(cursor, loans[-1][0])
+    return len(loans)
+
+
+# [(book_id, title, author, score)], most similar first
+def also_borrowed(book_id, limit=TOP_K):
+    with get_connection() as connection:
+        return connection.execute('''
+            SELECT books.id, books.title, books.author, book_neighbors.score
+            FROM book_neighbors
+            JOIN books ON books.id = book_neighbors.neighbor_id
+            WHERE book_neighbors.book_id = ?
+            ORDER BY book_neighbors.rank
+            LIMIT ?
+        ''', (book_id, limit)).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and show book recommendations.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help="recompute from every loan").add_argument('--top', type=int, default=TOP_K)
+    commands.add_parser('refresh', help="fold in new loans").add_argument('--top', type=int, default=TOP_K)
+    run_parser = commands.add_parser('run', help="refresh every --interval seconds")
+    run_parser.add_argument('--top', type=int, default=TOP_K)
+    run_parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL)
+    show_parser = commands.add_parser('show', help="books borrowed by a book's borrowers")
+    show_parser.add_argument('book_id', type=int)
+    show_parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        with get_connection() as connection:
+            migrate(connection)
+        if args.command == 'rebuild':
+            started = time.perf_counter()
+            books = rebuild(args.top)
+            print(f"Ranked neighbors of {books} books in {time.perf_counter() - started:.2f}s "
+                  f"({'NumPy' if numpy is not None else 'plain Python'})")
+        elif args.command == 'refresh':
+            print(f"Folded in {refresh(args.top)} loans")
+        elif args.command == 'run':
+            while True:
+                refresh(args.top)
+                time.sleep(args.interval)
+        else:
+            for book_id, title, author, score in also_borrowed(args.book_id, args.limit):
+                print(f"{score:.3f}  {book_id}. {title} by {author}")
+    except sqlite3.Error as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        pass
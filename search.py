@@ -0,0 +1,151 @@
+import difflib
+import re
+
+from database import get_connection
+
+RESULT_LIMIT = 10
+
+# how many trigram candidates are re-scored when nothing matched exactly
+FUZZY_CANDIDATES = 50
+# the rarest trigrams of the text are looked up, as many as fit in this many
+# matching books; common ones like "the" would pull in most of the catalog
+FUZZY_MATCH_BUDGET = 5000
+FUZZY_CUTOFF = 0.6
+
+# title matches count most, then author, genre and ISBN
+RANKED_SEARCH = '''
+    SELECT books.id, books.title, books.author, books.isbn, books.genre, books.availability
+    FROM books_fts
+    JOIN books ON books.id = books_fts.rowid
+    WHERE books_fts MATCH ?
+    ORDER BY bm25(books_fts, 10.0, 5.0, 1.0, 2.0)
+    LIMIT ?
+'''
+
+TRIGRAM_COUNTS = '''
+    SELECT term, doc
+    FROM books_trigram_vocab
+    WHERE term = ?
+'''
+
+TRIGRAM_CANDIDATES = '''
+    SELECT books.id, books.title, books.author, books.isbn, books.genre, books.availability
+    FROM (
+        SELECT rowid, rank
+        FROM books_trigram
+        WHERE books_trigram MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ) AS matches
+    JOIN books ON books.id = matches.rowid
+    ORDER BY matches.rank
+'''
+
+# when even the rarest trigram is everywhere, ranking every match costs more
+# than it is worth; take the first matches instead
+TRIGRAM_FIRST_CANDIDATES = '''
+    SELECT books.id, books.title, books.author, books.isbn, books.genre, books.availability
+    FROM (
+        SELECT rowid
+        FROM books_trigram
+        WHERE books_trigram MATCH ?
+        LIMIT ?
+    ) AS matches
+    JOIN books ON books.id = matches.rowid
+'''
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+# every word has to appear, and the last one may be unfinished: "harry pot"
+# becomes "harry" "pot"*
+def build_match_query(text):
+    words = WORD.findall(text)
+    if not words:
+        return None
+    terms = [_quote(word) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def trigrams(text):
+    text = ' '.join(text.lower().split())
+    return sorted({text[i:i + 3] for i in range(len(text) - 2)})
+
+
+# best ratio of text against any of the candidates; the cheap upper bounds
+# skip most full comparisons
+def _best_ratio(text, candidates):
+    matcher = difflib.SequenceMatcher(None, b=text)
+    best = 0.0
+    for candidate in candidates:
+        matcher.set_seq1(candidate)
+        if matcher.real_quick_ratio() > best and matcher.quick_ratio() > best:
+            best = max(best, matcher.ratio())
+    return best
+
+
+# the better of whole-string similarity and the average best match of each
+# searched word, so "tolkein" still finds "J. R. R. Tolkien"
+def _similarity(text, book):
+    text = text.lower()
+    title, author = (book[1] or '').lower(), (book[2] or '').lower()
+    whole = _best_ratio(text, (title, author))
+
+    words = WORD.findall(text)
+    candidates = WORD.findall(f'{title} {author}')
+    if not words or not candidates:
+        return whole
+    per_word = sum(_best_ratio(word, candidates) for word in words) / len(words)
+    return max(whole, per_word)
+
+
+def ranked_search(text, limit=RESULT_LIMIT):
+    query = build_match_query(text)
+    if query is None:
+        return []
+    with get_connection() as connection:
+        return connection.execute(RANKED_SEARCH, (query, limit)).fetchall()
+
+
+# Typos break word matching, but most of a misspelled word's trigrams still
+# match. Books sharing the text's rarest trigrams are fetched from the trigram
+# index and re-scored by string similarity.
+def fuzzy_search(text, limit=RESULT_LIMIT, cutoff=FUZZY_CUTOFF):
+    grams = trigrams(text)
+    if not grams:
+        return []
+
+    with get_connection() as connection:
+        counts = []
+        for gram in grams:
+            counts.extend(connection.execute(TRIGRAM_COUNTS, (gram,)).fetchall())
+        if not counts:
+            return []
+
+        # trigrams the typo created are simply absent from the index
+        counts.sort(key=lambda item: item[1])
+        terms, matched = [], 0
+        for term, doc in counts:
+            if terms and matched + doc > FUZZY_MATCH_BUDGET:
+                break
+            terms.append(term)
+            matched += doc
+
+        query = ' OR '.join(_quote(term) for term in terms)
+        statement = TRIGRAM_CANDIDATES if matched <= FUZZY_MATCH_BUDGET else TRIGRAM_FIRST_CANDIDATES
+        candidates = connection.execute(statement, (query, FUZZY_CANDIDATES)).fetchall()
+
+    scored = [(_similarity(text, book), book) for book in candidates]
+    scored = [item for item in scored if item[0] >= cutoff]
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [book for _, book in scored[:limit]]
+
+
+# returns (id, title, author, isbn, genre, availability) rows, best first
+def search_books(text, limit=RESULT_LIMIT):
+    return ranked_search(text, limit) or fuzzy_search(text, limit)
@@ -0,0 +1,466 @@
+# HTTP/JSON service for the library operations.
+#
+#     python service.py --port 8080 --workers 5 --max-concurrent 64
+#
+# The event loop only parses requests and writes responses. Every database
+# call runs on a bounded thread pool sized like the connection pool, and a
+# semaphore caps how many requests are in flight. Past that limit, requests
+# wait up to QUEUE_TIMEOUT seconds and then get 503.
+#
+# POST /login returns a session token. Borrowing, returning, holds, adding
+# books and loan history need it as an "Authorization: Bearer <token>"
+# header and act for the session's user. Only admins may add books, and
+# GET /transactions lists every loan for admins and only their own for
+# everyone else. Uncollected holds expire on a background thread while it serves.
+# With --group-commit-ms, borrows and returns, single or batch, go through
+# one group_commit.GroupCommitWriter, which commits them in batches.
+
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+import auth
+import circulation
+import holds
+import database
+import group_commit
+import main
+import pagination
+import recommendations
+import search
+
+HOST = '127.0.0.1'
+PORT = 8080
+MAX_CONCURRENT = 64
+QUEUE_TIMEOUT = 5.0
+MAX_BODY = 64 * 1024
+MAX_BATCH = 100
+MAX_LIMIT = 500
+# SQLite integers are signed 64-bit
+MAX_INTEGER = 2 ** 63 - 1
+
+logger = logging.getLogger(__name__)
+
+# the GroupCommitWriter, when serve() was given a latency budget
+writer = None
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _require(body, *fields):
+    missing = [field for field in fields if body.get(field) in (None, '')]
+    if missing:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Missing field(s): {', '.join(missing)}")
+    return [body[field] for field in fields]
+
+
+def _int(value, name):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer") from None
+    if not -MAX_INTEGER - 1 <= number <= MAX_INTEGER:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} is out of range")
+    return number
+
+
+def _id(value, name):
+    number = _int(value, name)
+    if number < 1:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be a positive integer")
+    return number
+
+
+# like _require, for fields that must be strings
+def _text(body, *fields):
+    values = _require(body, *fields)
+    _check_text(body, *fields)
+    return values
+
+
+# optional string fields may be absent or null
+def _check_text(body, *fields):
+    wrong = [field for field in fields if body.get(field) is not None and not isinstance(body[field], str)]
+    if wrong:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Field(s) must be strings: {', '.join(wrong)}")
+
+
+def _book(row):
+    book_id, title, author, isbn, genre, availability = row
+    return {
+        'id': book_id, 'title': title, 'author': author,
+        'isbn': isbn, 'genre': genre, 'availability': availability,
+    }
+
+
+def _limit(query, default):
+    limit = _int(query.get('limit', default), 'limit')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+def _page(page_function, query, fields):
+    limit = _limit(query, pagination.PAGE_SIZE)
+    try:
+        rows, cursor = page_function(query.get('cursor'), limit)
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e)) from None
+    return {'items': [dict(zip(fields, row)) for row in rows], 'next_cursor': cursor}
+
+
+def _result(result):
+    status = {
+        circulation.BORROWED: HTTPStatus.OK,
+        circulation.RETURNED: HTTPStatus.OK,
+        circulation.NOT_FOUND: HTTPStatus.NOT_FOUND,
+        circulation.NOT_BORROWED: HTTPStatus.NOT_FOUND,
+        circulation.UNAVAILABLE: HTTPStatus.CONFLICT,
+    }[result.status]
+    return status, {'status': result.status, 'book_id': result.book_id, 'penalty': result.penalty}
+
+
+# Handlers run on the worker threads. They take the query string and the
+# JSON body as dicts and return (status, payload).
+
+def list_books(query, body):
+    return HTTPStatus.OK, _page(
+        pagination.books_page, query, ('id', 'title', 'author', 'genre', 'availability'),
+    )
+
+
+def available_books(query, body):
+    return HTTPStatus.OK, _page(pagination.available_books_page, query, ('id', 'title', 'author'))
+
+
+def find_book(query, body):
+    title, = _text(query, 'title')
+    book = main.get_book_by_title(title)
+    if book is None:
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"Book '{title}' not found.")
+    return HTTPStatus.OK, _book(book)
+
+
+def search_books(query, body):
+    text, = _text(query, 'q')
+    limit = _limit(query, search.RESULT_LIMIT)
+    return HTTPStatus.OK, {'items': [_book(row) for row in search.search_books(text, limit)]}
+
+
+def also_borrowed(query, body):
+    book_id = _id(_require(query, 'book_id')[0], 'book_id')
+    limit = _limit(query, recommendations.TOP_K)
+    return HTTPStatus.OK, {'items': [
+        {'id': other_id, 'title': title, 'author': author, 'score': score}
+        for other_id, title, author, score in recommendations.also_borrowed(book_id, limit)
+    ]}
+
+
+# a coroutine, so the password hash runs on the auth pool and doesn't hold
+# one of the database workers
+async def login_user(query, body):
+    # checked here: a number would only fail inside the hash, on the auth pool
+    email, password = _text(body, 'email', 'password')
+    session = await auth.login_async(email, password)
+    if session is None:
+        raise HTTPError(HTTPStatus.UNAUTHORIZED, "Invalid email or password.")
+    user_id, token = session
+    return HTTPStatus.OK, {'user_id': user_id, 'token': token}
+
+
+# Handlers in AUTHENTICATED only run with a valid session; dispatch puts
+# its user_id and token in the body.
+
+def logout_user(query, body):
+    auth.end_session(body['token'])
+    return HTTPStatus.OK, {}
+
+
+def _is_admin(body):
+    return auth.user_role(body['user_id']) == auth.ADMIN_ROLE
+
+
+def _require_admin(body):
+    if not _is_admin(body):
+        raise HTTPError(HTTPStatus.FORBIDDEN, "Admins only.")
+
+
+# admins see every loan, everyone else their own
+def user_transactions(query, body):
+    if _is_admin(body):
+        page_function = pagination.transactions_page
+    else:
+        page_function = functools.partial(pagination.user_transactions_page, body['user_id'])
+    return HTTPStatus.OK, _page(page_function, query, ('id', 'user', 'title', 'borrowed_at', 'returned_at'))
+
+
+def add_book(query, body):
+    _require_admin(body)
+    title, author = _text(body, 'title', 'author')
+    _check_text(body, 'isbn', 'genre')
+    availability = _int(body.get('availability', 1), 'availability')
+    book_id = main.insert_book(title, author, body.get('isbn'), body.get('genre'), availability)
+    return HTTPStatus.CREATED, {'id': book_id}
+
+
+# operation is the name of the call in both circulation and the writer
+def _circulate(operation, *args):
+    if writer is not None:
+        return getattr(writer, operation)(*args).result()
+    return getattr(circulation, operation)(*args)
+
+
+def borrow_book(query, body):
+    user_id = body['user_id']
+    if body.get('book_id') is not None:
+        return _result(_circulate('checkout', user_id, _id(body['book_id'], 'book_id')))
+    title, author = _text(body, 'title', 'author')
+    return _result(_circulate('checkout_by_title', user_id, title, author))
+
+
+def return_book(query, body):
+    user_id = body['user_id']
+    title, author = _text(body, 'title', 'author')
+    return _result(_circulate('checkin_by_title', user_id, title, author))
+
+
+def _items(body):
+    items, = _require(body, 'items')
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"items must be a list of 1 to {MAX_BATCH} book ids or ISBNs")
+    if not all(isinstance(item, (int, str)) and not isinstance(item, bool) for item in items):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "items must be book ids (numbers) or ISBNs (strings)")
+    return [item if isinstance(item, str) else _id(item, 'items') for item in items]
+
+
+# one transaction for the whole stack; 200 with a result per item
+def _batch(items, results):
+    return HTTPStatus.OK, {'items': [
+        {'item': item, 'status': result.status, 'book_id': result.book_id, 'penalty': result.penalty}
+        for item, result in zip(items, results)
+    ]}
+
+
+def borrow_books(query, body):
+    items = _items(body)
+    return _batch(items, _circulate('checkout_many', body['user_id'], items))
+
+
+def return_books(query, body):
+    items = _items(body)
+    return _batch(items, _circulate('checkin_many', body['user_id'], items))
+
+
+def place_hold(query, body):
+    book_id = _id(_require(body, 'book_id')[0], 'book_id')
+    result = holds.place_hold(body['user_id'], book_id)
+    if result.status == holds.NOT_FOUND:
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Book not found.")
+    if result.status == holds.AVAILABLE:
+        raise HTTPError(HTTPStatus.CONFLICT, "A copy is on the shelf; borrow it instead.")
+    status = HTTPStatus.CREATED if result.status == holds.PLACED else HTTPStatus.OK
+    return status, {'id': result.hold_id, 'status': result.status, 'position': result.position}
+
+
+def cancel_hold(query, body):
+    book_id = _id(_require(body, 'book_id')[0], 'book_id')
+    if not holds.cancel_hold(body['user_id'], book_id):
+        raise HTTPError(HTTPStatus.NOT_FOUND, "No open hold on this book.")
+    return HTTPStatus.OK, {}
+
+
+def user_holds(query, body):
+    return HTTPStatus.OK, {'items': [
+        {'id': hold_id, 'book_id': book_id, 'status': status, 'placed_at': placed_at, 'expires_at': expires_at}
+        for hold_id, book_id, status, placed_at, expires_at in holds.holds_for_user(body['user_id'])
+    ]}
+
+
+ROUTES = {
+    ('GET', '/books'): list_books,
+    ('GET', '/books/available'): available_books,
+    ('GET', '/books/find'): find_book,
+    ('GET', '/books/search'): search_books,
+    ('GET', '/books/also-borrowed'): also_borrowed,
+    ('POST', '/books'): add_book,
+    ('GET', '/transactions'): user_transactions,
+    ('POST', '/login'): login_user,
+    ('POST', '/logout'): logout_user,
+    ('POST', '/borrow'): borrow_book,
+    ('POST', '/return'): return_book,
+    ('POST', '/borrow/batch'): borrow_books,
+    ('POST', '/return/batch'): return_books,
+    ('GET', '/holds'): user_holds,
+    ('POST', '/holds'): place_hold,
+    ('POST', '/holds/cancel'): cancel_hold,
+}
+
+AUTHENTICATED = {
+    add_book, user_transactions, logout_user, borrow_book, return_book, borrow_books, return_books, user_holds, place_hold, cancel_hold,
+}
+
+
+def _bearer_token(headers):
+    scheme, _, token = headers.get('authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
+
+class LibraryService:
+    def __init__(self, workers=database.POOL_SIZE, max_concurrent=MAX_CONCURRENT, routes=ROUTES):
+        self.routes = routes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library-db')
+        self.limit = asyncio.Semaphore(max_concurrent)
+        self.server = None
+
+    async def dispatch(self, method, target, body, headers=None):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Method not allowed."}
+            return HTTPStatus.NOT_FOUND, {'error': "Not found."}
+
+        try:
+            query = dict(parse_qsl(url.query))
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object.")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return HTTPStatus.BAD_REQUEST, {'error': "Request body is not valid JSON."}
+        except HTTPError as e:
+            return e.status, {'error': e.message}
+
+        if handler in AUTHENTICATED:
+            token = _bearer_token(headers or {})
+            user_id = auth.session_user(token) if token else None
+            if user_id is None:
+                return HTTPStatus.UNAUTHORIZED, {'error': "Log in first."}
+            payload.update(user_id=user_id, token=token)
+
+        try:
+            await asyncio.wait_for(self.limit.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Server is busy, try again."}
+
+        try:
+            if inspect.iscoroutinefunction(handler):
+                return await handler(query, payload)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, handler, query, payload)
+        except HTTPError as e:
+            return e.status, {'error': e.message}
+        except sqlite3.Error as e:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"Error: {e}"}
+        except Exception:
+            # a bug in a handler still gets an answer, not a dropped connection
+            logger.exception("%s %s failed", method, url.path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Internal server error."}
+        finally:
+            self.limit.release()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': "Body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                keep_alive = (
+                    version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                )
+                status, payload = await self.dispatch(method, target, body, headers)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        # timestamps go out as they read in SQLite's own format
+        body = json.dumps(payload, default=str).encode()
+        head = (
+            f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def start(self, host=HOST, port=PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+
+async def serve(host, port, workers, max_concurrent, group_commit_ms=0):
+    global writer
+    if group_commit_ms > 0:
+        writer = group_commit.GroupCommitWriter(max_delay=group_commit_ms / 1000).start()
+    service = LibraryService(workers, max_concurrent)
+    port = await service.start(host, port)
+    print(f"Library service listening on http://{host}:{port}")
+    expiry = holds.ExpiryScheduler()
+    expiry.start()
+    try:
+        await service.server.serve_forever()
+    finally:
+        expiry.stop()
+        await service.close()
+        if writer is not None:
+            writer.stop()
+            writer = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the library over HTTP/JSON.")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--database', default=database.DATABASE)
+    parser.add_argument('--workers', type=int, default=database.POOL_SIZE)
+    parser.add_argument('--max-concurrent', type=int, default=MAX_CONCURRENT)
+    parser.add_argument('--group-commit-ms', type=float, default=0,
+                        help="commit borrows and returns in batches, waiting up to this long")
+    args = parser.parse_args()
+
+    # the group commit writer keeps a connection of its own
+    database.configure(args.database, size=args.workers + (args.group_commit_ms > 0))
+    main.initialize_database()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_concurrent, args.group_commit_ms))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,405 @@
+# Compact catalog snapshots for read-heavy clients such as kiosks.
+#
+#     python snapshot.py export catalog.snap
+#     python snapshot.py watch catalog.snap --interval 5
+#
+# Catalog holds the books table as columns: ids and availability in typed
+# arrays, authors and genres as indexes into tables of interned strings, and
+# titles and ISBNs as lists of str. Catalog.refresh() applies only the books
+# changed since the snapshot was taken, which the book_changes table
+# (migration 7) numbers in order.
+#
+# Catalog.write() saves the snapshot as a file of native-endian columns.
+# Kiosk processes open it with MappedCatalog, which maps the file read-only
+# and reads the columns in place through memoryviews, so every process
+# shares the one copy in the page cache and only the strings a lookup
+# returns get decoded. write() replaces the file atomically and
+# MappedCatalog.reload() switches to the new one.
+
+import argparse
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+from database import get_connection
+
+MAGIC = b'LIBSNAP1'
+BYTE_ORDER_MARK = 0x01020304
+# magic, byte order mark, books, seq
+HEADER = struct.Struct('=8sIQQ')
+SECTION = struct.Struct('=QQ')
+ALIGNMENT = 8
+
+# (name, typecode) in file order; 'B' sections of *_data hold UTF-8 text
+SECTIONS = (
+    ('ids', 'q'),
+    ('availability', 'i'),
+    ('authors', 'I'),
+    ('genres', 'I'),
+    ('flags', 'B'),
+    ('title_offsets', 'I'),
+    ('title_data', 'B'),
+    ('isbn_offsets', 'I'),
+    ('isbn_data', 'B'),
+    ('author_offsets', 'I'),
+    ('author_data', 'B'),
+    ('genre_offsets', 'I'),
+    ('genre_data', 'B'),
+    # book positions sorted by title, for find_title
+    ('title_order', 'I'),
+)
+
+# author and genre code of a NULL
+NONE = 0xFFFFFFFF
+# flags bits for NULL titles and ISBNs, which are stored as ''
+NULL_TITLE = 1
+NULL_ISBN = 2
+
+# a refresh with more changes than this share of the catalog reloads it
+REBUILD_FRACTION = 0.25
+
+BOOKS = 'SELECT id, title, author, isbn, genre, availability FROM books ORDER BY id'
+LAST_CHANGE = 'SELECT IFNULL(MAX(seq), 0) FROM book_changes'
+CHANGES = '''
+    SELECT book_changes.seq, book_changes.book_id, books.id IS NULL,
+           books.title, books.author, books.isbn, books.genre, books.availability
+    FROM book_changes
+    LEFT JOIN books ON books.id = book_changes.book_id
+    WHERE book_changes.seq > ?
+    ORDER BY book_changes.seq
+'''
+
+
+class Book:
+    __slots__ = ('id', 'title', 'author', 'isbn', 'genre', 'availability')
+
+    def __init__(self, id, title, author, isbn, genre, availability):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.genre = genre
+        self.availability = availability
+
+    # unpacks like a row of books
+    def __iter__(self):
+        return iter((self.id, self.title, self.author, self.isbn, self.genre, self.availability))
+
+    def __eq__(self, other):
+        return isinstance(other, Book) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f'Book{tuple(self)!r}'
+
+
+def _read_snapshot(connection, query, parameters=()):
+    # the books and the change number they are current up to must come
+    # from the same read transaction
+    connection.execute('BEGIN')
+    try:
+        seq = connection.execute(LAST_CHANGE).fetchone()[0]
+        yield seq
+        yield from connection.execute(query, parameters)
+    finally:
+        connection.rollback()
+
+
+class Catalog:
+    def __init__(self):
+        self.ids = array('q')
+        self.titles = []
+        self.authors = array('I')
+        self.isbns = []
+        self.genres = array('I')
+        self.availability = array('i')
+        self.author_names = []
+        self.genre_names = []
+        self._author_codes = {}
+        self._genre_codes = {}
+        # book_changes.seq this snapshot is current up to
+        self.seq = 0
+
+    @classmethod
+    def load(cls):
+        catalog = cls()
+        with get_connection() as connection:
+            rows = _read_snapshot(connection, BOOKS)
+            catalog.seq = next(rows)
+            for row in rows:
+                catalog._append(row)
+        return catalog
+
+    def _code(self, value, names, codes):
+        if value is None:
+            return NONE
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(sys.intern(value))
+        return code
+
+    def _append(self, row):
+        book_id, title, author, isbn, genre, availability = row
+        self.ids.append(book_id)
+        self.titles.append(title)
+        self.authors.append(self._code(author, self.author_names, self._author_codes))
+        self.isbns.append(isbn)
+        self.genres.append(self._code(genre, self.genre_names, self._genre_codes))
+        self.availability.append(availability or 0)
+
+    def _insert(self, position, row):
+        book_id, title, author, isbn, genre, availability = row
+        self.ids.insert(position, book_id)
+        self.titles.insert(position, title)
+        self.authors.insert(position, self._code(author, self.author_names, self._author_codes))
+        self.isbns.insert(position, isbn)
+        self.genres.insert(position, self._code(genre, self.genre_names, self._genre_codes))
+        self.availability.insert(position, availability or 0)
+
+    def _replace(self, position, row):
+        _, title, author, isbn, genre, availability = row
+        self.titles[position] = title
+        self.authors[position] = self._code(author, self.author_names, self._author_codes)
+        self.isbns[position] = isbn
+        self.genres[position] = self._code(genre, self.genre_names, self._genre_codes)
+        self.availability[position] = availability or 0
+
+    def _delete(self, position):
+        for column in (self.ids, self.titles, self.authors, self.isbns, self.genres, self.availability):
+            del column[position]
+
+    def _position(self, book_id):
+        position = bisect_left(self.ids, book_id)
+        found = position < len(self.ids) and self.ids[position] == book_id
+        return position, found
+
+    def __len__(self):
+        return len(self.ids)
+
+    def book(self, position):
+        author, genre = self.authors[position], self.genres[position]
+        return Book(
+            self.ids[position], self.titles[position],
+            None if author == NONE else self.author_names[author],
+            self.isbns[position],
+            None if genre == NONE else self.genre_names[genre],
+            self.availability[position],
+        )
+
+    def __iter__(self):
+        return (self.book(position) for position in range(len(self)))
+
+    def get(self, book_id):
+        position, found = self._position(book_id)
+        return self.book(position) if found else None
+
+    # applies the books changed since the last load or refresh; returns how
+    # many changes there were
+    def refresh(self):
+        with get_connection() as connection:
+            rows = _read_snapshot(connection, CHANGES, (self.seq,))
+            seq = next(rows)
+            changes = list(rows)
+
+        if len(changes) > REBUILD_FRACTION * max(len(self), 1):
+            fresh = Catalog.load()
+            self.__dict__.update(fresh.__dict__)
+            return len(changes)
+
+        for _, book_id, deleted, *book in changes:
+            position, found = self._position(book_id)
+            if deleted:
+                if found:
+                    self._delete(position)
+            elif found:
+                self._replace(position, (book_id, *book))
+            else:
+                self._insert(position, (book_id, *book))
+        self.seq = seq
+        return len(changes)
+
+    def write(self, path):
+        flags = array('B', [
+            (NULL_TITLE if title is None else 0) | (NULL_ISBN if isbn is None else 0)
+            for title, isbn in zip(self.titles, self.isbns)
+        ])
+        title_offsets, title_data = _pack_strings(self.titles)
+        isbn_offsets, isbn_data = _pack_strings(self.isbns)
+        author_offsets, author_data = _pack_strings(self.author_names)
+        genre_offsets, genre_data = _pack_strings(self.genre_names)
+        titles = self.titles
+        title_order = array('I', sorted(range(len(self)), key=lambda position: titles[position] or ''))
+        sections = [
+            self.ids, self.availability, self.authors, self.genres, flags,
+            title_offsets, title_data, isbn_offsets, isbn_data,
+            author_offsets, author_data, genre_offsets, genre_data, title_order,
+        ]
+
+        # write then rename, so a kiosk never maps half a file
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as output:
+            offset = _align(HEADER.size + SECTION.size * len(SECTIONS))
+            table = []
+            for section in sections:
+                length = len(section) * section.itemsize
+                table.append(SECTION.pack(offset, length))
+                offset = _align(offset + length)
+
+            output.write(HEADER.pack(MAGIC, BYTE_ORDER_MARK, len(self), self.seq))
+            output.write(b''.join(table))
+            for section in sections:
+                output.write(b'\0' * (_align(output.tell()) - output.tell()))
+                section.tofile(output)
+        os.replace(temporary, path)
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# returns (offsets, data): string i is data[offsets[i]:offsets[i + 1]]
+def _pack_strings(strings):
+    encoded = [(value or '').encode() for value in strings]
+    offsets = array('I', [0])
+    total = 0
+    for value in encoded:
+        total += len(value)
+        offsets.append(total)
+    return offsets, array('B', b''.join(encoded))
+
+
+class MappedCatalog:
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as source:
+            self._stat = os.fstat(source.fileno())
+            self._mmap = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, order, self._count, self.seq = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{self.path} is not a catalog snapshot")
+        if order != BYTE_ORDER_MARK:
+            self._mmap.close()
+            raise ValueError(f"{self.path} was written on a machine with another byte order")
+
+        view = memoryview(self._mmap)
+        self._views = [view]
+        for index, (name, typecode) in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(self._mmap, HEADER.size + SECTION.size * index)
+            section = view[offset:offset + length]
+            column = section.cast(typecode)
+            self._views += [section, column]
+            setattr(self, name, column)
+
+        # small tables, decoded once
+        self.author_names = [self._string(self.author_offsets, self.author_data, i)
+                             for i in range(len(self.author_offsets) - 1)]
+        self.genre_names = [self._string(self.genre_offsets, self.genre_data, i)
+                            for i in range(len(self.genre_offsets) - 1)]
+
+    def close(self):
+        # every view into the map has to go before the map itself
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    # switches to a newer file written at the same path; returns True if
+    # there was one
+    def reload(self):
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime_ns) == (self._stat.st_ino, self._stat.st_mtime_ns):
+            return False
+        self.close()
+        self._open()
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _string(offsets, data, index):
+        return str(data[offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def _title_bytes(self, position):
+        return bytes(self.title_data[self.title_offsets[position]:self.title_offsets[position + 1]])
+
+    def __len__(self):
+        return self._count
+
+    def book(self, position):
+        flags = self.flags[position]
+        author, genre = self.authors[position], self.genres[position]
+        return Book(
+            self.ids[position],
+            None if flags & NULL_TITLE else self._string(self.title_offsets, self.title_data, position),
+            None if author == NONE else self.author_names[author],
+            None if flags & NULL_ISBN else self._string(self.isbn_offsets, self.isbn_data, position),
+            None if genre == NONE else self.genre_names[genre],
+            self.availability[position],
+        )
+
+    def __iter__(self):
+        return (self.book(position) for position in range(len(self)))
+
+    def get(self, book_id):
+        position = bisect_left(self.ids, book_id)
+        if position < len(self) and self.ids[position] == book_id:
+            return self.book(position)
+        return None
+
+    def find_title(self, title):
+        target = title.encode()
+        order = self.title_order
+        start = bisect_left(order, target, key=self._title_bytes)
+        books = []
+        for position in order[start:]:
+            if self._title_bytes(position) != target:
+                break
+            books.append(self.book(position))
+        return books
+
+
+def watch(path, interval):
+    catalog = Catalog.load()
+    catalog.write(path)
+    print(f"Wrote {len(catalog)} books to {path}")
+    while True:
+        time.sleep(interval)
+        changes = catalog.refresh()
+        if changes:
+            catalog.write(path)
+            print(f"Applied {changes} change(s), {len(catalog)} books")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the catalog as a memory-mappable snapshot.")
+    parser.add_argument('command', choices=('export', 'watch'))
+    parser.add_argument('path')
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between refreshes for watch")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            catalog = Catalog.load()
+            catalog.write(args.path)
+            print(f"Wrote {len(catalog)} books to {args.path}")
+        else:
+            watch(args.path, args.interval)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        pass
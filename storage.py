@@ -0,0 +1,419 @@
+# Storage engines behind one interface for users, books and loans.
+#
+#     engine = storage.configure('memory')        # or 'sqlite:library.db', 'dict'
+#     book_id = engine.add_book('Dune', 'Frank Herbert', '9780441013593', 'Fiction', 2)
+#     engine.checkout(user_id, book_id)
+#
+# Three engines share the methods below:
+#
+#   SQLiteEngine.file(path)    the library database on disk
+#   SQLiteEngine.memory(name)  the same schema in a shared-cache in-memory
+#                              database, kept alive until close()
+#   DictEngine()               plain dicts with their own indexes; the
+#                              fastest, but has none of the triggers, so no
+#                              holds, reports, change log or snapshots
+#
+# The SQLite engines run the same statements as circulation.py. Each has a
+# pool of its own; configure() (and get_engine()) also make it database.py's
+# pool, so main.py and the other modules use the same store. The process
+# caches hold rows of the library database only, so an engine invalidates
+# them only when its pool is on that database. Which engine get_engine()
+# returns is set by configure() or LIBRARY_STORAGE.
+# `python conformance.py` checks that every engine behaves the same.
+#
+# Errors are sqlite3 errors in every engine (a repeated email raises
+# sqlite3.IntegrityError), so callers keep a single except clause.
+#
+#   add_user(name, email, password, role) -> id
+#   user_by_email(email) -> User or None
+#   delete_user(user_id) -> bool
+#   add_book(title, author, isbn, genre, availability) -> id
+#   book(book_id) -> snapshot.Book or None
+#   find_books(title, author=None) -> [Book]
+#   books_by_isbn(isbn) -> [Book]
+#   update_book(book_id, **columns) -> bool
+#   delete_book(book_id) -> bool
+#   books_page(after_id=0, limit=PAGE_SIZE) -> [Book], by id
+#   checkout(user_id, book_id, now=None) -> circulation.Result
+#   checkin(user_id, book_id, now=None) -> circulation.Result
+#   open_loans(user_id) -> [Loan], oldest first
+#   close()
+
+import bisect
+import datetime
+import itertools
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+import cache
+import circulation
+import database
+from migrations import migrate
+from pagination import PAGE_SIZE
+from snapshot import Book
+
+User = namedtuple('User', 'id name email password role')
+Loan = namedtuple('Loan', 'id user_id book_id borrowed_at returned_at')
+
+BOOK_COLUMNS = ('title', 'author', 'isbn', 'genre', 'availability')
+
+
+def _check_columns(columns):
+    unknown = set(columns) - set(BOOK_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown book columns: {', '.join(sorted(unknown))}")
+
+
+class SQLiteEngine:
+    def __init__(self, pool):
+        self.pool = pool
+        self._keeper = None
+        with pool.connection() as connection:
+            migrate(connection)
+
+    @classmethod
+    def file(cls, path=database.DATABASE, size=database.POOL_SIZE):
+        return cls(database.ConnectionPool(path, size))
+
+    # Shared cache lets every pooled connection see the one in-memory
+    # database; it locks per table, so writers take turns.
+    @classmethod
+    def memory(cls, name='library', size=database.POOL_SIZE):
+        uri = f'file:{name}?mode=memory&cache=shared'
+        # the database lasts as long as some connection has it open
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        engine = cls(database.ConnectionPool(uri, size))
+        engine._keeper = keeper
+        return engine
+
+    # branch shards and other databases of their own share no cache
+    # entries with the library database
+    @property
+    def _cached(self):
+        return self.pool.database == database.get_pool().database
+
+    def _invalidate_book(self, book_id=None, title=None, author=None):
+        if self._cached:
+            cache.invalidate_book(book_id, title, author)
+
+    def _read(self, sql, parameters=()):
+        with self.pool.connection() as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    def _write(self, sql, parameters=()):
+        with self.pool.connection() as connection:
+            cursor = connection.execute(sql, parameters)
+            rows = cursor.fetchall()
+            connection.commit()
+            return rows
+
+    def _circulate(self, operation, user_id, book_id, now):
+        with database.write_transaction(self.pool) as cursor:
+            result = operation(cursor, user_id, book_id, now or datetime.datetime.now())
+        if result.status in (circulation.BORROWED, circulation.RETURNED):
+            self._invalidate_book(result.book_id)
+        return result
+
+    def add_user(self, name, email, password, role):
+        rows = self._write('''
+            INSERT INTO users (name, email, password, role)
+            VALUES (?, ?, ?, ?)
+            RETURNING id
+        ''', (name, email, password, role))
+        if self._cached:
+            cache.invalidate_user(email)
+        return rows[0][0]
+
+    def user_by_email(self, email):
+        rows = self._read('SELECT id, name, email, password, role FROM users WHERE email = ?', (email,))
+        return User(*rows[0]) if rows else None
+
+    def delete_user(self, user_id):
+        rows = self._write('DELETE FROM users WHERE id = ? RETURNING email', (user_id,))
+        if self._cached:
+            for email, in rows:
+                cache.invalidate_user(email)
+        return bool(rows)
+
+    def add_book(self, title, author, isbn, genre, availability):
+        rows = self._write('''
+            INSERT INTO books (title, author, isbn, genre, availability)
+            VALUES (?, ?, ?, ?, ?)
+            RETURNING id
+        ''', (title, author, isbn, genre, availability))
+        self._invalidate_book(title=title, author=author)
+        return rows[0][0]
+
+    def book(self, book_id):
+        rows = self._read(
+            'SELECT id, title, author, isbn, genre, availability FROM books WHERE id = ?', (book_id,),
+        )
+        return Book(*rows[0]) if rows else None
+
+    def find_books(self, title, author=None):
+        if author is None:
+            rows = self._read('''
+                SELECT id, title, author, isbn, genre, availability
+                FROM books WHERE title = ? ORDER BY id
+            ''', (title,))
+        else:
+            rows = self._read('''
+                SELECT id, title, author, isbn, genre, availability
+                FROM books WHERE title = ? AND author = ? ORDER BY id
+            ''', (title, author))
+        return [Book(*row) for row in rows]
+
+    def books_by_isbn(self, isbn):
+        rows = self._read('''
+            SELECT id, title, author, isbn, genre, availability
+            FROM books WHERE isbn = ? ORDER BY id
+        ''', (isbn,))
+        return [Book(*row) for row in rows]
+
+    def update_book(self, book_id, **columns):
+        _check_columns(columns)
+        if not columns:
+            return self.book(book_id) is not None
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        rows = self._write(
+            f'UPDATE books SET {assignments} WHERE id = ? RETURNING id', (*columns.values(), book_id),
+        )
+        if self._cached:
+            cache.invalidate_all_books()
+        return bool(rows)
+
+    def delete_book(self, book_id):
+        rows = self._write('DELETE FROM books WHERE id = ? RETURNING title, author', (book_id,))
+        for title, author in rows:
+            self._invalidate_book(book_id, title, author)
+        return bool(rows)
+
+    def books_page(self, after_id=0, limit=PAGE_SIZE):
+        rows = self._read('''
+            SELECT id, title, author, isbn, genre, availability
+            FROM books WHERE id > ? ORDER BY id LIMIT ?
+        ''', (after_id, limit))
+        return [Book(*row) for row in rows]
+
+    def checkout(self, user_id, book_id, now=None):
+        return self._circulate(circulation._checkout, user_id, book_id, now)
+
+    def checkin(self, user_id, book_id, now=None):
+        return self._circulate(circulation._checkin, user_id, book_id, now)
+
+    def open_loans(self, user_id):
+        rows = self._read('''
+            SELECT id, user_id, book_id, borrowed_at, returned_at
+            FROM transactions
+            WHERE user_id = ? AND returned_at IS NULL
+            ORDER BY id
+        ''', (user_id,))
+        return [Loan(*row) for row in rows]
+
+    def close(self):
+        if self.pool is database.get_pool():
+            database.close_pool()
+        else:
+            self.pool.close()
+        if self._keeper is not None:
+            self._keeper.close()
+            self._keeper = None
+
+
+class DictEngine:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._book_counter = itertools.count(1)
+        self._users = {}
+        self._user_ids = {}  # email -> id
+        self._books = {}
+        self._book_ids = []  # ascending, for pages
+        # title -> author -> {book id: None}, dicts keeping insertion order
+        self._titles = {}
+        self._isbns = {}  # isbn -> {book id: None}
+        self._loans = {}
+        self._open = {}  # user id -> {loan id: None}
+        self._user_counter = itertools.count(1)
+        self._loan_counter = itertools.count(1)
+
+    # Every method holds the lock, so one engine can be shared by threads
+    # the way the SQLite engines are.
+
+    def add_user(self, name, email, password, role):
+        with self._lock:
+            if email in self._user_ids:
+                raise sqlite3.IntegrityError("UNIQUE constraint failed: users.email")
+            user = User(next(self._user_counter), name, email, password, role)
+            self._users[user.id] = user
+            self._user_ids[email] = user.id
+            return user.id
+
+    def user_by_email(self, email):
+        with self._lock:
+            user_id = self._user_ids.get(email)
+            return None if user_id is None else self._users[user_id]
+
+    def delete_user(self, user_id):
+        with self._lock:
+            user = self._users.pop(user_id, None)
+            if user is None:
+                return False
+            del self._user_ids[user.email]
+            return True
+
+    def _index(self, book):
+        self._titles.setdefault(book.title, {}).setdefault(book.author, {})[book.id] = None
+        self._isbns.setdefault(book.isbn, {})[book.id] = None
+
+    def _unindex(self, book):
+        authors = self._titles[book.title]
+        del authors[book.author][book.id]
+        if not authors[book.author]:
+            del authors[book.author]
+            if not authors:
+                del self._titles[book.title]
+        del self._isbns[book.isbn][book.id]
+        if not self._isbns[book.isbn]:
+            del self._isbns[book.isbn]
+
+    def add_book(self, title, author, isbn, genre, availability):
+        with self._lock:
+            book = Book(next(self._book_counter), title, author, isbn, genre, availability)
+            self._books[book.id] = book
+            self._book_ids.append(book.id)
+            self._index(book)
+            return book.id
+
+    # copies, so callers can't change the stored books
+    def book(self, book_id):
+        with self._lock:
+            book = self._books.get(book_id)
+            return None if book is None else Book(*book)
+
+    def find_books(self, title, author=None):
+        with self._lock:
+            authors = self._titles.get(title, {})
+            if author is not None:
+                ids = list(authors.get(author, ()))
+            else:
+                ids = sorted(book_id for books in authors.values() for book_id in books)
+            return [Book(*self._books[book_id]) for book_id in ids]
+
+    def books_by_isbn(self, isbn):
+        with self._lock:
+            return [Book(*self._books[book_id]) for book_id in self._isbns.get(isbn, ())]
+
+    def update_book(self, book_id, **columns):
+        _check_columns(columns)
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is None:
+                return False
+            self._unindex(book)
+            for column, value in columns.items():
+                setattr(book, column, value)
+            self._index(book)
+            return True
+
+    def delete_book(self, book_id):
+        with self._lock:
+            book = self._books.pop(book_id, None)
+            if book is None:
+                return False
+            self._unindex(book)
+            del self._book_ids[bisect.bisect_left(self._book_ids, book_id)]
+            return True
+
+    def books_page(self, after_id=0, limit=PAGE_SIZE):
+        with self._lock:
+            start = bisect.bisect_right(self._book_ids, after_id)
+            return [Book(*self._books[book_id]) for book_id in self._book_ids[start:start + limit]]
+
+    def checkout(self, user_id, book_id, now=None):
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is None:
+                return circulation.Result(circulation.NOT_FOUND, book_id, 0)
+            if (book.availability or 0) <= 0:
+                return circulation.Result(circulation.UNAVAILABLE, book_id, 0)
+            book.availability -= 1
+            loan = Loan(next(self._loan_counter), user_id, book_id, now or datetime.datetime.now(), None)
+            self._loans[loan.id] = loan
+            self._open.setdefault(user_id, {})[loan.id] = None
+            return circulation.Result(circulation.BORROWED, book_id, 0)
+
+    def checkin(self, user_id, book_id, now=None):
+        now = now or datetime.datetime.now()
+        with self._lock:
+            loans = self._open.get(user_id, {})
+            # the oldest open loan of the book, as in circulation._checkin
+            loan_id = next((loan_id for loan_id in loans if self._loans[loan_id].book_id == book_id), None)
+            if loan_id is None:
+                return circulation.Result(circulation.NOT_BORROWED, None, 0)
+            del loans[loan_id]
+            loan = self._loans[loan_id] = self._loans[loan_id]._replace(returned_at=now)
+
+            book = self._books.get(book_id)
+            if book is not None:
+                book.availability = (book.availability or 0) + 1
+            policy = circulation.DEFAULT_POLICY
+            if circulation.POLICIES:
+                user = self._users.get(user_id)
+                policy = circulation.policy_for(book.genre if book else None, user.role if user else None)
+            return circulation.Result(
+                circulation.RETURNED, book_id, circulation.calculate_penalty(loan.borrowed_at, now, policy),
+            )
+
+    def open_loans(self, user_id):
+        with self._lock:
+            return [self._loans[loan_id] for loan_id in self._open.get(user_id, ())]
+
+    def close(self):
+        pass
+
+
+ENGINES = ('sqlite', 'memory', 'dict')
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# 'sqlite' (database.DATABASE), 'sqlite:path', 'memory', 'memory:name' or
+# 'dict'
+def open_engine(spec):
+    kind, _, argument = spec.partition(':')
+    if kind == 'sqlite':
+        return SQLiteEngine.file(argument or database.DATABASE)
+    if kind == 'memory':
+        return SQLiteEngine.memory(argument or 'library')
+    if kind == 'dict':
+        return DictEngine()
+    raise ValueError(f"Unknown storage engine {spec!r}, expected one of {', '.join(ENGINES)}")
+
+
+# the library pool becomes the engine's, for main.py and the other modules
+def _use(engine):
+    if isinstance(engine, SQLiteEngine):
+        database.use_pool(engine.pool)
+    return engine
+
+
+def configure(spec):
+    global _engine
+    engine = _use(open_engine(spec))
+    with _engine_lock:
+        previous, _engine = _engine, engine
+    if previous is not None and previous is not engine:
+        previous.close()
+    return engine
+
+
+def get_engine(environ=os.environ):
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _use(open_engine(environ.get('LIBRARY_STORAGE', 'sqlite')))
+    return _engine
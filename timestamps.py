@@ -0,0 +1,90 @@
+# Timestamps stored as integer microseconds since the Unix epoch.
+#
+# Datetime parameters are converted where they are bound, with
+# to_micros(moment); no adapter is registered, so other sqlite3 users in
+# the process keep their own. Importing this module (database.py does)
+# registers converters that turn DATETIME columns back into datetimes on
+# connections opened with detect_types=sqlite3.PARSE_DECLTYPES, as the
+# pool's are. SQLite compares and indexes plain integers. Naive datetimes
+# are local time, as datetime.now() returns them.
+#
+# In SQL, borrowed_at / 1000000 is Unix seconds, so
+# date(borrowed_at / 1000000, 'unixepoch', 'localtime') is the local day.
+
+import datetime
+import sqlite3
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+LOCAL_EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+MICROS_PER_SECOND = 1_000_000
+MICROS_PER_DAY = 86400 * MICROS_PER_SECOND
+MICROS_PER_QUARTER_HOUR = 900_000_000
+
+# the same in SQL, for triggers and column defaults; 'now' has millisecond
+# resolution there
+NOW_MICROS_SQL = (
+    "(CAST(strftime('%s', 'now') AS INTEGER) * 1000000"
+    " + CAST(substr(strftime('%f', 'now'), 4) AS INTEGER) * 1000)"
+)
+
+
+# Asking the time zone database for every row costs more than the rest of
+# the conversion. Offsets only change on a quarter hour in every zone, so
+# they are kept per quarter hour, of UTC one way and of local wall-clock
+# time the other.
+_utc_offsets = {}
+_local_offsets = {}
+
+
+def _offset(offsets, epoch, quarter):
+    try:
+        return offsets[quarter]
+    except KeyError:
+        moment = epoch + datetime.timedelta(microseconds=quarter * MICROS_PER_QUARTER_HOUR)
+        offset = offsets[quarter] = moment.astimezone().utcoffset() // MICROSECOND
+        return offset
+
+
+def to_micros(moment):
+    if moment is None:
+        return None
+    if moment.tzinfo is not None:
+        return (moment - EPOCH) // MICROSECOND
+    micros = (moment - LOCAL_EPOCH) // MICROSECOND
+    return micros - _offset(_local_offsets, LOCAL_EPOCH, micros // MICROS_PER_QUARTER_HOUR)
+
+
+# a naive local datetime
+def from_micros(micros):
+    offset = _offset(_utc_offsets, EPOCH, micros // MICROS_PER_QUARTER_HOUR)
+    return LOCAL_EPOCH + datetime.timedelta(microseconds=micros + offset)
+
+
+# Text timestamps from before migration 11, with or without microseconds;
+# the migration converts them with this. Empty text becomes NULL.
+def text_to_micros(text):
+    if text is None or isinstance(text, int):
+        return text
+    if not text.strip():
+        return None
+    return to_micros(datetime.datetime.fromisoformat(text))
+
+
+def convert_datetime(value):
+    try:
+        return from_micros(int(value))
+    except ValueError:
+        # an archive file or a row written before migration 11
+        text = value.decode().strip()
+        return datetime.datetime.fromisoformat(text) if text else None
+
+
+def convert_date(value):
+    text = value.decode().strip()
+    return datetime.date.fromisoformat(text) if text else None
+
+
+sqlite3.register_converter('DATETIME', convert_datetime)
+# replaces sqlite3's own DATE converter, deprecated since Python 3.12
+sqlite3.register_converter('DATE', convert_date)